@@ -1,17 +1,66 @@
 import os
 import sys
+import time
+from collections import OrderedDict
 
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(parent_dir)
 from util.config_manager import Config
+from util.database_manager import Database, DatabaseUnavailableError
+from util.blacklist_matcher import BlacklistMatcher
 
-from interactions import listen, Extension
+from interactions import listen, Extension, InteractionContext, OptionType, Permissions, slash_command, slash_option
 from interactions.api.events import MessageCreate, MessageUpdate
 
 """
 A class representing an extension of the bot. This extention contains the functionality for the blacklist provided by the bot.
+
+Every server has its own blacklist stored in the bot database, which is combined with the global blacklist specified in the config.
+A compiled matcher is built for a server the first time one of its messages is checked, and is evicted again once the server has been idle for a while.
 """
 class BlacklistExtension(Extension):
+    matcher = None
+
+    guild_matchers = OrderedDict()
+
+    # The settings of the per-server matcher cache, which are only worked out again after the config changes since they are used for every message.
+    cache_settings = None
+
+    """
+    Creates the blacklist extension and subscribes it to config changes, so the compiled blacklist is rebuilt when the blacklist in the config changes.
+
+    @param bot The client the bot is running on.
+    """
+    def __init__(self, bot):
+        # The config may have changed while the extension wasn't loaded, so the cache settings are worked out again when they are next needed.
+        BlacklistExtension.cache_settings = None
+        Config.subscribe(BlacklistExtension.on_config_changed)
+
+    """
+    Unsubscribes from config changes when the extension is unloaded.
+    """
+    def drop(self):
+        Config.unsubscribe(BlacklistExtension.on_config_changed)
+        super().drop()
+
+    """
+    Config subscriber which discards the compiled blacklists when the blacklist in the config changes. They are rebuilt when they are next needed.
+    The settings of the per-server matcher cache are worked out again when they change.
+
+    @param old_config The old config.
+    @param new_config The new config.
+    """
+    @staticmethod
+    def on_config_changed(old_config: dict, new_config: dict):
+        if (Config.changed(old_config, new_config, "blacklist_guild_cache_size", "blacklist_guild_idle_timeout")):
+            BlacklistExtension.cache_settings = BlacklistExtension.load_cache_settings(new_config)
+
+        if (Config.changed(old_config, new_config, "blacklist")):
+            BlacklistExtension.matcher = None
+
+            # Every server's matcher includes the global blacklist, so they all need to be rebuilt as well.
+            BlacklistExtension.guild_matchers.clear()
+
     """
     MessageCreate event listener.
     This is a callback function that is called when a MessageCreate event is triggered.
@@ -21,9 +70,11 @@ class BlacklistExtension(Extension):
     """
     @listen(MessageCreate)
     async def on_message_create(self, event: MessageCreate):
-        if (self.message_contains_blacklisted_word(event.message.content)):
+        # Messages that weren't sent in a server, such as direct messages, are not checked.
+        guild = event.message.guild
+        if (guild is not None and await self.message_contains_blacklisted_word(event.message.content, guild.id)):
             await event.message.delete()
-    
+
     """
     MessageUpdate event listener.
     This is a callback function that is called when a MessageUpdate event is triggered.
@@ -33,26 +84,264 @@ class BlacklistExtension(Extension):
     """
     @listen(MessageUpdate)
     async def on_message_update(self, event: MessageUpdate):
-        if (self.message_contains_blacklisted_word(event.after.content)):
+        # Messages that weren't sent in a server, such as direct messages, are not checked.
+        guild = event.after.guild
+        if (guild is not None and await self.message_contains_blacklisted_word(event.after.content, guild.id)):
             await event.after.delete()
-    
+
+    """
+    Blacklist Add Command.
+    Adds a word to the blacklist of the current server. This command can only be used by server administrators or the owner of the bot.
+    This is function is registered as a slash command using interactions.py and it automatically called when the command is invoked by a Discord user.
+
+    @param context The context for which this command was invoked.
+    @param word The word to blacklist.
+    """
+    @slash_command(
+        name="blacklist_add",
+        description="Adds a word to this server's blacklist. Only server administrators can use this command",
+        dm_permission=False
+    )
+    @slash_option(
+        name="word",
+        description="The word to blacklist",
+        required=True,
+        opt_type=OptionType.STRING
+    )
+    async def blacklist_add(self, context: InteractionContext, word: str):
+        # Check if the user invoking this command is allowed to manage the blacklist.
+        if (not BlacklistExtension.can_manage_blacklist(context)):
+            await context.send("Only server administrators can manage the blacklist!", ephemeral=True)
+            return
+
+        try:
+            # Add the word to the blacklist of this server. The primary key makes this a no-op if the word is already blacklisted.
+            added = await Database.execute("INSERT OR IGNORE INTO blacklist(guildID, word) VALUES (?, ?)", (str(context.guild_id), word,))
+            BlacklistExtension.invalidate_guild(str(context.guild_id))
+
+            if (added):
+                await context.send(f"Added `{word}` to the blacklist for this server.", ephemeral=True)
+            else:
+                await context.send(f"`{word}` is already blacklisted in this server!", ephemeral=True)
+        except DatabaseUnavailableError:
+            # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
+            await context.send("Unable to access bot database!", ephemeral=True)
+
+    """
+    Blacklist Remove Command.
+    Removes a word from the blacklist of the current server. This command can only be used by server administrators or the owner of the bot.
+    This is function is registered as a slash command using interactions.py and it automatically called when the command is invoked by a Discord user.
+
+    @param context The context for which this command was invoked.
+    @param word The word to remove from the blacklist.
+    """
+    @slash_command(
+        name="blacklist_remove",
+        description="Removes a word from this server's blacklist. Only server administrators can use this command",
+        dm_permission=False
+    )
+    @slash_option(
+        name="word",
+        description="The word to remove from the blacklist",
+        required=True,
+        opt_type=OptionType.STRING
+    )
+    async def blacklist_remove(self, context: InteractionContext, word: str):
+        # Check if the user invoking this command is allowed to manage the blacklist.
+        if (not BlacklistExtension.can_manage_blacklist(context)):
+            await context.send("Only server administrators can manage the blacklist!", ephemeral=True)
+            return
+
+        try:
+            # Remove the word from the blacklist of this server.
+            removed = await Database.execute("DELETE FROM blacklist WHERE guildID = ? AND word = ?", (str(context.guild_id), word,))
+            BlacklistExtension.invalidate_guild(str(context.guild_id))
+
+            if (removed):
+                await context.send(f"Removed `{word}` from the blacklist for this server.", ephemeral=True)
+            else:
+                await context.send(f"`{word}` is not blacklisted in this server!", ephemeral=True)
+        except DatabaseUnavailableError:
+            # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
+            await context.send("Unable to access bot database!", ephemeral=True)
+
+    """
+    Blacklist List Command.
+    Displays the blacklist of the current server to the user who invoked this command. This command can only be used by server administrators or the owner of the bot.
+    This is function is registered as a slash command using interactions.py and it automatically called when the command is invoked by a Discord user.
+
+    @param context The context for which this command was invoked.
+    """
+    @slash_command(
+        name="blacklist_list",
+        description="Displays this server's blacklist. Only server administrators can use this command",
+        dm_permission=False
+    )
+    async def blacklist_list(self, context: InteractionContext):
+        # Check if the user invoking this command is allowed to manage the blacklist.
+        if (not BlacklistExtension.can_manage_blacklist(context)):
+            await context.send("Only server administrators can manage the blacklist!", ephemeral=True)
+            return
+
+        try:
+            # Get the blacklist of this server.
+            words = await BlacklistExtension.fetch_guild_words(str(context.guild_id))
+
+            if (not words):
+                await context.send("This server's blacklist is empty.", ephemeral=True)
+                return
+
+            # List the words, stopping before the message would become longer than Discord allows.
+            message = "Blacklisted words for this server:\n"
+            for word in words:
+                line = f"`{word}`\n"
+                if (len(message) + len(line) > 1900):
+                    message += "..."
+                    break
+                message += line
+
+            await context.send(message, ephemeral=True)
+        except DatabaseUnavailableError:
+            # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
+            await context.send("Unable to access bot database!", ephemeral=True)
+
+    """
+    Checks if the user who invoked a command is allowed to manage the blacklist of the current server.
+
+    @param context The context for which the command was invoked.
+    @return True if the user is the owner of the bot or an administrator of the server, False if not.
+    """
+    @staticmethod
+    def can_manage_blacklist(context: InteractionContext):
+        if (Config.get_config()["owner_id"] == str(context.author_id)):
+            return True
+
+        return context.member is not None and context.member.has_permission(Permissions.ADMINISTRATOR)
+
+    """
+    Returns the blacklisted words of a server from the bot database.
+
+    @param guild_id The guild ID of the server.
+    @return A list of the blacklisted words of the server.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def fetch_guild_words(guild_id: str):
+        rows = await Database.fetch_all("SELECT word FROM blacklist WHERE guildID = ? ORDER BY word", (guild_id,))
+        return [row[0] for row in rows]
+
+    """
+    Returns the settings of the per-server matcher cache, as specified in the config.json file.
+
+    @return A tuple containing the maximum amount of cached matchers and the amount of seconds a server can be idle before its matcher is evicted.
+    """
+    @staticmethod
+    def get_cache_settings():
+        cache_settings = BlacklistExtension.cache_settings
+        if (cache_settings is None):
+            cache_settings = BlacklistExtension.load_cache_settings(Config.get_config())
+            BlacklistExtension.cache_settings = cache_settings
+        return cache_settings
+
+    """
+    Works out the settings of the per-server matcher cache from a config.
+
+    @param config The config to read the settings from.
+    @return A tuple containing the maximum amount of cached matchers and the amount of seconds a server can be idle before its matcher is evicted.
+    """
+    @staticmethod
+    def load_cache_settings(config: dict):
+        return (max(0, config.get("blacklist_guild_cache_size", 256)), max(0, config.get("blacklist_guild_idle_timeout", 3600)))
+
+    """
+    Returns the compiled matcher for the blacklist specified in the config.
+    The matcher is built the first time it is needed, and is only rebuilt after the blacklist in the config has changed.
+
+    @return The BlacklistMatcher for the current blacklist.
+    """
+    @staticmethod
+    def get_matcher():
+        matcher = BlacklistExtension.matcher
+        if (matcher is None):
+            matcher = BlacklistMatcher(Config.get_config()["blacklist"])
+            BlacklistExtension.matcher = matcher
+
+        return matcher
+
+    """
+    Returns the compiled matcher for a server, which matches both the global blacklist and the server's own blacklist.
+    The matcher is built the first time it is needed, and matchers for servers that have been idle for too long are evicted.
+
+    @param guild_id The guild ID of the server, or None for messages that weren't sent in a server.
+    @return The BlacklistMatcher for the server.
+    """
+    @staticmethod
+    async def get_guild_matcher(guild_id: str):
+        global_matcher = BlacklistExtension.get_matcher()
+        if (guild_id is None):
+            return global_matcher
+
+        now = time.monotonic()
+        guild_matchers = BlacklistExtension.guild_matchers
+        cache_size, idle_timeout = BlacklistExtension.get_cache_settings()
+
+        # Evict the matchers of servers which haven't had a message checked in a while. The least recently used matchers are at the front.
+        while (guild_matchers):
+            oldest_guild_id, (_, last_used) = next(iter(guild_matchers.items()))
+            if (now - last_used <= idle_timeout):
+                break
+            del guild_matchers[oldest_guild_id]
+
+        # Use the cached matcher for this server if there is one.
+        cached = guild_matchers.get(guild_id)
+        if (cached is not None):
+            guild_matchers[guild_id] = (cached[0], now)
+            guild_matchers.move_to_end(guild_id)
+            return cached[0]
+
+        try:
+            words = await BlacklistExtension.fetch_guild_words(guild_id)
+        except DatabaseUnavailableError:
+            # If we can't read this server's blacklist we will fall back to the global blacklist without caching it.
+            return global_matcher
+
+        # Servers without a blacklist of their own can share the global matcher.
+        if (words):
+            matcher = BlacklistMatcher(list(Config.get_config()["blacklist"]) + words)
+        else:
+            matcher = global_matcher
+
+        # Don't cache the matcher if the global blacklist changed while the server's blacklist was being read.
+        if (global_matcher is BlacklistExtension.matcher and cache_size > 0):
+            guild_matchers[guild_id] = (matcher, now)
+            while (len(guild_matchers) > cache_size):
+                guild_matchers.popitem(last=False)
+
+        return matcher
+
+    """
+    Removes the cached matcher of a server, so it is rebuilt with the server's current blacklist the next time it is needed.
+
+    @param guild_id The guild ID of the server.
+    """
+    @staticmethod
+    def invalidate_guild(guild_id: str):
+        BlacklistExtension.guild_matchers.pop(guild_id, None)
+
     """
     Determines if a message contains a blacklisted word.
-    Checks if any of the blacklisted words, specified in the config, are present in the message. Returns True if any are present, False if not.
+    Checks if any of the blacklisted words, specified in the config or in the blacklist of the server the message was sent in, are present in the message.
+    Returns True if any are present, False if not.
 
     @param message The contents of the message.
+    @param guild_id The guild ID of the server the message was sent in, or None if it wasn't sent in a server.
     @return True if the message contains any blacklisted words, Flase if not.
     """
     @staticmethod
-    def message_contains_blacklisted_word(message: str):
-        # Get the blacklist from the config.
-        blacklist = Config.get_config()["blacklist"]
+    async def message_contains_blacklisted_word(message: str, guild_id = None):
+        # Messages without any text can't contain a blacklisted word, so there is no need to look up the matcher.
+        if (not message):
+            return False
 
-        # Loop through the blacklist.
-        for blacklisted_word in blacklist:
-            # If the message contains the current word we are indexing, return True.
-            if (blacklisted_word != "" and message.__contains__(blacklisted_word)):
-                return True
-        
-        # If no blacklisted words were found in the message, return False.
-        return False
\ No newline at end of file
+        matcher = await BlacklistExtension.get_guild_matcher(str(guild_id) if guild_id is not None else None)
+        return matcher.matches(message)
@@ -1,19 +1,48 @@
+import asyncio
 import os
 import sys
+import time
 
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(parent_dir)
 from util.config_manager import Config
-from util.database_manager import Database
+from util.database_manager import Database, DatabaseUnavailableError
+from util.tag_cache import TagCache
+from util.tag_name_index import TagNameIndex
+from util.tag_sampler import TagSampler
+from util.tag_usage_counter import TagUsageCounter
+from util.member_cache_policy import MemberCachePolicy
+from util.geocode_cache import GeocodeCache
+# The blacklist extension is imported as a module, since interactions.py would load every extension class imported into this module as well.
+from extensions import blacklist
 
-from interactions import listen, Extension, Client
-from interactions.api.events import GuildLeft, MemberRemove
+from interactions import listen, Extension, Client, Task, IntervalTrigger
+from interactions.api.events import GuildLeft, MemberRemove, Ready, Startup
+from interactions.client.errors import HTTPException
 
 """
 A class representing an extension of the bot.
 This extention contains the functionality for the removing server specific information from the database.
 """
 class DatabaseCleanupExtension(Extension):
+    cleanup_task = None
+
+    # The settings for the cleanup, which are only worked out again after the config changes.
+    settings = None
+
+    # The amount of members requested from Discord at once when listing the members of a server. This is the most Discord allows.
+    MEMBER_PAGE_SIZE = 1000
+
+    """
+    Creates the database cleanup extension and subscribes it to config changes, so the cleanup settings are worked out again when they change.
+
+    @param bot The client the bot is running on.
+    """
+    def __init__(self, bot):
+        # The config may have changed while the extension wasn't loaded, so the settings are worked out again when they are next needed.
+        DatabaseCleanupExtension.settings = None
+        Config.subscribe(DatabaseCleanupExtension.on_config_changed)
+
     """
     GuildLeft event listener.
     This is a callback function that is called when a GuildLeft event is triggered.
@@ -23,25 +52,16 @@ class DatabaseCleanupExtension(Extension):
     """
     @listen(GuildLeft)
     async def on_guild_left(self, event: GuildLeft):
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-
-            # Delete all tags from this server.
-            cur.execute(f"DELETE FROM tags WHERE guildID = ?", (str(event.guild.id),))
-            
-            # Delete all timezone registrations from this server.
-            cur.execute(f"DELETE FROM timezones WHERE guildID = ?", (str(event.guild.id),))
-
-            # Commit the changes to the database.
-            con.commit()
-
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
+        try:
+            # Delete all tags, timezone registrations and blacklisted words from this server.
+            await Database.write(DatabaseCleanupExtension.delete_guild_data, str(event.guild.id))
+            TagCache.invalidate_guild(str(event.guild.id))
+            TagNameIndex.remove_guild(str(event.guild.id))
+            TagSampler.invalidate(str(event.guild.id))
+            TagUsageCounter.discard(str(event.guild.id))
+            blacklist.BlacklistExtension.invalidate_guild(str(event.guild.id))
+        except DatabaseUnavailableError:
+            pass
     
     """
     MemberRemove event listener.
@@ -53,86 +73,332 @@ class DatabaseCleanupExtension(Extension):
     @listen(MemberRemove)
     async def on_member_remove(self, event: MemberRemove):
         # Checks if the "clean_user_data" flag is enabled in the config.
-        if (Config.get_config["clean_user_data"]):
-            # Get a connection to the bot database.
-            con = Database.get_connection()
+        if (Config.get_config()["clean_user_data"]):
+            try:
+                # Delete all tags and timezone registrations for this user from this server.
+                await Database.write(DatabaseCleanupExtension.delete_member_data, str(event.member.id), str(event.guild.id))
+                TagCache.invalidate_author(str(event.member.id), str(event.guild.id))
+                TagSampler.invalidate(str(event.guild.id))
+                await TagNameIndex.load_guild(str(event.guild.id))
+            except DatabaseUnavailableError:
+                pass
+
+    """
+    Deletes all server specific information for a server from the bot database.
+    This function is run on the database writer thread.
+
+    @param con The connection to the bot database.
+    @param guild_id The guild ID of the server.
+    @return The amount of rows that were deleted.
+    """
+    @staticmethod
+    def delete_guild_data(con, guild_id: str):
+        # Create a cursor to query the database.
+        cur = con.cursor()
 
-            # Check if the connection is valid.
-            if (con is not None):
-                # Create a cursor to query the database.
-                cur = con.cursor()
+        # Delete all tags from this server.
+        removed = cur.execute("DELETE FROM tags WHERE guildID = ?", (guild_id,)).rowcount
 
-                # Delete all tags created by this user from this server.
-                cur.execute(f"DELETE FROM tags WHERE authorID = ? AND guildID = ?", (str(event.member.id), str(event.guild.id),))
-                
-                # Delete all timezone registrations for this user from this server.
-                cur.execute(f"DELETE FROM timezones WHERE userID = ? AND guildID = ?", (str(event.member.id), str(event.guild.id),))
+        # Delete all timezone registrations from this server.
+        removed += cur.execute("DELETE FROM timezones WHERE guildID = ?", (guild_id,)).rowcount
 
-                # Commit the changes to the database.
-                con.commit()
+        # Delete the blacklist of this server.
+        removed += cur.execute("DELETE FROM blacklist WHERE guildID = ?", (guild_id,)).rowcount
 
-                # Close the connection to the database now that we are done accessing it.
-                con.close()
+        return removed
 
     """
-    Deletes server and user specific information from the bot database for servers and users that are unavailable to the bot.
-    This function is called when the On Ready event is triggered to ensure that no uneccesary data wasn't left unremoved during the bot's downtime.
+    Deletes all user specific information for a user in a server from the bot database.
+    This function is run on the database writer thread.
+
+    @param con The connection to the bot database.
+    @param user_id The user ID of the user.
+    @param guild_id The guild ID of the server.
     """
     @staticmethod
-    def on_ready_cleanup(client: Client):
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-            
-            # Make sure the temporary tables we are going to create, don't already exist.
-            cur.execute("DROP TABLE IF EXISTS guilds")
-            cur.execute("DROP TABLE IF EXISTS users")
-
-            # Create two temporary tables in the database to store the guild IDs and user IDs for all the servers the bot is currently in.
-            cur.execute("CREATE TABLE guilds(guildID)")
-            cur.execute("CREATE TABLE users(userID, guildID)")
-            
-            # Get a list of guilds the bot is in.
-            guilds = client.guilds
-
-            # Loop over the list of guilds.
-            for guild in guilds:
-                # Insert the guild ID for this guild into the temporary table.
-                cur.execute("INSERT INTO guilds VALUES (?)", (str(guild.id),))
-
-                # Check if the "clean_user_data" flag is enabled in the config.
-                if (Config.get_config()["clean_user_data"]):
-                    # Get a list of users in this server.
-                    users = guild.members
-
-                    # Loop over the list of users.
-                    for user in users:
-                        # For each user in a guild we will insert the user IDs into the temporary table.
-                        cur.execute("INSERT INTO users VALUES (?, ?)", (str(user.id), str(guild.id),))
-                    
-                    # If the flag is enabled we will delete all tags and timezone registrations from users not available to the bot.
-                    cur.execute("DELETE FROM tags WHERE authorID NOT IN (SELECT u.userID FROM users u WHERE guildID = ?)", (str(guild.id),))
-                    cur.execute("DELETE FROM timezones WHERE userID NOT IN (SELECT u.userID FROM users u WHERE guildID = ?)", (str(guild.id),))
-
-                    # Clear the temporary table.
-                    cur.execute("DELETE FROM users")
-
-            # Delete all tags from the database that don't have an author ID or guild ID present in the temporary table.
-            cur.execute("DELETE FROM tags WHERE guildID NOT IN (SELECT g.guildID FROM guilds g)")
-
-            # Delete all timezone registrations from the database that don't have a userID or guild ID present in the temporary table.
-            cur.execute("DELETE FROM timezones WHERE guildID NOT IN (SELECT g.guildID FROM guilds g)")
-
-            # Delete the temporary tables.
-            cur.execute("DROP TABLE guilds")
-            cur.execute("DROP TABLE users")
-            
-            # Commit the changes to the database.
-            con.commit()
-
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
\ No newline at end of file
+    def delete_member_data(con, user_id: str, guild_id: str):
+        # Create a cursor to query the database.
+        cur = con.cursor()
+
+        # Delete all tags created by this user from this server.
+        cur.execute("DELETE FROM tags WHERE authorID = ? AND guildID = ?", (user_id, guild_id,))
+
+        # Delete all timezone registrations for this user from this server.
+        cur.execute("DELETE FROM timezones WHERE userID = ? AND guildID = ?", (user_id, guild_id,))
+
+    """
+    Startup event listener.
+    This is a callback function that is called when a Startup event is triggered.
+    This function will initialize the extension.
+
+    @param event The event context.
+    """
+    @listen(Startup)
+    async def on_startup(self, event: Startup):
+        await self.initialize()
+
+    """
+    Initializes the extension once the bot has started.
+    This function will start the task which periodically reruns the cleanup if a cleanup interval is specified in the config.
+    If the extension was deferred, the bot is already ready when it is initialized, so the first cleanup is started here instead of by the Ready listener.
+    """
+    async def initialize(self):
+        # An interval of 0 means the cleanup only runs when the bot starts.
+        interval = DatabaseCleanupExtension.get_cleanup_settings()["interval"]
+        if (interval > 0):
+            self.cleanup_schedule = Task(self.scheduled_cleanup, IntervalTrigger(seconds=interval))
+            self.cleanup_schedule.start()
+
+        if (self.bot.is_ready):
+            DatabaseCleanupExtension.start_cleanup(self.bot)
+
+    """
+    Ready event listener.
+    This is a callback function that is called when a Ready event is triggered, which happens when the bot starts and after it reconnects.
+    This function will start the cleanup, so data left behind while the bot was offline is removed.
+
+    @param event The event context.
+    """
+    @listen(Ready)
+    async def on_ready(self, event: Ready):
+        DatabaseCleanupExtension.start_cleanup(self.bot)
+
+    """
+    Starts the cleanup as a background task.
+    This function is called periodically by the cleanup schedule.
+    """
+    async def scheduled_cleanup(self):
+        DatabaseCleanupExtension.start_cleanup(self.bot)
+
+    """
+    Stops the background tasks of this extension and unsubscribes from config changes when the extension is unloaded.
+    The cleanup saves its progress after every chunk, so it resumes from the last finished chunk the next time it is started.
+    """
+    def drop(self):
+        Config.unsubscribe(DatabaseCleanupExtension.on_config_changed)
+        if (getattr(self, "cleanup_schedule", None) is not None):
+            self.cleanup_schedule.stop()
+        if (DatabaseCleanupExtension.cleanup_task is not None):
+            DatabaseCleanupExtension.cleanup_task.cancel()
+        super().drop()
+
+    """
+    Returns the settings for the cleanup specified in the config.json file.
+
+    @return A dictionary containing the chunk_size, chunk_delay and interval settings.
+    """
+    @staticmethod
+    def get_cleanup_settings():
+        settings = DatabaseCleanupExtension.settings
+        if (settings is None):
+            settings = DatabaseCleanupExtension.load_cleanup_settings(Config.get_config())
+            DatabaseCleanupExtension.settings = settings
+        return settings
+
+    """
+    Works out the settings for the cleanup from a config.
+
+    @param config The config to read the settings from.
+    @return A dictionary containing the chunk_size, chunk_delay and interval settings.
+    """
+    @staticmethod
+    def load_cleanup_settings(config: dict):
+        return {
+            "chunk_size": max(1, config.get("database_cleanup_chunk_size", 100)),
+            "chunk_delay": max(0.0, config.get("database_cleanup_chunk_delay", 1.0)),
+            "interval": max(0, config.get("database_cleanup_interval", 86400)),
+        }
+
+    """
+    Config subscriber which works out the settings for the cleanup again when they change.
+    The cleanup schedule is only created when the extension is initialized, so a changed interval only takes effect after a restart.
+
+    @param old_config The old config.
+    @param new_config The new config.
+    """
+    @staticmethod
+    def on_config_changed(old_config: dict, new_config: dict):
+        if (Config.changed(old_config, new_config, "database_cleanup_chunk_size", "database_cleanup_chunk_delay", "database_cleanup_interval")):
+            DatabaseCleanupExtension.settings = DatabaseCleanupExtension.load_cleanup_settings(new_config)
+
+    """
+    Starts deleting server and user specific information from the bot database for servers and users that are unavailable to the bot.
+    This function is called when the On Ready event is triggered to ensure that no uneccesary data wasn't left unremoved during the bot's downtime, and is
+    then called periodically by the cleanup schedule. The cleanup runs as a background task so that it doesn't hold up the On Ready event.
+
+    @param client The client the bot is running on.
+    @return The task running the cleanup.
+    """
+    @staticmethod
+    def start_cleanup(client: Client):
+        # Don't start a second cleanup while one is still running.
+        if (DatabaseCleanupExtension.cleanup_task is not None and not DatabaseCleanupExtension.cleanup_task.done()):
+            return DatabaseCleanupExtension.cleanup_task
+
+        DatabaseCleanupExtension.cleanup_task = asyncio.create_task(DatabaseCleanupExtension.run_cleanup(client))
+        return DatabaseCleanupExtension.cleanup_task
+
+    """
+    Runs the cleanup of data for servers and users that are unavailable to the bot.
+    The servers stored in the bot database are processed in order of their guild ID, in chunks. Each chunk is cleaned in its own short transaction,
+    which also saves the guild ID of the last server in the chunk as a checkpoint, and the cleanup sleeps between chunks so that commands aren't
+    held up by it. If the bot is restarted during a cleanup, the next cleanup resumes after the last saved checkpoint.
+
+    @param client The client the bot is running on.
+    """
+    @staticmethod
+    async def run_cleanup(client: Client):
+        settings = DatabaseCleanupExtension.get_cleanup_settings()
+        clean_user_data = Config.get_config()["clean_user_data"]
+
+        try:
+            # Resume from the checkpoint of an interrupted cleanup if there is one.
+            state = await Database.fetch_one("SELECT checkpoint, startedAt FROM job_state WHERE job = ?", ("cleanup",))
+            if (state is not None):
+                checkpoint, started_at = state
+                print(f"Resuming bot database cleanup after server {checkpoint}...")
+            else:
+                checkpoint, started_at = "", int(time.time())
+                print("Starting bot database cleanup...")
+
+            processed = 0
+            removed = 0
+            while (True):
+                # Get the next chunk of servers which have data in the bot database.
+                rows = await Database.fetch_all("""SELECT guildID FROM (SELECT guildID FROM tags UNION SELECT guildID FROM timezones UNION SELECT guildID FROM blacklist)
+                                                   WHERE guildID > ? ORDER BY guildID LIMIT ?""", (checkpoint, settings["chunk_size"],))
+                if (not rows):
+                    break
+
+                # Get the users with data in each server of the chunk, if user specific information is being cleaned.
+                referenced = {}
+                if (clean_user_data):
+                    referenced_rows = await Database.fetch_all("""SELECT guildID, authorID FROM tags WHERE guildID > ? AND guildID <= ?
+                                                                  UNION SELECT guildID, userID FROM timezones WHERE guildID > ? AND guildID <= ?""",
+                                                               (checkpoint, rows[-1][0], checkpoint, rows[-1][0],))
+                    for guild_id, user_id in referenced_rows:
+                        referenced.setdefault(guild_id, set()).add(user_id)
+
+                # Work out which of those users have left each server in the chunk. Servers the bot is no longer in are marked with None.
+                departed_members = {}
+                for (guild_id,) in rows:
+                    guild = client.get_guild(int(guild_id)) if guild_id.isdigit() else None
+                    if (guild is None):
+                        departed_members[guild_id] = None
+                    elif (guild_id in referenced):
+                        departed = await DatabaseCleanupExtension.find_departed_members(client, guild, referenced[guild_id])
+                        # Servers whose members couldn't be listed are skipped, rather than treating every user as having left them.
+                        if (departed):
+                            departed_members[guild_id] = departed
+
+                # Clean the chunk and save the checkpoint in a single transaction.
+                checkpoint = rows[-1][0]
+                chunk_removed = await Database.write(DatabaseCleanupExtension.cleanup_chunk, departed_members, checkpoint, started_at)
+                if (chunk_removed > 0):
+                    for guild_id, user_ids in departed_members.items():
+                        TagCache.invalidate_guild(guild_id)
+                        TagSampler.invalidate(guild_id)
+                        await TagNameIndex.load_guild(guild_id)
+
+                        # Every tag and blacklisted word of a server the bot is no longer in was deleted, so its pending usage counts
+                        # and cached blacklist matcher are dropped as well.
+                        if (user_ids is None):
+                            TagUsageCounter.discard(guild_id)
+                            blacklist.BlacklistExtension.invalidate_guild(guild_id)
+
+                processed += len(rows)
+                removed += chunk_removed
+                print(f"Bot database cleanup: checked {processed} server(s), removed {removed} row(s).")
+
+                # Give the event loop and the database writer some room before the next chunk.
+                await asyncio.sleep(settings["chunk_delay"])
+
+            # The cleanup finished, so the next one will start from the beginning.
+            await Database.execute("DELETE FROM job_state WHERE job = ?", ("cleanup",))
+
+            # Stop caching the members whose data was removed.
+            await MemberCachePolicy.load_references()
+
+            # Delete the cached geocoding results which have expired.
+            expired = await GeocodeCache.delete_expired()
+            print(f"Bot database cleanup finished. Checked {processed} server(s), removed {removed} row(s) and {expired} expired geocoding result(s).")
+        except DatabaseUnavailableError:
+            print("Unable to access bot database! The bot database cleanup will resume from its last checkpoint next time.")
+
+    """
+    Finds which of a server's users are no longer members of it.
+    If every member of every server is cached, the cache is used. Otherwise the members of the server are streamed from Discord a page at a time,
+    and only the user IDs that are asked about are kept, so the members of large servers are never all held in memory at once.
+
+    @param client The client the bot is running on.
+    @param guild The server.
+    @param user_ids A set of the user IDs to check.
+    @return A list of the user IDs that are no longer members of the server, or None if the members of the server couldn't be listed.
+    """
+    @staticmethod
+    async def find_departed_members(client: Client, guild, user_ids: set):
+        if (MemberCachePolicy.caches_all_members() and guild.chunked.is_set()):
+            return [user_id for user_id in user_ids if not user_id.isdigit() or guild.get_member(int(user_id)) is None]
+
+        remaining = set(user_ids)
+        after = None
+        try:
+            while (remaining):
+                page = await client.http.list_members(guild.id, limit=DatabaseCleanupExtension.MEMBER_PAGE_SIZE, after=after)
+                for member in page:
+                    remaining.discard(member["user"]["id"])
+
+                # A page that isn't full is the last page.
+                if (len(page) < DatabaseCleanupExtension.MEMBER_PAGE_SIZE):
+                    break
+                after = page[-1]["user"]["id"]
+        except HTTPException:
+            return None
+
+        return list(remaining)
+
+    """
+    Deletes server and user specific information from the bot database for a chunk of servers, and saves the checkpoint of the cleanup.
+    Servers the bot is no longer in have all of their data deleted. For the other servers, user specific information is deleted for the users that
+    are no longer members. The user IDs are bulk loaded into an indexed temporary table for this.
+    This function is run on the database writer thread.
+
+    @param con The connection to the bot database.
+    @param departed_members A dictionary mapping the guild ID of servers in the chunk to a list of the user IDs that are no longer members of that server, or None if the bot is no longer in it.
+    @param checkpoint The guild ID of the last server in the chunk.
+    @param started_at The unix time the cleanup was started at.
+    @return The amount of rows that were deleted.
+    """
+    @staticmethod
+    def cleanup_chunk(con, departed_members: dict, checkpoint: str, started_at: int):
+        # Create a cursor to query the database.
+        cur = con.cursor()
+        removed = 0
+
+        # Create a temporary table to store the user IDs of the departed members of the servers in this chunk.
+        # Temporary tables only exist for this connection and are never written to the bot database file.
+        cur.execute("DROP TABLE IF EXISTS temp.cleanup_members")
+        cur.execute("CREATE TEMP TABLE cleanup_members(guildID TEXT NOT NULL, userID TEXT NOT NULL, PRIMARY KEY (guildID, userID)) WITHOUT ROWID")
+
+        try:
+            for guild_id, user_ids in departed_members.items():
+                if (user_ids is None):
+                    # Delete all server specific information for servers the bot is no longer in.
+                    removed += DatabaseCleanupExtension.delete_guild_data(con, guild_id)
+                else:
+                    # Delete all tags and timezone registrations from users who are no longer members of this server.
+                    cur.executemany("INSERT OR IGNORE INTO cleanup_members VALUES (?, ?)", ((guild_id, user_id) for user_id in user_ids))
+                    removed += cur.execute("""DELETE FROM tags WHERE guildID = ? AND EXISTS
+                                   (SELECT 1 FROM cleanup_members m WHERE m.guildID = tags.guildID AND m.userID = tags.authorID)""", (guild_id,)).rowcount
+                    removed += cur.execute("""DELETE FROM timezones WHERE guildID = ? AND EXISTS
+                                   (SELECT 1 FROM cleanup_members m WHERE m.guildID = timezones.guildID AND m.userID = timezones.userID)""", (guild_id,)).rowcount
+        finally:
+            # Delete the temporary table.
+            cur.execute("DROP TABLE IF EXISTS temp.cleanup_members")
+
+        # Save the checkpoint as part of the same transaction, so the chunk is never cleaned twice or skipped.
+        now = int(time.time())
+        cur.execute("""INSERT INTO job_state(job, checkpoint, startedAt, updatedAt) VALUES (?, ?, ?, ?)
+                       ON CONFLICT(job) DO UPDATE SET checkpoint = excluded.checkpoint, updatedAt = excluded.updatedAt""", ("cleanup", checkpoint, started_at, now,))
+
+        return removed
@@ -0,0 +1,54 @@
+import os
+import sys
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+from util.database_manager import Database, DatabaseUnavailableError
+
+from interactions import listen, Extension, Task, IntervalTrigger
+from interactions.api.events import Startup
+
+"""
+A class representing an extension of the bot.
+This extention contains the background tasks which keep the bot database healthy while the bot is running.
+"""
+class DatabaseMaintenanceExtension(Extension):
+    """
+    Startup event listener.
+    This is a callback function that is called when a Startup event is triggered.
+    This function will initialize the extension.
+
+    @param event The event context.
+    """
+    @listen(Startup)
+    async def on_startup(self, event: Startup):
+        await self.initialize()
+
+    """
+    Initializes the extension once the bot has started.
+    This function will start the periodic checkpoint task if a checkpoint interval is specified in the config.
+    """
+    async def initialize(self):
+        # Get the checkpoint interval from the config. An interval of 0 disables periodic checkpointing.
+        interval = Database.get_pragma_settings()["checkpoint_interval"]
+        if (interval > 0):
+            self.checkpoint_task = Task(self.checkpoint, IntervalTrigger(seconds=interval))
+            self.checkpoint_task.start()
+
+    """
+    Checkpoints the write-ahead log of the bot database.
+    This function is called periodically by the checkpoint task.
+    """
+    async def checkpoint(self):
+        try:
+            await Database.checkpoint()
+        except DatabaseUnavailableError:
+            pass
+
+    """
+    Stops the background tasks of this extension when the extension is unloaded.
+    """
+    def drop(self):
+        if (getattr(self, "checkpoint_task", None) is not None):
+            self.checkpoint_task.stop()
+        super().drop()
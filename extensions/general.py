@@ -5,13 +5,52 @@ import sys
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(parent_dir)
 from util.config_manager import Config
+from util.tag_cache import TagCache
 
-from interactions import InteractionContext, Extension, Embed, OptionType, slash_command, slash_option
+from interactions import listen, InteractionContext, Extension, Embed, OptionType, Task, IntervalTrigger, slash_command, slash_option
+from interactions.api.events import Startup
 
 """
 A class representing an extension of the bot. This extention contains the functionality for the general slash commands provided by the bot.
 """
 class GeneralExtension(Extension):
+    """
+    Startup event listener.
+    This is a callback function that is called when a Startup event is triggered.
+    This function will initialize the extension.
+
+    @param event The event context.
+    """
+    @listen(Startup)
+    async def on_startup(self, event: Startup):
+        await self.initialize()
+
+    """
+    Initializes the extension once the bot has started.
+    This function will start the task which watches the config file and reloads it when it changes, if a watch interval is specified in the config.
+    """
+    async def initialize(self):
+        # Get the watch interval from the config. An interval of 0 means the config is only reloaded with the reloadconfig command.
+        interval = Config.get_config().get("config_watch_interval", 5)
+        if (interval > 0):
+            self.config_watch_task = Task(self.watch_config, IntervalTrigger(seconds=interval))
+            self.config_watch_task.start()
+
+    """
+    Reloads the config if the config file has changed.
+    This function is called periodically by the config watch task.
+    """
+    async def watch_config(self):
+        Config.check_for_changes()
+
+    """
+    Stops the background tasks of this extension when the extension is unloaded.
+    """
+    def drop(self):
+        if (getattr(self, "config_watch_task", None) is not None):
+            self.config_watch_task.stop()
+        super().drop()
+
     """
     About Command.
     Displays the credits for the bot to the user who invoked this command.
@@ -170,3 +209,27 @@ class GeneralExtension(Extension):
             await context.send("Successfully reloaded config.")
         else:
             await context.send("Unable to reload config. Falling back to old config.")
+
+    """
+    Cache Stats Command.
+    Displays the statistics of the tag cache since the bot started. Only the owner of the bot can use this command
+    This is function is registered as a slash command using interactions.py and it automatically called when the command is invoked by a Discord user.
+
+    @param context The context for which this command was invoked.
+    """
+    @slash_command(
+        name="cachestats",
+        description="Displays the statistics of the tag cache. Only the owner of the bot can use this command",
+        dm_permission=True
+    )
+    async def cachestats(self, context: InteractionContext):
+        # Check if the user invoking this command is the owner specified in the config.
+        config = Config.get_config()
+        if (config["owner_id"] != str(context.author_id)):
+            # If the user is not the owner we will respond to the user and tell them so.
+            await context.send("You are not specified as an owner in the config!")
+            return
+
+        # Respond with the size of the tag cache and how many lookups it has answered without the bot database.
+        stats = TagCache.get_stats()
+        await context.send(f"Tag cache: {stats['size']} tag(s) cached, {stats['hits']} hit(s), {stats['misses']} miss(es), {stats['hit_rate']:.1%} hit rate.")
@@ -1,19 +1,93 @@
+import asyncio
+import csv
 import os
+import re
 import sys
+import tempfile
+import time
 from datetime import date
 
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(parent_dir)
 from util.config_manager import Config
-from util.database_manager import Database
-
-from interactions import Extension, InteractionContext, OptionType, Embed, slash_command, slash_option
-from interactions.ext.paginators import Paginator
+from util.database_manager import Database, DatabaseUnavailableError
+from util.tag_cache import TagCache
+from util.tag_usage_counter import TagUsageCounter
+from util.lazy_paginator import LazyPaginator
+from util.tag_name_index import TagNameIndex
+from util.member_cache_policy import MemberCachePolicy
+from util.user_resolver import UserResolver
+from util.tag_sampler import TagSampler
+from util.bulk_delete import BulkDelete
+from util.tag_transfer import TagTransfer
+
+from interactions import listen, Extension, AutocompleteContext, Attachment, File, InteractionContext, OptionType, Embed, Member, SlashCommandChoice, Task, IntervalTrigger, slash_command, slash_option, auto_defer
+from interactions.api.events import Startup
 
 """
 A class representing an extension of the bot. This extention contains the functionality for the tag slash commands provided by the bot.
 """
 class TagExtension(Extension):
+    # The key columns of each tag_all listing and whether the listing is in descending order. The tag ID breaks ties between equal values.
+    TAG_LISTINGS = {
+        "name": (("name",), False),
+        "top": (("amountUsed", "id"), True),
+        "recent": (("createdAt", "id"), True),
+    }
+
+    # The maximum amount of results shown by tag_search, and the maximum amount of words used from a search.
+    SEARCH_RESULT_LIMIT = 10
+    SEARCH_WORD_LIMIT = 16
+
+    # The maximum amount of characters of a search shown back to the user, which keeps it within Discord's 256 character limit for embed titles.
+    SEARCH_QUERY_DISPLAY_LENGTH = 200
+
+    # The largest export file that is sent by tag_export, which is the most Discord allows a bot to upload.
+    MAX_EXPORT_SIZE = 10 * 1024 * 1024
+
+    # The amount of servers tag_import can import into before the whole tag name index is reloaded instead of each server's names.
+    IMPORT_RELOAD_THRESHOLD = 100
+
+    """
+    Startup event listener.
+    This is a callback function that is called when a Startup event is triggered.
+    This function will initialize the extension.
+
+    @param event The event context.
+    """
+    @listen(Startup)
+    async def on_startup(self, event: Startup):
+        await self.initialize()
+
+    """
+    Initializes the extension once the bot has started.
+    This function will start the task which periodically writes the accumulated tag usage counts to the bot database, and load the tag name index.
+    """
+    async def initialize(self):
+        # Get the flush interval from the config.
+        try:
+            interval = int(Config.get_config().get("tag_usage_flush_interval", 30))
+        except (TypeError, ValueError):
+            interval = 30
+
+        self.usage_flush_task = Task(TagUsageCounter.flush, IntervalTrigger(seconds=max(1, interval)))
+        self.usage_flush_task.start()
+
+        # Load the names of every tag so autocomplete requests can be answered without querying the bot database.
+        try:
+            await TagNameIndex.warm()
+        except DatabaseUnavailableError:
+            print("Unable to access bot database! Tag name autocomplete will be unavailable until tags are added.")
+
+    """
+    Stops the background tasks of this extension and writes any pending tag usage counts when the extension is unloaded.
+    """
+    def drop(self):
+        if (getattr(self, "usage_flush_task", None) is not None):
+            self.usage_flush_task.stop()
+        TagUsageCounter.flush_now()
+        super().drop()
+
     """
     Tag Get Command.
     Displays the specified tag's content to the user who invoked this command.
@@ -31,47 +105,28 @@ class TagExtension(Extension):
         name="name",
         description="The tag's name",
         required=True,
-        opt_type=OptionType.STRING
+        opt_type=OptionType.STRING,
+        autocomplete=True
     )
     async def tag_get(self, context: InteractionContext, name: str):
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-            
-            # Check if any tags with the same name and guildID exists in the database.
-            params = (name, str(context.guild_id),)
-            res = cur.execute(f"SELECT name, content, amountUsed FROM tags WHERE name = ? AND guildID = ?", params)
-            
-            # Store the results of our database query.
-            fetch = res.fetchone()
+        try:
+            # Get the tag with the same name and guildID.
+            guild_id = str(context.guild_id)
+            fetch = await TagExtension.get_tag(guild_id, name)
 
-            # Check if there is an existing tag in the database.
+            # Check if there is an existing tag.
             if (fetch is None):
                 # If the the specified tag is not in the database we will respond to the user who invoked this command and tell them so.
                 await context.send(f"No tags with name '{name}' found!")
             else:
-                # Update the amountUsed counter for the tag.
-                used_counter = fetch[2]
-                used_counter += 1
-
-                # Only updates the tag if they share the same name and guildID.
-                params = (used_counter, name, str(context.guild_id),)
-                cur.execute(f"UPDATE tags SET amountUsed = ? WHERE name = ? AND guildID = ?", params)
-                
-                # Commit the changes to the database.
-                con.commit()
-
                 # Respond to the user who invoked this command with the content of the tag.
-                content = fetch[1]
+                content = fetch[0]
                 await context.send(f"{content}")
 
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
-        else:
+                # Record the use of the tag. The amountUsed counter is updated in the database in batches.
+                if (TagUsageCounter.increment(guild_id, name)):
+                    await TagUsageCounter.flush()
+        except DatabaseUnavailableError:
             # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
             await context.send("Unable to access bot database!")
 
@@ -102,40 +157,28 @@ class TagExtension(Extension):
         opt_type=OptionType.STRING
     )
     async def tag_add(self, context: InteractionContext, name: str, content: str):
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-            
-            # Check if any tags with the same name and guildID already exists in the database.
-            params = (name, str(context.guild_id),)
-            res = cur.execute(f"SELECT name FROM tags WHERE name = ? AND guildID = ?", params)
-            
-            # Store the results of our database query.
-            fetch = res.fetchone()
-
-            # Check if there is a conflicting tag already in the database.
-            if (fetch is None):
-                # Gets the current date and stores it as a string with a month abbreviation, day, and year format {Jan-01-2000}.
-                currentDate = date.today().strftime("%b-%d-%Y")
-
-                # If there are no conflicting tags with the same name and guildID we will add the new tag to the database.
-                params = (name, content, str(context.author_id), str(context.guild_id), currentDate,)
-                cur.execute("INSERT INTO tags VALUES (?, ?, ?, ?, ?, 0)", params)
-                con.commit()
+        try:
+            # Gets the current date and stores it as a string with a month abbreviation, day, and year format {Jan-01-2000}.
+            currentDate = date.today().strftime("%b-%d-%Y")
+
+            # Add the new tag to the database only if there are no conflicting tags with the same name and guildID.
+            # The unique (guildID, name) key makes the insert a no-op if a conflicting tag already exists.
+            params = (name, content, str(context.author_id), str(context.guild_id), currentDate, int(time.time()),)
+            created = await Database.execute("INSERT OR IGNORE INTO tags(name, content, authorID, guildID, date, createdAt, amountUsed) VALUES (?, ?, ?, ?, ?, ?, 0)", params)
+            TagCache.invalidate(str(context.guild_id), name)
+
+            # Check if there was a conflicting tag already in the database.
+            if (created):
+                TagNameIndex.add(str(context.guild_id), name)
+                TagSampler.invalidate(str(context.guild_id))
+                MemberCachePolicy.add_reference(str(context.guild_id), str(context.author_id))
 
                 # Respond to the user who invoked this command.
                 await context.send(f"Created tag: '{name}'")
             else:
                 # Respond to the user who invoked this command and tell them that a conflicting tag already exists.
                 await context.send("Tag with that name already exists!")
-
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
-        else:
+        except DatabaseUnavailableError:
             # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
             await context.send("Unable to access bot database!")
 
@@ -156,26 +199,17 @@ class TagExtension(Extension):
         name="name",
         description="The tag's name",
         required=True,
-        opt_type=OptionType.STRING
+        opt_type=OptionType.STRING,
+        autocomplete=True
     )
     async def tag_delete(self, context: InteractionContext, name: str):
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-
+        try:
             # Gets the config file.
             config = Config.get_config()
 
             # Check if any tags with the same name and guildID exists in the database.
             params = (name, str(context.guild_id),)
-            res = cur.execute(f"SELECT authorID FROM tags WHERE name = ? AND guildID = ?", params)
-
-            # Store the results of our database query.
-            fetch = res.fetchone()
+            fetch = await Database.fetch_one("SELECT authorID FROM tags WHERE name = ? AND guildID = ?", params)
 
             # Check if there is an existing tag in the database.
             if (fetch is None):
@@ -184,20 +218,18 @@ class TagExtension(Extension):
             elif (fetch[0] == str(context.author_id) or config["owner_id"] == str(context.author_id)):
                 # Delete the tag with the same name and guildID from the database.
                 params = (name, str(context.guild_id),)
-                cur.execute(f"DELETE FROM tags WHERE name = ? AND guildID = ?", params)
-                
-                # Commit the changes to the database.
-                con.commit()
+                await Database.execute("DELETE FROM tags WHERE name = ? AND guildID = ?", params)
+                TagUsageCounter.discard(str(context.guild_id), name)
+                TagCache.invalidate(str(context.guild_id), name)
+                TagNameIndex.remove(str(context.guild_id), name)
+                TagSampler.invalidate(str(context.guild_id))
 
                 # Respond to the user who invoked this command and tell them that the tag was deleted.
                 await context.send(f"Deleted tag '{name}'")
             else:
                 # If the user invoking this command isn't the author or bot owner we will tell them so.
                 await context.send("This tag can only be deleted by it's author or the bot owner!")
-            
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
-        else:
+        except DatabaseUnavailableError:
             # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
             await context.send("Unable to access bot database!")
 
@@ -218,23 +250,14 @@ class TagExtension(Extension):
         name="name",
         description="The tag's name",
         required=True,
-        opt_type=OptionType.STRING
+        opt_type=OptionType.STRING,
+        autocomplete=True
     )
     async def tag_info(self, context: InteractionContext, name: str):
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-            
+        try:
             # Check if any tags with the same name and guildID exists in the database.
             params = (name, str(context.guild_id),)
-            res = cur.execute(f"SELECT name, content, authorID, guildID, date, amountUsed FROM tags WHERE name = ? AND guildID = ?", params)
-            
-            # Store the results of our database query.
-            fetch = res.fetchone()
+            fetch = await Database.fetch_one("SELECT name, content, authorID, guildID, date, amountUsed FROM tags WHERE name = ? AND guildID = ?", params)
 
             # Check if there is an existing tag in the database.
             if (fetch is None):
@@ -243,155 +266,385 @@ class TagExtension(Extension):
             else:
                 # Create an embed to display the info of the tag in.
                 embed = Embed()
-                embed.add_field(f"Name: {fetch[0]}", f"Date Created: {fetch[4]}\nTimes Used: {fetch[5]}\n Content: {fetch[1]}")
-
-                # Get the user object of the author of the tag.
-                authorUser = context.client.get_user(fetch[2])
+                timesUsed = fetch[5] + TagUsageCounter.get_pending(fetch[3], fetch[0])
+                embed.add_field(f"Name: {fetch[0]}", f"Date Created: {fetch[4]}\nTimes Used: {timesUsed}\n Content: {fetch[1]}")
 
-                # Check if the user object is None.
-                if (authorUser is not None):
-                    # If the user object isn't None we will set the author of the embed to be the author's name and avatar icon.
-                    embed.set_author(authorUser.tag, icon_url=authorUser.display_avatar.url)
-                else:
-                    # If the user object is None we will set the author of the embed to be the user ID of the author.
-                    embed.set_author(f"Author ID: {fetch[2]}", icon_url=context.client.user.display_avatar.url)
+                # Set the author of the embed to the author of the tag.
+                users = await UserResolver.resolve(context.client, [fetch[2]])
+                TagExtension.set_embed_author(context, embed, fetch[2], users)
 
                 # Respond to the user who invoked this command with the embedded message.
                 await context.send(embeds=embed)
-
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
-        else:
+        except DatabaseUnavailableError:
             # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
             await context.send("Unable to access bot database!")
-    
+
+    """
+    Tag name autocomplete callback.
+    Suggests the names of the tags in the current server which start with what the user has typed so far.
+    This function is registered as the autocomplete callback for the name option of the tag_get, tag_delete and tag_info commands, and is called
+    on every keystroke, so the suggestions are served from the in-memory tag name index rather than the bot database.
+
+    @param context The context for which the autocomplete was requested.
+    """
+    @tag_get.autocomplete("name")
+    @tag_delete.autocomplete("name")
+    @tag_info.autocomplete("name")
+    async def tag_name_autocomplete(self, context: AutocompleteContext):
+        names = TagNameIndex.suggest(str(context.guild_id), context.input_text)
+        await context.send(choices=[{"name": name, "value": name} for name in names])
+
     """
     Tag All Command.
     Displays the info for every tag in the database to the user who invoked this command.
+    The tags can be sorted by name, by amount of uses or by creation date, or limited to the tags of a single author sorted by name.
     This is function is registered as a slash command using interactions.py and it automatically called when the command is invoked by a Discord user.
 
     @param context The context for which this command was invoked.
+    @param sort The order to display the tags in.
+    @param author The author to display the tags of, or None to display the tags of every author.
     """
     @slash_command(
         name="tag_all",
         description="Displays the info of every tag",
         dm_permission=False
     )
-    async def tag_all(self, context: InteractionContext):
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-
-            # Pull all of the tags from database with the same guildID.
-            res = cur.execute(f"SELECT name, content, authorID, guildID, date, amountUsed FROM tags WHERE guildID = ?", (str(context.guild_id),))
-            
-            # Store the results of our database query.
-            fetch = res.fetchall()
-            
+    @slash_option(
+        name="sort",
+        description="The order to display the tags in",
+        required=False,
+        opt_type=OptionType.STRING,
+        choices=[
+            SlashCommandChoice(name="Name", value="name"),
+            SlashCommandChoice(name="Most used", value="top"),
+            SlashCommandChoice(name="Newest", value="recent")
+        ]
+    )
+    @slash_option(
+        name="author",
+        description="Only display the tags created by this user, sorted by name",
+        required=False,
+        opt_type=OptionType.USER
+    )
+    @auto_defer()
+    async def tag_all(self, context: InteractionContext, sort: str = "name", author: Member = None):
+        try:
+            # Get the listing for the chosen order, falling back to ordering by name. The tags of a single author are always listed by name,
+            # since that is the order of the author index.
+            author_id = str(author.id) if author is not None else None
+            listing = TagExtension.TAG_LISTINGS.get(sort if author_id is None else "name", TagExtension.TAG_LISTINGS["name"])
+
+            # Count the tags with the same guildID. Only the tags on the page being shown are read from the database.
+            if (author_id is None):
+                count = (await Database.fetch_one("SELECT COUNT(*) FROM tags WHERE guildID = ?", (str(context.guild_id),)))[0]
+            else:
+                count = (await Database.fetch_one("SELECT COUNT(*) FROM tags WHERE authorID = ? AND guildID = ?", (author_id, str(context.guild_id),)))[0]
+
+            # Create a paginator which loads one tag per page as the user moves through it.
+            paginator = await LazyPaginator.create(context.client, self.create_tag_page_loader(context, listing, author_id), count)
+
+            # Check if the list of tags is empty
+            if (paginator is None):
+                # If the list of tags is empty we will respond to the user who invoked this command.
+                await context.send("There are no tags yet!")
+                return
+
+            # Respond to the user who invoked this command with the paginator.
+            await paginator.send(context)
+        except DatabaseUnavailableError:
+            # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
+            await context.send("Unable to access bot database!")
+
+    """
+    Tag Top Command.
+    Displays a leaderboard of the most used tags to the user who invoked this command.
+    This is function is registered as a slash command using interactions.py and it automatically called when the command is invoked by a Discord user.
+
+    @param context The context for which this command was invoked.
+    @param amount The amount of tags to display.
+    """
+    @slash_command(
+        name="tag_top",
+        description="Displays the most used tags",
+        dm_permission=False
+    )
+    @slash_option(
+        name="amount",
+        description="The amount of tags to display",
+        required=False,
+        opt_type=OptionType.INTEGER,
+        min_value=1,
+        max_value=25
+    )
+    async def tag_top(self, context: InteractionContext, amount: int = 10):
+        try:
+            # Pull the most used tags with the same guildID. The usage index means only these tags are read from the database.
+            fetch = await Database.fetch_all("SELECT name, amountUsed FROM tags WHERE guildID = ? ORDER BY amountUsed DESC, id DESC LIMIT ?", (str(context.guild_id), amount,))
+
             # Check if the list of tags is empty
             if (not fetch):
                 # If the list of tags is empty we will respond to the user who invoked this command.
                 await context.send("There are no tags yet!")
                 return
 
-            # Store a list of embeds for each page in the paginator.
-            embeds = []
+            # Add the uses that haven't been written to the database yet, and sort the tags again in case that changed their order.
+            leaderboard = [(tag[1] + TagUsageCounter.get_pending(str(context.guild_id), tag[0]), tag[0]) for tag in fetch]
+            leaderboard.sort(key=lambda entry: entry[0], reverse=True)
 
-            # Loop over every row in the fetched results.
-            for tag in fetch:
-                # Create an embed to display the info of the tag in.
-                embed = Embed()
-                embed.add_field(f"Name: {tag[0]}", f"Date Created: {tag[4]}\nTimes Used: {tag[5]}\n Content: {tag[1]}")
+            # Create an embed with a line for each tag and respond to the user who invoked this command with it.
+            embed = Embed(title="Most Used Tags")
+            embed.description = "\n".join(f"**{position}.** {name} - {timesUsed} use(s)" for position, (timesUsed, name) in enumerate(leaderboard, start=1))
+            await context.send(embeds=embed)
+        except DatabaseUnavailableError:
+            # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
+            await context.send("Unable to access bot database!")
 
-                # Get the user object of the author of the tag.
-                authorUser = context.client.get_user(tag[2])
+    """
+    Creates the page loader used by the tag_all paginator.
+    Tags are paged through using keyset pagination on the columns of the listing, so each page only reads the tags it shows from the database.
+    Every listing is served by an index on the tags table, which keeps the cost of a page independent of the amount of tags in the server.
+
+    @param context The context for which the tag_all command was invoked.
+    @param listing A tuple containing the key columns of the listing, and whether the listing is in descending order.
+    @param author_id The user ID of the author to list the tags of, or None to list the tags of every author.
+    @return A loader callback for a LazyPaginator.
+    """
+    @staticmethod
+    def create_tag_page_loader(context: InteractionContext, listing, author_id: str = None):
+        guild_id = str(context.guild_id)
+        columns, descending = listing
+        key = ", ".join(columns)
+        placeholders = ", ".join("?" for _ in columns)
+
+        async def load(anchor, forward: bool, limit: int):
+            # Read the listing in its own order when moving forward, and in the opposite order when moving backward.
+            ascending = forward != descending
+            order = ", ".join(f"{column} {'ASC' if ascending else 'DESC'}" for column in columns)
+
+            # Filter by server, by author if one was given, and by the position of the anchor.
+            conditions = "guildID = ?"
+            params = (guild_id,)
+            if (author_id is not None):
+                conditions += " AND authorID = ?"
+                params += (author_id,)
+            if (anchor is not None):
+                conditions += f" AND ({key}) {'>' if ascending else '<'} ({placeholders})"
+                params += anchor
+
+            try:
+                fetch = await Database.fetch_all(f"SELECT name, content, authorID, date, amountUsed, {key} FROM tags WHERE {conditions} ORDER BY {order} LIMIT ?", params + (limit,))
+            except DatabaseUnavailableError:
+                return []
+
+            # Resolve the authors of every tag being loaded in a single step.
+            users = await UserResolver.resolve(context.client, [tag[2] for tag in fetch])
+            return [(tuple(tag[5:]), TagExtension.create_tag_embed(context, guild_id, tag, users)) for tag in fetch]
+
+        return load
 
-                # Check if the user object is None.
-                if (authorUser is not None):
-                    # If the user object isn't None we will set the author of the embed to be the author's name and avatar icon.
-                    embed.set_author(authorUser.tag, icon_url=authorUser.display_avatar.url)
-                else:
-                    # If the user object is None we will set the author of the embed to be the user ID of the author.
-                    embed.set_author(f"Author ID: {tag[2]}", icon_url=context.client.user.display_avatar.url)
+    """
+    Creates the embed used to display the info of a tag in the tag_all paginator.
 
-                # Add the embed to the list of embeds.
-                embeds.append(embed)
+    @param context The context for which the tag_all command was invoked.
+    @param guild_id The guild ID of the server the tag belongs to.
+    @param tag A tuple containing the name, content, author ID, creation date and amount of uses of the tag.
+    @param users A dictionary of resolved users from the UserResolver, which includes the author of the tag.
+    @return The embed for the tag.
+    """
+    @staticmethod
+    def create_tag_embed(context: InteractionContext, guild_id: str, tag, users: dict):
+        # Create an embed to display the info of the tag in.
+        embed = Embed()
+        timesUsed = tag[4] + TagUsageCounter.get_pending(guild_id, tag[0])
+        embed.add_field(f"Name: {tag[0]}", f"Date Created: {tag[3]}\nTimes Used: {timesUsed}\n Content: {tag[1]}")
 
-            # Create a paginator from the list of embeds and respond to the user who invoked this command with it.
-            paginator = Paginator.create_from_embeds(context.client, *embeds)
-            await paginator.send(context)
+        # Set the author of the embed to the author of the tag.
+        TagExtension.set_embed_author(context, embed, tag[2], users)
+        return embed
 
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
+    """
+    Sets the author of an embed displaying a tag to the author of the tag.
+
+    @param context The context for which the command was invoked.
+    @param embed The embed.
+    @param author_id The user ID of the author of the tag.
+    @param users A dictionary of resolved users from the UserResolver, which includes the author of the tag.
+    """
+    @staticmethod
+    def set_embed_author(context: InteractionContext, embed: Embed, author_id: str, users: dict):
+        # Get the resolved author of the tag.
+        author = users.get(author_id)
+
+        # Check if the author was resolved.
+        if (author is not None):
+            # If the author was resolved we will set the author of the embed to be the author's name and avatar icon.
+            embed.set_author(author[0], icon_url=author[2])
         else:
+            # If the author couldn't be resolved we will set the author of the embed to be the user ID of the author.
+            embed.set_author(f"Author ID: {author_id}", icon_url=context.client.user.display_avatar.url)
+
+    """
+    Tag Search Command.
+    Searches the names and contents of the tags in the current server, and displays the best matching tags to the user who invoked this command.
+    This is function is registered as a slash command using interactions.py and it automatically called when the command is invoked by a Discord user.
+
+    @param context The context for which this command was invoked.
+    @param query The words to search for.
+    """
+    @slash_command(
+        name="tag_search",
+        description="Searches the names and contents of tags",
+        dm_permission=False
+    )
+    @slash_option(
+        name="query",
+        description="The words to search for",
+        required=True,
+        opt_type=OptionType.STRING
+    )
+    async def tag_search(self, context: InteractionContext, query: str):
+        # Turn the query into a full-text query which can't contain any FTS5 syntax.
+        match = TagExtension.create_search_query(query)
+        if (match is None):
+            await context.send("Your search must contain at least one word!")
+            return
+
+        # Shorten long queries when they are shown back to the user.
+        if (len(query) > TagExtension.SEARCH_QUERY_DISPLAY_LENGTH):
+            query = query[:TagExtension.SEARCH_QUERY_DISPLAY_LENGTH] + "…"
+
+        try:
+            # Search the tags with the same guildID. Matches in the name of a tag are ranked higher than matches in its content.
+            guild_filter = f'guildID : "{context.guild_id}"'
+            fetch = await Database.fetch_all("""SELECT name, snippet(tags_search, 1, '**', '**', '...', 12) FROM tags_search
+                                                WHERE tags_search MATCH ? ORDER BY bm25(tags_search, 10.0, 1.0, 0.0) LIMIT ?""",
+                                             (f"{guild_filter} AND {{name content}} : ({match})", TagExtension.SEARCH_RESULT_LIMIT,))
+
+            # Check if any tags were found.
+            if (not fetch):
+                await context.send(f"No tags matching '{query}' found!")
+                return
+
+            # Create an embed with a field for each tag and respond to the user who invoked this command with it.
+            embed = Embed(title=f"Tags matching '{query}'")
+            for tag in fetch:
+                embed.add_field(tag[0], tag[1] or "...")
+            await context.send(embeds=embed)
+        except DatabaseUnavailableError:
             # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
             await context.send("Unable to access bot database!")
 
+    """
+    Creates a full-text query from the words in a search.
+    Every word is quoted so that it can't be read as FTS5 syntax, and the last word is matched as a prefix so that partially typed words still match.
+
+    @param query The search entered by the user.
+    @return The full-text query, or None if the search doesn't contain any words.
+    """
+    @staticmethod
+    def create_search_query(query: str):
+        words = re.findall(r"\w+", query)[:TagExtension.SEARCH_WORD_LIMIT]
+        if (not words):
+            return None
+
+        terms = [f'"{word}"' for word in words]
+        terms[-1] += "*"
+        return " ".join(terms)
+
+    """
+    Returns the content and author of a tag, checking the tag cache before going to the bot database.
+
+    @param guild_id The guild ID of the server the tag belongs to.
+    @param name The tag's name.
+    @return A tuple containing the content and author ID of the tag, or None if there is no such tag.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def get_tag(guild_id: str, name: str):
+        # Check if the tag is in the tag cache before going to the database.
+        fetch = TagCache.get(guild_id, name)
+
+        if (fetch is None):
+            # Check if any tags with the same name and guildID exists in the database.
+            generation = TagCache.get_generation()
+            params = (name, guild_id,)
+            fetch = await Database.fetch_one("SELECT content, authorID FROM tags WHERE name = ? AND guildID = ?", params)
+
+            # Add the tag to the cache so the next lookup doesn't need the database.
+            if (fetch is not None):
+                TagCache.put(guild_id, name, fetch[0], fetch[1], generation)
+
+        return fetch
+
     """
     Tag Random Command.
     Displays a random tag's content to the user who invoked this command.
+    Tags are chosen from the in-memory tag name index, so choosing one doesn't need to read every tag in the server. If the weighted option is
+    enabled, tags which have been used more often are more likely to be chosen.
     This is function is registered as a slash command using interactions.py and it automatically called when the command is invoked by a Discord user.
 
     @param context The context for which this command was invoked.
+    @param weighted Whether or not tags should be weighted by the amount of times they have been used.
     """
     @slash_command(
         name="tag_random",
         description="Displays the content of a random tag",
         dm_permission=False
     )
-    async def tag_random(self, context: InteractionContext):
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-            
-            # Pull a random tag with the same guildID from the database.
-            res = cur.execute(f"SELECT name, content, amountUsed FROM tags WHERE guildID = ? ORDER BY RANDOM() LIMIT 1", (str(context.guild_id),))
-            
-            # Store the results of our database query.
-            fetch = res.fetchone()
+    @slash_option(
+        name="weighted",
+        description="Whether or not more popular tags should be more likely to be chosen",
+        required=False,
+        opt_type=OptionType.BOOLEAN
+    )
+    async def tag_random(self, context: InteractionContext, weighted: bool = False):
+        try:
+            guild_id = str(context.guild_id)
+
+            # Load the tag name index if it couldn't be loaded when the bot started.
+            if (not TagNameIndex.loaded):
+                await TagNameIndex.warm()
+
+            # Pick a random tag. If the tag was deleted after it was picked, it is removed from the name index, the weights are rebuilt and another
+            # tag is picked.
+            fetch = None
+            for attempt in range(3):
+                tagName = await TagSampler.weighted_name(guild_id) if weighted else TagNameIndex.random_name(guild_id)
+                if (tagName is None):
+                    break
+
+                fetch = await TagExtension.get_tag(guild_id, tagName)
+                if (fetch is not None):
+                    break
+                TagNameIndex.remove(guild_id, tagName)
+                TagSampler.invalidate(guild_id)
 
             # Check if there is an existing tag in the database.
             if (fetch is None):
                 await context.send("There are no tags saved to the database.")
             else:
-                # Get the tag name.
-                tagName = fetch[0]
-                
-                # Update the amountUsed counter for the tag.
-                used_counter = fetch[2]
-                used_counter += 1
-                params = (used_counter, tagName, str(context.guild_id),)
-                cur.execute(f"UPDATE tags SET amountUsed = ? WHERE name = ? AND guildID = ?", params)
-                
-                # Commit the changes to the database.
-                con.commit()
-
                 # Respond to the user who invoked this command with the content of the tag.
-                content = fetch[1]
+                content = fetch[0]
                 await context.send(f"{content}")
 
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
-        else:
+                # Record the use of the tag. The amountUsed counter is updated in the database in batches.
+                if (TagUsageCounter.increment(guild_id, tagName)):
+                    await TagUsageCounter.flush()
+        except DatabaseUnavailableError:
             # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
             await context.send("Unable to access bot database!")
-    
+
     """
     Tag Clear Command.
     Clears the bot database of tags that meet a specified condition. This command can only be used by the owner of the bot.
+    The tags are deleted in batches so the bot database isn't locked for long, and the owner is kept updated on the progress. A dry run only counts the
+    tags that would be cleared.
     This is function is registered as a slash command using interactions.py and it automatically called when the command is invoked by a Discord user.
 
     @param context The context for which this command was invoked.
     @param userid An optional argument which will cause this command to clear all tags with an author who has the specified user ID.
     @param guildid An optional argument which will cause this command to clear all tags with the specified guild ID.
+    @param dryrun An optional argument which will cause this command to only count the tags that would be cleared.
     """
     @slash_command(
         name="tag_clear",
@@ -410,7 +663,13 @@ class TagExtension(Extension):
         required=False,
         opt_type=OptionType.STRING
     )
-    async def tag_clear(self, context: InteractionContext, userid: str = "", guildid: str = ""):
+    @slash_option(
+        name="dryrun",
+        description="If enabled this command will only count the tags that would be cleared",
+        required=False,
+        opt_type=OptionType.BOOLEAN
+    )
+    async def tag_clear(self, context: InteractionContext, userid: str = "", guildid: str = "", dryrun: bool = False):
         # Check if the user invoking this command is the owner specified in the config.
         config = Config.get_config()
         if (config["owner_id"] != str(context.author_id)):
@@ -418,40 +677,254 @@ class TagExtension(Extension):
             await context.send("You are not specified as an owner in the config!")
             return
         
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-            
-            # Check the different combinations of options and delete the tags from the database based off of them.
-            if (userid == "" and guildid == ""):
-                # If no options are specified we will delete all tags from the database.
-                params = (str(context.guild_id),)
-                cur.execute(f"DELETE FROM tags")
-            elif (userid != "" and guildid == ""):
-                # If a user ID is specified but not a guild ID, we will delete all tags with the specified user ID.
-                params = (userid,)
-                cur.execute(f"DELETE FROM tags WHERE authorID = ?", params)
-            elif (userid == "" and guildid != ""):
-                # If a guild ID is specified but not a user ID, we will delete all tags with the specified guild ID.
-                params = (guildid,)
-                cur.execute(f"DELETE FROM tags WHERE guildID = ?", params)
-            else:
-                # If both a user ID and guild ID is specified, we will delete all tags with the specified user ID and guild ID.
-                params = (userid, guildid,)
-                cur.execute(f"DELETE FROM tags WHERE authorID = ? AND guildID = ?", params)
-             
-            # Commit the changes to the database.
-            con.commit()
+        try:
+            # Match the tags based off of the combination of options that were specified. If no options are specified every tag is matched.
+            conditions, params = BulkDelete.get_conditions({"authorID": userid, "guildID": guildid})
+
+            # Check if this is a dry run.
+            if (dryrun):
+                # If this is a dry run we will only count the tags that would be cleared and respond to the user who invoked this command.
+                count = await BulkDelete.count("tags", conditions, params)
+                await context.send(f"Dry run: {count} tag(s) would be cleared from database with specified conditions.")
+                return
 
-            # Respond to the user who invoked this command.
-            await context.send("Cleared tags from database with specified conditions.")
+            # Write any pending usage counts first so none are left over for tags that are about to be deleted.
+            await TagUsageCounter.flush()
 
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
+            try:
+                # Delete the tags in batches. This responds to the user who invoked this command with the progress.
+                await BulkDelete.run(context, "tags", conditions, params, "tag(s)")
+            finally:
+                # Update the in-memory tag data, even if only some of the batches were deleted.
+                await TagExtension.forget_cleared_tags(userid, guildid)
+        except DatabaseUnavailableError:
+            # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
+            await context.send("Unable to access bot database!")
+
+    """
+    Removes tags cleared by the tag_clear command from the tag cache, the tag name index, the tag sampler and the pending tag usage counts.
+
+    @param userid The user ID the tags were cleared for, or an empty string if they were cleared for every user.
+    @param guildid The guild ID the tags were cleared for, or an empty string if they were cleared for every server.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def forget_cleared_tags(userid: str, guildid: str):
+        if (userid == "" and guildid == ""):
+            TagCache.clear()
+            TagNameIndex.clear()
+            TagSampler.clear()
+            TagUsageCounter.discard()
+        elif (userid != "" and guildid == ""):
+            TagCache.invalidate_author(userid)
+            TagSampler.clear()
+            await TagNameIndex.warm()
+        elif (userid == "" and guildid != ""):
+            TagCache.invalidate_guild(guildid)
+            TagNameIndex.remove_guild(guildid)
+            TagSampler.invalidate(guildid)
+            TagUsageCounter.discard(guildid)
         else:
+            TagCache.invalidate_author(userid, guildid)
+            TagSampler.invalidate(guildid)
+            await TagNameIndex.load_guild(guildid)
+
+        # The pending usage counts don't know the author of each tag, so when only an author's tags were cleared the counts are written now.
+        # Counts of the cleared tags then match no rows, instead of being added to a tag which is later created with the same name.
+        if (userid != ""):
+            await TagUsageCounter.flush()
+
+    """
+    Tag Export Command.
+    Exports tags from the bot database to a file, which is sent to the user who invoked this command. This command can only be used by the owner of the bot.
+    This is function is registered as a slash command using interactions.py and it automatically called when the command is invoked by a Discord user.
+
+    @param context The context for which this command was invoked.
+    @param format The format of the file, either "ndjson" or "csv".
+    @param guildid An optional argument which will cause this command to only export the tags with the specified guild ID.
+    """
+    @slash_command(
+        name="tag_export",
+        description="Exports tags to a file. Only the owner of the bot can use this command",
+        dm_permission=False
+    )
+    @slash_option(
+        name="format",
+        description="The format of the file",
+        required=False,
+        opt_type=OptionType.STRING,
+        choices=[
+            SlashCommandChoice(name="NDJSON", value="ndjson"),
+            SlashCommandChoice(name="CSV", value="csv")
+        ]
+    )
+    @slash_option(
+        name="guildid",
+        description="If specified this command will only export tags created within a server with the guildID",
+        required=False,
+        opt_type=OptionType.STRING
+    )
+    @auto_defer()
+    async def tag_export(self, context: InteractionContext, format: str = "ndjson", guildid: str = ""):
+        # Check if the user invoking this command is the owner specified in the config.
+        config = Config.get_config()
+        if (config["owner_id"] != str(context.author_id)):
+            # If the user is not the owner we will respond to the user and tell them so.
+            await context.send("You are not specified as an owner in the config!")
+            return
+
+        # Create a temporary file to export the tags to.
+        descriptor, path = tempfile.mkstemp(suffix=f".{format}")
+        os.close(descriptor)
+
+        try:
+            # Write any pending usage counts first so the exported amounts of uses are up to date.
+            await TagUsageCounter.flush()
+
+            # Export the tags on a database thread, so the file is written without holding up the bot.
+            exported = await Database.read(TagTransfer.export_tags, path, format, guildid or None)
+
+            # Check if the file is too large to be sent.
+            if (os.path.getsize(path) > TagExtension.MAX_EXPORT_SIZE):
+                await context.send(f"The export of {exported} tag(s) is too large to send! Use `python -m util.tag_transfer export` while the bot is stopped instead.")
+                return
+
+            # Respond to the user who invoked this command with the file.
+            await context.send(f"Exported {exported} tag(s).", file=File(path, file_name=f"tags.{format}"))
+        except DatabaseUnavailableError:
             # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
-            await context.send("Unable to access bot database!")
\ No newline at end of file
+            await context.send("Unable to access bot database!")
+        finally:
+            # Delete the temporary file.
+            os.remove(path)
+
+    """
+    Tag Import Command.
+    Imports tags from a file attached by the user who invoked this command into the bot database. This command can only be used by the owner of the bot.
+    The file is in the format written by the tag_export command, and tags whose name is already used in their server are either skipped or replaced.
+    This is function is registered as a slash command using interactions.py and it automatically called when the command is invoked by a Discord user.
+
+    @param context The context for which this command was invoked.
+    @param file The attached file to import the tags from.
+    @param guildid An optional argument which will cause this command to import every tag into the server with the specified guild ID.
+    @param onconflict What to do with tags whose name is already used in their server, either "skip" or "replace".
+    """
+    @slash_command(
+        name="tag_import",
+        description="Imports tags from a file. Only the owner of the bot can use this command",
+        dm_permission=False
+    )
+    @slash_option(
+        name="file",
+        description="An NDJSON or CSV file exported by the tag_export command",
+        required=True,
+        opt_type=OptionType.ATTACHMENT
+    )
+    @slash_option(
+        name="guildid",
+        description="If specified this command will import every tag into the server with the guildID",
+        required=False,
+        opt_type=OptionType.STRING
+    )
+    @slash_option(
+        name="onconflict",
+        description="What to do with tags whose name is already used in their server",
+        required=False,
+        opt_type=OptionType.STRING,
+        choices=[
+            SlashCommandChoice(name="Skip", value="skip"),
+            SlashCommandChoice(name="Replace", value="replace")
+        ]
+    )
+    @auto_defer()
+    async def tag_import(self, context: InteractionContext, file: Attachment, guildid: str = "", onconflict: str = "skip"):
+        # Check if the user invoking this command is the owner specified in the config.
+        config = Config.get_config()
+        if (config["owner_id"] != str(context.author_id)):
+            # If the user is not the owner we will respond to the user and tell them so.
+            await context.send("You are not specified as an owner in the config!")
+            return
+
+        # The aiohttp library is only needed to download the file, so it is imported when a file is imported.
+        import aiohttp
+
+        # Create a temporary file to download the attached file to.
+        descriptor, path = tempfile.mkstemp()
+        os.close(descriptor)
+
+        # The guild IDs of the tags that were read from the file and sent to the bot database.
+        guild_ids = set()
+        try:
+            # Download the attached file in chunks, so it is never held in memory all at once.
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(file.url) as response:
+                        response.raise_for_status()
+                        with open(path, "wb") as output:
+                            async for chunk in response.content.iter_chunked(65536):
+                                output.write(chunk)
+            except aiohttp.ClientError:
+                await context.send("Unable to download the attached file!")
+                return
+
+            # Write any pending usage counts first so they are added to the tags before any of them are replaced.
+            await TagUsageCounter.flush()
+
+            read = 0
+            imported = 0
+            sql = TagTransfer.get_insert_sql(onconflict)
+            try:
+                with open(path, "r", encoding="utf-8", newline="") as tag_file:
+                    batches = TagTransfer.batch_tags(TagTransfer.read_tags(tag_file, TagTransfer.get_format(file.filename), guildid or None))
+                    while (True):
+                        # Read the next batch from the file on a background thread.
+                        batch = await asyncio.to_thread(next, batches, None)
+                        if (batch is None):
+                            break
+
+                        # Insert each batch as its own write, so the database writer thread can run other writes between batches.
+                        guild_ids.update(tag[0] for tag in batch)
+                        imported += await Database.execute_many(sql, batch)
+                        read += len(batch)
+            except (UnicodeDecodeError, ValueError, csv.Error) as error:
+                await context.send(f"Unable to import the attached file, some tags may have been imported: {error}")
+                return
+
+            # Respond to the user who invoked this command.
+            await context.send(f"Read {read} tag(s) from the attached file and imported {imported} of them.")
+        except DatabaseUnavailableError:
+            # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
+            await context.send("Unable to access bot database!")
+        finally:
+            # Delete the temporary file.
+            os.remove(path)
+
+            # Update the in-memory tag data for the servers that tags were sent to the bot database for, if there were any.
+            if (guild_ids):
+                try:
+                    await TagExtension.forget_imported_tags(guild_ids)
+                except DatabaseUnavailableError:
+                    pass
+
+    """
+    Updates the tag cache, the tag name index, the tag sampler and the member cache after tags were imported by the tag_import command.
+
+    @param guild_ids A set of the guild IDs of the servers tags were imported into.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def forget_imported_tags(guild_ids: set):
+        if (len(guild_ids) > TagExtension.IMPORT_RELOAD_THRESHOLD):
+            # Reload the whole index at once when tags were imported into many servers.
+            TagCache.clear()
+            await TagNameIndex.warm()
+        else:
+            for guild_id in guild_ids:
+                TagCache.invalidate_guild(guild_id)
+                await TagNameIndex.load_guild(guild_id)
+
+        for guild_id in guild_ids:
+            TagSampler.invalidate(guild_id)
+
+        # The authors of the imported tags are referenced by the bot database now.
+        await MemberCachePolicy.load_references()
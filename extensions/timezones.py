@@ -1,20 +1,57 @@
-import geocoder
+import asyncio
 from datetime import datetime
-from zoneinfo import ZoneInfo
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import os
 import sys
 
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(parent_dir)
 from util.config_manager import Config
-from util.database_manager import Database
+from util.database_manager import Database, DatabaseUnavailableError
+from util.gazetteer import Gazetteer
+from util.geocode_cache import GeocodeCache
+from util.lazy_paginator import LazyPages, LazyPaginator
+from util.member_cache_policy import MemberCachePolicy
+from util.user_resolver import UserResolver
+from util.bulk_delete import BulkDelete
 
-from interactions import Extension, InteractionContext, OptionType, slash_command, slash_option, auto_defer
+from interactions import listen, Extension, InteractionContext, OptionType, slash_command, slash_option, auto_defer
+from interactions.api.events import Startup
+from interactions.ext.paginators import Page
+
+"""
+This exception is raised when the GeoNames API couldn't be reached or returned an error instead of a result.
+"""
+class GeocodeLookupError(Exception):
+    pass
 
 """
 A class representing an extension of the bot. This extention contains the functionality for the timezone slash commands provided by the bot.
 """
 class TimezonesExtension(Extension):
+    zones = {}
+
+    # The maximum amount of users listed on a single page of the timezone listing.
+    USERS_PER_PAGE = 50
+
+    """
+    Startup event listener.
+    This is a callback function that is called when a Startup event is triggered.
+    This function will initialize the extension.
+
+    @param event The event context.
+    """
+    @listen(Startup)
+    async def on_startup(self, event: Startup):
+        await self.initialize()
+
+    """
+    Initializes the extension once the bot has started.
+    This function will load the offline GeoNames gazetteer on a background thread so that it doesn't delay the bot.
+    """
+    async def initialize(self):
+        await asyncio.to_thread(Gazetteer.load_from_config)
+
     """
     Timezone Set Command.
     Registers the timezone for a user in the current server.
@@ -36,66 +73,122 @@ class TimezonesExtension(Extension):
     )
     @auto_defer()
     async def timezone_set(self, context: InteractionContext, city: str):
-        # Gets the GeoName API username from the config.
-        api_username = Config.get_config()["geoname_api_username"]
-        
-        # Creates an object to store our GeoName API response in.
-        geonameCity = ""
+        # Look up the city in the offline gazetteer first.
+        geonameCity = Gazetteer.lookup(city)
 
-        try:
-            # Attempt to query the GeoName API with the given city name and API username.
-            geonameCity = geocoder.geonames(location=city, key=api_username, fuzzy=0, isNameRequired=True, featureClass="P", cities="cities15000")
-        except:
-            # If an invalid API username was provided a message will be sent to the user who invoked this command.
-            await context.send("Invalid GeoNames API username provided in config! This command will not work until the issue is resolved.")
-            return
+        # If the city isn't in the gazetteer we will fall back to the GeoNames API, if it is enabled in the config.
+        if (geonameCity is None and Config.get_config().get("geonames_online_fallback", True)):
+            # Check if this city has been looked up with the GeoNames API before.
+            cached, geonameCity = await GeocodeCache.get(city)
+
+            if (not cached):
+                # Gets the GeoName API username from the config.
+                api_username = Config.get_config()["geoname_api_username"]
+
+                try:
+                    # Attempt to query the GeoName API with the given city name and API username on a background thread.
+                    geonameCity = await asyncio.to_thread(TimezonesExtension.lookup_city_online, city, api_username)
+                except ValueError:
+                    # If no API username was provided a message will be sent to the user who invoked this command.
+                    await context.send("Invalid GeoNames API username provided in config! This command will not work until the issue is resolved.")
+                    return
+                except GeocodeLookupError as error:
+                    # If the GeoNames API couldn't be reached or refused the request we will tell the user who invoked this command.
+                    # The error isn't cached, so the city is looked up again the next time.
+                    await context.send(f"Unable to look up the city with the GeoNames API ({error}). Please try again later.")
+                    return
+
+                # Cache the result, even if the city was not recognized, so the next lookup doesn't need the GeoNames API.
+                await GeocodeCache.put(city, geonameCity)
 
         # Check if the the city name provided by the user resulted in an actual place.
-        if (geonameCity.geonames_id is None):
+        if (geonameCity is None):
             # If no places were found with the given city name we will tell the user who invoked this command.
             await context.send("City name not recognized!")
             return
-        
-        # Get the timezone of the resulting location by querying the GeoName API.
-        geonameTimezone = geocoder.geonames(geonameCity.geonames_id, method="details", key=api_username).timeZoneId
 
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-        
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-            
-            # Query the databse for any rows with the current userID and guildID.
-            params = (str(context.author_id), str(context.guild_id),)
-            res = cur.execute(f"SELECT userID, guildID FROM timezones WHERE userID = ? AND guildID = ?", params)
-            
-            # Store the results of our database query.
-            fetch = res.fetchone()
-            
-            # Build a new list of parameters for the upcoming database query.
-            params = (geonameTimezone, str(context.author_id), str(context.guild_id),)
-
-            # Check if this user already has a timezone set for this server.
-            if (fetch is None):
-                # If the user does not have their timezone set for this server, we will add it to the database.
-                cur.execute("INSERT INTO timezones VALUES (?, ?, ?)", params)
+        # Get the timezone of the resulting location.
+        geonameTimezone = geonameCity[1]
+
+        try:
+            # Register the timezone for this user in the database.
+            updated = await Database.write(TimezonesExtension.register_timezone, geonameTimezone, str(context.author_id), str(context.guild_id))
+            MemberCachePolicy.add_reference(str(context.guild_id), str(context.author_id))
+
+            # Check if this user already had a timezone set for this server.
+            if (not updated):
                 await context.send("City found! Registered your timezone for this server.")
             else:
-                # If the user already has their timezone set for this server, we will update their timezone.
-                cur.execute(f"UPDATE timezones SET timezone = ? WHERE userID = ? AND guildID = ?", params)
                 await context.send("City found! Updated your timezone for this server.")
-            
-            # Commit the changes to the database.
-            con.commit()
-
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
-        else:
+        except DatabaseUnavailableError:
             # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
             await context.send("Unable to access bot database!")
-    
+
+    """
+    Looks up a city using the GeoNames API. This makes two blocking HTTP requests, so it should be run on a background thread.
+
+    @param city The name of the city.
+    @param api_username The GeoNames API username.
+    @return A tuple containing the GeoNames ID and timezone of the city, or None if no city with the given name and a timezone was found.
+    @throws GeocodeLookupError If the GeoNames API couldn't be reached or returned an error, such as for an invalid username or an exceeded quota.
+    @throws ValueError If no API username was given.
+    """
+    @staticmethod
+    def lookup_city_online(city: str, api_username: str):
+        # The geocoder library imports requests and several other modules, so it is only imported the first time a city is looked up online.
+        import geocoder
+
+        # Query the GeoName API with the given city name and API username.
+        geonameCity = geocoder.geonames(location=city, key=api_username, fuzzy=0, isNameRequired=True, featureClass="P", cities="cities15000")
+
+        # Only an answer without any results means the city wasn't recognized. Connection and API errors are reported separately.
+        if (geonameCity.error):
+            raise GeocodeLookupError(geonameCity.error)
+        if (not geonameCity.ok or geonameCity.geonames_id is None):
+            return None
+
+        # Get the timezone of the resulting location by querying the GeoName API.
+        geonameDetails = geocoder.geonames(geonameCity.geonames_id, method="details", key=api_username)
+        if (geonameDetails.error):
+            raise GeocodeLookupError(geonameDetails.error)
+
+        # A place without a timezone can't be registered, so it is treated the same as a city that wasn't recognized.
+        if (not geonameDetails.ok or not geonameDetails.timeZoneId):
+            return None
+        return (geonameCity.geonames_id, geonameDetails.timeZoneId)
+
+    """
+    Registers or updates the timezone for a user in a server.
+    This function is run on the database writer thread so the check and the write happen in the same transaction.
+
+    @param con The connection to the bot database.
+    @param timezone The timezone to register.
+    @param user_id The user ID of the user registering their timezone.
+    @param guild_id The guild ID of the server the timezone is registered in.
+    @return True if an existing registration was updated, False if a new one was added.
+    """
+    @staticmethod
+    def register_timezone(con, timezone: str, user_id: str, guild_id: str):
+        # Create a cursor to query the database.
+        cur = con.cursor()
+
+        # Query the databse for any rows with the current userID and guildID.
+        params = (user_id, guild_id,)
+        fetch = cur.execute("SELECT userID, guildID FROM timezones WHERE userID = ? AND guildID = ?", params).fetchone()
+
+        # Build a new list of parameters for the upcoming database query.
+        params = (timezone, user_id, guild_id,)
+
+        # Check if this user already has a timezone set for this server.
+        if (fetch is None):
+            # If the user does not have their timezone set for this server, we will add it to the database.
+            cur.execute("INSERT INTO timezones(timezone, userID, guildID) VALUES (?, ?, ?)", params)
+            return False
+        else:
+            # If the user already has their timezone set for this server, we will update their timezone.
+            cur.execute("UPDATE timezones SET timezone = ? WHERE userID = ? AND guildID = ?", params)
+            return True
+
     """
     Timezone Get Command.
     Displays the registered timezone for a user in the current server.
@@ -109,20 +202,10 @@ class TimezonesExtension(Extension):
         dm_permission=False
     )
     async def timezone_get(self, context: InteractionContext):
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-        
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-            
+        try:
             # Query the databse for any rows with the current userID and guildID.
             params = (str(context.author_id), str(context.guild_id),)
-            res = cur.execute(f"SELECT timezone FROM timezones WHERE userID = ? AND guildID = ?", params)
-            
-            # Store the results of our database query.
-            fetch = res.fetchone()
+            fetch = await Database.fetch_one("SELECT timezone FROM timezones WHERE userID = ? AND guildID = ?", params)
 
             # Check if this user has a timezone set for this server.
             if (fetch is None):
@@ -133,13 +216,10 @@ class TimezonesExtension(Extension):
                 timezone = fetch[0]
                 currentTime = datetime.now(tz=ZoneInfo(timezone)).strftime("%H:%M")
                 await context.send(f"Your timezone is: `{timezone}`\nThe current time is: `{currentTime}`")
-
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
-        else:
+        except DatabaseUnavailableError:
             # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
             await context.send("Unable to access bot database!")
-    
+
     """
     Timezone Remove Command.
     Removes the registered timezone for a user in the current server.
@@ -153,20 +233,10 @@ class TimezonesExtension(Extension):
         dm_permission=False
     )
     async def timezone_remove(self, context: InteractionContext):
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-        
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-            
+        try:
             # Query the databse for any rows with the current userID and guildID.
             params = (str(context.author_id), str(context.guild_id),)
-            res = cur.execute(f"SELECT timezone FROM timezones WHERE userID = ? AND guildID = ?", params)
-            
-            # Store the results of our database query.
-            fetch = res.fetchone()
+            fetch = await Database.fetch_one("SELECT timezone FROM timezones WHERE userID = ? AND guildID = ?", params)
 
             # Check if this user has a timezone set for this server.
             if (fetch is None):
@@ -174,18 +244,14 @@ class TimezonesExtension(Extension):
                 await context.send("You have not registered your timezone in this server!")
             else:
                 # Delete the user's timezone for this server from the database.
-                cur.execute(f"DELETE FROM timezones WHERE userID = ? AND guildID = ?", params)
-                con.commit()
+                await Database.execute("DELETE FROM timezones WHERE userID = ? AND guildID = ?", params)
 
                 # Respond to the user and tell them that their timezone has been removed.
                 await context.send(f"Your timezone has been removed from this server.")
-
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
-        else:
+        except DatabaseUnavailableError:
             # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
             await context.send("Unable to access bot database!")
-    
+
     """
     Timezone List Command.
     Lists the time for all users with registered timezones in the current server.
@@ -198,88 +264,140 @@ class TimezonesExtension(Extension):
         description="Lists the time for all users with registered timezones in the current server",
         dm_permission=False
     )
+    @auto_defer()
     async def timezone_list(self, context: InteractionContext):
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-        
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-            
-            # Query the databse for any rows with the current guildID.
+        try:
+            # Query the databse for the registered users of every timezone with the current guildID.
             params = (str(context.guild_id),)
-            res = cur.execute(f"SELECT timezone, userID FROM timezones WHERE guildID = ?", params)
-            
-            # Store the results of our database query.
-            fetch = res.fetchall()
+            fetch = await Database.fetch_all("SELECT timezone, group_concat(userID) FROM timezones WHERE guildID = ? GROUP BY timezone", params)
 
             # Checks if the results list is empty.
             if (not fetch):
                 # If the list is empty we will send a message, to the user who invoked this command, saying so.
                 await context.send("No users have registered their timezone yet!")
                 return
-            
-            # Create a dictionary to store the users with registered timezones.
-            user_dict = {}
-
-            # Loop through all the users with registered timezones in this server.
-            for timezone in fetch:
-                # Get the current time and username for all people with registered timezones.
-                time = datetime.now(tz=ZoneInfo(timezone[0])).strftime("%H:%M")
-
-                # Get the user of the timezone.
-                user_name = ""
-                user = context.client.get_user(timezone[1])
-
-                # Check if the user is None.
-                if (user is not None):
-                    # If the user is not None we will get the user's display name.
-                    user_name = user.display_name
-                else:
-                    # If the user is None we will display the user's ID.
-                    user_name = f"User ID: {timezone[1]}"
-
-                # Put the users in a dictionary.
-                if (time in user_dict):
-                    user_dict[time].append(user_name)
-                else:
-                    user_dict[time] = [user_name]
-            
-            # Get all the times from the user dictionary.
-            timezone_list = list(user_dict.keys())
-
-            # Sort the times.
-            sorted_timezone_list = sorted(timezone_list, key=lambda x: float(f"{x[0:2]}{float(x[3:4])/60.0 * 100.0}"))
-            
-            # Sort the users using the sorted times.
-            sorted_user_dict = {k: user_dict[k] for k in sorted_timezone_list if k in user_dict}
-
-            # Start building a list to send in the message.
-            message = "Registered timezones for this server:\n```\n"
-            
-            # Add every time to the list and list every user with that time alongside it.
-            for time_display, name_list in sorted_user_dict.items():
-                message = f"{message}{time_display} - [{', '.join(name_list)}]\n"
-            message = message + "```"
-
-            # Send the list to the user who invoked this command.
-            await context.send(message)
-
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
-        else:
+
+            # Group the timezones by their current UTC offset, sorted from the earliest to the latest time.
+            buckets = TimezonesExtension.get_offset_buckets(fetch)
+
+            # Split each bucket into pages with a limited amount of users, so every page fits in a single embed.
+            sources = []
+            limit = TimezonesExtension.USERS_PER_PAGE
+            for offset, _, user_ids in buckets:
+                for start in range(0, len(user_ids), limit):
+                    sources.append((offset, user_ids[start:start + limit]))
+
+            # Check if every registered timezone was invalid.
+            if (not sources):
+                await context.send("No users have registered their timezone yet!")
+                return
+
+            # Create a paginator which only looks up the names of the users on the pages being loaded, and send it to the user who invoked this command.
+            async def render(page_sources):
+                users = await UserResolver.resolve(context.client, [user_id for _, user_ids in page_sources for user_id in user_ids])
+                return [TimezonesExtension.create_timezone_page(offset, user_ids, users) for offset, user_ids in page_sources]
+
+            paginator = await LazyPaginator.create(context.client, LazyPages.create_source_loader(sources, render), len(sources))
+            await paginator.send(context)
+        except DatabaseUnavailableError:
             # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
             await context.send("Unable to access bot database!")
-    
+
+    """
+    Returns the ZoneInfo for a timezone name. Timezones are cached, including names that aren't valid timezones so they are only looked up once.
+
+    @param name The name of the timezone.
+    @return The ZoneInfo for the timezone, or None if it isn't a valid timezone.
+    """
+    @staticmethod
+    def get_zone(name: str):
+        if (name not in TimezonesExtension.zones):
+            try:
+                TimezonesExtension.zones[name] = ZoneInfo(name)
+            except (ZoneInfoNotFoundError, ValueError):
+                TimezonesExtension.zones[name] = None
+
+        return TimezonesExtension.zones[name]
+
+    """
+    Groups the registered users of each timezone by the current UTC offset of their timezone.
+    The current time is read once, and the offset of each distinct timezone is computed once, no matter how many users registered it.
+
+    @param rows A list of tuples containing a timezone and a comma separated list of the user IDs registered to it.
+    @return A list of tuples containing the UTC offset, the current time at that offset and the user IDs with that offset, sorted by the offset.
+    """
+    @staticmethod
+    def get_offset_buckets(rows):
+        now = datetime.now(tz=TimezonesExtension.get_zone("UTC"))
+        buckets = {}
+
+        for zone_name, user_ids in rows:
+            # Skip any timezones that aren't valid anymore.
+            zone = TimezonesExtension.get_zone(zone_name)
+            if (zone is None):
+                continue
+
+            # Timezones with the same offset share a bucket, since they show the same time.
+            offset = now.astimezone(zone).utcoffset()
+            if (offset not in buckets):
+                buckets[offset] = (offset, (now + offset).strftime("%H:%M"), [])
+            buckets[offset][2].extend(user_ids.split(","))
+
+        return sorted(buckets.values(), key=lambda bucket: bucket[0])
+
+    """
+    Creates a page of the timezone listing, with the current time at a UTC offset and the users whose timezone has that offset.
+    The time is read when the page is created, so it stays current while the user moves through the listing.
+
+    @param offset The UTC offset of the page.
+    @param user_ids The user IDs of the users on the page.
+    @param users A dictionary of resolved users from the UserResolver, which includes every user on the page.
+    @return The page of the listing.
+    """
+    @staticmethod
+    def create_timezone_page(offset, user_ids: list, users: dict):
+        # Get the current time at the offset.
+        time_display = (datetime.now(tz=TimezonesExtension.get_zone("UTC")) + offset).strftime("%H:%M")
+
+        # Format the offset in hours and minutes, such as UTC+05:30.
+        minutes = int(offset.total_seconds()) // 60
+        sign = "+" if minutes >= 0 else "-"
+        offset_display = f"UTC{sign}{abs(minutes) // 60:02d}:{abs(minutes) % 60:02d}"
+
+        names = "\n".join(TimezonesExtension.get_user_name(user_id, users) for user_id in user_ids)
+        return Page(names, title=f"Registered timezones for this server: {time_display} ({offset_display})")
+
+    """
+    Returns the name to display for a user in a timezone listing.
+
+    @param user_id The user ID of the user.
+    @param users A dictionary of resolved users from the UserResolver, which includes the user.
+    @return The display name of the user, or their user ID if the user isn't available.
+    """
+    @staticmethod
+    def get_user_name(user_id: str, users: dict):
+        # Get the resolved user of the timezone.
+        user = users.get(user_id)
+
+        # Check if the user is None.
+        if (user is not None):
+            # If the user is not None we will get the user's display name.
+            return user[1]
+
+        # If the user is None we will display the user's ID.
+        return f"User ID: {user_id}"
+
     """
     Timezone Clear Command.
     Clears the bot database of timezone registrations that meet a specified condition. This command can only be used by the owner of the bot.
+    The registrations are deleted in batches so the bot database isn't locked for long, and the owner is kept updated on the progress. A dry run only
+    counts the registrations that would be cleared.
     This is function is registered as a slash command using interactions.py and it automatically called when the command is invoked by a Discord user.
 
     @param context The context for which this command was invoked.
     @param userid An optional argument which will cause this command to clear all timezone registrations with the specified user ID.
     @param guildid An optional argument which will cause this command to clear all timezone registrations with the specified guild ID.
+    @param dryrun An optional argument which will cause this command to only count the timezone registrations that would be cleared.
     """
     @slash_command(
         name="timezone_clear",
@@ -298,7 +416,13 @@ class TimezonesExtension(Extension):
         required=False,
         opt_type=OptionType.STRING
     )
-    async def timezone_clear(self, context: InteractionContext, userid: str = "", guildid: str = ""):
+    @slash_option(
+        name="dryrun",
+        description="If enabled this command will only count the timezone registrations that would be cleared",
+        required=False,
+        opt_type=OptionType.BOOLEAN
+    )
+    async def timezone_clear(self, context: InteractionContext, userid: str = "", guildid: str = "", dryrun: bool = False):
         # Check if the user invoking this command is the owner specified in the config.
         config = Config.get_config()
         if (config["owner_id"] != str(context.author_id)):
@@ -306,40 +430,19 @@ class TimezonesExtension(Extension):
             await context.send("You are not specified as an owner in the config!")
             return
         
-        # Get a connection to the bot database.
-        con = Database.get_connection()
-
-        # Check if the connection is valid.
-        if (con is not None):
-            # Create a cursor to query the database.
-            cur = con.cursor()
-            
-            # Check the different combinations of options and delete the timezone registrations from the database based off of them.
-            if (userid == "" and guildid == ""):
-                # If no options are specified we will delete all timezone registrations from the database.
-                params = (str(context.guild_id),)
-                cur.execute(f"DELETE FROM timezones")
-            elif (userid != "" and guildid == ""):
-                # If a user ID is specified but not a guild ID, we will delete all timezone registrations with the specified user ID.
-                params = (userid,)
-                cur.execute(f"DELETE FROM timezones WHERE userID = ?", params)
-            elif (userid == "" and guildid != ""):
-                # If a guild ID is specified but not a user ID, we will delete all timezone registrations with the specified guild ID.
-                params = (guildid,)
-                cur.execute(f"DELETE FROM timezones WHERE guildID = ?", params)
-            else:
-                # If both a user ID and guild ID is specified, we will delete all timezone registrations with the specified user ID and guild ID.
-                params = (userid, guildid,)
-                cur.execute(f"DELETE FROM timezones WHERE userID = ? AND guildID = ?", params)
-             
-            # Commit the changes to the database.
-            con.commit()
-
-            # Respond to the user who invoked this command.
-            await context.send("Cleared timezone registrations from database with specified conditions.")
-
-            # Close the connection to the database now that we are done accessing it.
-            con.close()
-        else:
+        try:
+            # Match the timezone registrations based off of the combination of options that were specified. If no options are specified every registration is matched.
+            conditions, params = BulkDelete.get_conditions({"userID": userid, "guildID": guildid})
+
+            # Check if this is a dry run.
+            if (dryrun):
+                # If this is a dry run we will only count the timezone registrations that would be cleared and respond to the user who invoked this command.
+                count = await BulkDelete.count("timezones", conditions, params)
+                await context.send(f"Dry run: {count} timezone registration(s) would be cleared from database with specified conditions.")
+                return
+
+            # Delete the timezone registrations in batches. This responds to the user who invoked this command with the progress.
+            await BulkDelete.run(context, "timezones", conditions, params, "timezone registration(s)")
+        except DatabaseUnavailableError:
             # If we are unable to get a valid connection to the database we will respond the user who invoked this command and tell them so.
-            await context.send("Unable to access bot database!")
\ No newline at end of file
+            await context.send("Unable to access bot database!")
@@ -1,24 +1,47 @@
-from util.config_manager import Config
-from util.database_manager import Database
-from extensions.database_cleanup import DatabaseCleanupExtension
+import time
 
-from interactions import Intents, Client, listen
+# Record when the process started, before anything else is imported, so the startup profile covers the whole startup.
+start_time = time.perf_counter()
 
+from util.startup_profiler import StartupProfiler
+StartupProfiler.set_start_time(start_time)
+
+with StartupProfiler.measure("import bot modules"):
+    from util.config_manager import Config
+    from util.database_manager import Database, DatabaseUnavailableError
+    from util.member_cache_policy import MemberCachePolicy
+    from util.tag_usage_counter import TagUsageCounter
+
+    from interactions import Intents, Client, listen
+
+# The extensions of the bot, in the order they are loaded.
+EXTENSIONS = ["general", "tags", "blacklist", "timezones", "database_cleanup", "database_maintenance"]
 
 # Get the config for the bot.
-Config.read_config()
-config = Config.get_config()
+with StartupProfiler.measure("read config"):
+    Config.read_config()
+    config = Config.get_config()
 
 # Setup the bot database.
-Database.setup_bot_database()
+with StartupProfiler.measure("setup bot database"):
+    Database.setup_bot_database()
+
+# Work out which extensions are loaded after the bot is ready instead of before it connects to discord.
+deferred_extensions = [name for name in EXTENSIONS if name in config["deferred_extensions"]]
+for name in config["deferred_extensions"]:
+    if (name not in EXTENSIONS):
+        print(f"Warning: Unknown extension '{name}' in deferred_extensions, ignoring it.")
 
-# Create a client instance for connecting to discord.
+# Create a client instance for connecting to discord. The member cache policy in the config decides how many members are kept in memory.
+# The slash commands of deferred extensions aren't known when the commands are first synchronised with discord, so unused commands are
+# only deleted when no extensions are deferred. Otherwise the commands of deferred extensions would be deleted and created again on every
+# restart, which changes their IDs, drops their permission overrides and uses up discord's daily command creation limit.
 client = Client(
         token=config["token"],
         intents=Intents.new(default=True, message_content=True, guild_members=True, direct_messages=True),
-        delete_unused_application_cmds=True,
-        fetch_members=True,
-        send_command_tracebacks=False)
+        delete_unused_application_cmds=not deferred_extensions,
+        send_command_tracebacks=False,
+        **MemberCachePolicy.get_client_options())
 
 # Check if the testing mode is enabled in the config.
 if (config["testing_mode_enabled"]):
@@ -27,19 +50,67 @@ if (config["testing_mode_enabled"]):
     client.send_command_tracebacks=True
     client.debug_scope=config["testing_guild_id"]
 
+# Whether the bot has finished starting up, which is when it first becomes ready.
+startup_state = {"finished": False}
+
+"""
+Loads an extension of the bot and measures how long importing and loading it took.
+
+@param name The name of the extension's module in the extensions package.
+"""
+def load_extension(name: str):
+    with StartupProfiler.measure(f"load extension {name}"):
+        client.load_extension(name=f".{name}", package="extensions")
+
+"""
+Loads the deferred extensions once the bot is ready.
+The Startup event has already been dispatched by then, so the initialize() method of each deferred extension, which its Startup listener
+would otherwise call, is called directly.
+The slash commands of the deferred extensions are synchronised with discord by interactions.py when they are loaded.
+"""
+async def load_deferred_extensions():
+    for name in deferred_extensions:
+        load_extension(name)
+
+        # Find the extensions created from the module that was just loaded and initialize the ones that have startup work.
+        for extension in list(client.ext.values()):
+            if (type(extension).__module__ == f"extensions.{name}" and hasattr(extension, "initialize")):
+                with StartupProfiler.measure(f"initialize extension {name}"):
+                    await extension.initialize()
+
 # Listen for ready event.
 @listen()
 async def on_ready():
-    DatabaseCleanupExtension.on_ready_cleanup(client)
     print("")
     print(f"Logged in as {client.user}")
 
-# Load the extensions for the bot.
-client.load_extension(name=".general", package="extensions")
-client.load_extension(name=".tags", package="extensions")
-client.load_extension(name=".blacklist", package="extensions")
-client.load_extension(name=".timezones", package="extensions")
-client.load_extension(name=".database_cleanup", package="extensions")
+    # The ready event is dispatched again after reconnecting, but the startup only needs to be reported and finished once.
+    if (startup_state["finished"]):
+        return
+    startup_state["finished"] = True
+
+    # Load the members referenced by the bot database, if only those members are cached.
+    try:
+        await MemberCachePolicy.load_references()
+    except DatabaseUnavailableError:
+        print("Unable to access bot database! Members will not be cached until the next bot database cleanup.")
+
+    StartupProfiler.report(config["startup_profile"], "on_ready")
+    if (deferred_extensions):
+        await load_deferred_extensions()
+        StartupProfiler.report(config["startup_profile"], "deferred extensions loaded")
+
+# Load the extensions for the bot which aren't deferred.
+for name in EXTENSIONS:
+    if (name not in deferred_extensions):
+        load_extension(name)
 
 # Start the bot and connect to discord.
-client.start()
\ No newline at end of file
+try:
+    client.start()
+finally:
+    # Write any tag usage counts that are still pending.
+    TagUsageCounter.flush_now()
+
+    # Close the pooled connections to the bot database now that the bot has stopped.
+    Database.close()
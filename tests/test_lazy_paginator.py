@@ -0,0 +1,39 @@
+import asyncio
+import inspect
+
+import pytest
+
+# The lazy paginator extends the paginator of interactions.py, so these tests only run when it is installed.
+interactions = pytest.importorskip("interactions")
+
+from interactions.ext.paginators import Paginator
+
+from util.lazy_paginator import LazyPages
+
+def test_paginator_internals_still_exist():
+    # LazyPaginator overrides Paginator._on_button() and pings Paginator._timeout_task, which are private to interactions.py.
+    # If this fails after upgrading interactions.py, LazyPaginator has to be updated before the new version is used.
+    assert inspect.iscoroutinefunction(Paginator._on_button)
+    assert "_timeout_task" in {field.name for field in Paginator.__attrs_attrs__}
+
+def test_pages_only_keep_neighbours_loaded():
+    rendered = []
+
+    async def render(sources):
+        rendered.append(list(sources))
+        return [f"page {source}" for source in sources]
+
+    pages = LazyPages(LazyPages.create_source_loader(list(range(10)), render), 10)
+
+    async def browse():
+        assert await pages.load(0, 0)
+        assert await pages.load(1, 0)
+        assert await pages.load(2, 1)
+        assert await pages.load(9, 2)
+        # Pages more than one page away from the loaded page can't be reached without loading the pages in between.
+        assert not await pages.load(5, 9)
+
+    asyncio.run(browse())
+    assert pages[9] == "page 9"
+    assert sorted(pages.loaded) == [8, 9]
+    assert rendered == [[0, 1], [2, 3], [9, 8]]
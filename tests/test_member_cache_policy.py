@@ -0,0 +1,56 @@
+import pytest
+
+# The member cache policy builds its caches with interactions.py, so these tests only run when it is installed.
+interactions = pytest.importorskip("interactions")
+
+from util.config_manager import Config
+from util.member_cache_policy import MemberCachePolicy
+
+GUILD_ID = 111111111111111111
+USER_ID = 222222222222222222
+
+"""
+Swaps in a config with the given settings, in the same way as reloading the config, and swaps the old config back in afterwards.
+"""
+@pytest.fixture
+def use_config():
+    old_config = Config.config
+    yield lambda **settings: Config.swap_config(dict(Config.get_default_config(), **settings))
+    Config.swap_config(old_config)
+
+"""
+Creates a client with the caches used by a member cache policy.
+
+@param monkeypatch The pytest monkeypatch fixture.
+@param use_config The use_config fixture.
+@param policy The member cache policy.
+@return The client.
+"""
+def create_client(monkeypatch, use_config, policy: str):
+    use_config(member_cache_policy=policy)
+    monkeypatch.setattr(MemberCachePolicy, "referenced_members", set())
+    intents = interactions.Intents.new(default=True, message_content=True, guild_members=True, direct_messages=True)
+    return interactions.Client(intents=intents, **MemberCachePolicy.get_client_options())
+
+@pytest.mark.parametrize("policy", MemberCachePolicy.POLICIES)
+def test_member_display_name(monkeypatch, use_config, policy):
+    client = create_client(monkeypatch, use_config, policy)
+    MemberCachePolicy.add_reference(str(GUILD_ID), str(USER_ID))
+
+    member = client.cache.place_member_data(GUILD_ID, {
+        "user": {"id": str(USER_ID), "username": "mini", "global_name": "Mini Bot", "discriminator": "0", "avatar": None},
+        "nick": None,
+        "roles": [],
+        "joined_at": "2024-01-01T00:00:00+00:00",
+    })
+
+    # The member has no nickname, so its display name comes from its user, which has to be in the user cache under every policy.
+    assert member.user is not None
+    assert member.display_name == "Mini Bot"
+
+@pytest.mark.parametrize("policy", ("none", "lru", "referenced"))
+def test_user_cache_is_bounded(use_config, policy):
+    use_config(member_cache_policy=policy, member_cache_size=10)
+    options = MemberCachePolicy.get_client_options()
+
+    assert options["user_cache"].hard_limit == 10
@@ -0,0 +1,57 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from util.config_manager import Config
+from util.database_manager import Database
+from util.tag_usage_counter import TagUsageCounter
+
+@pytest.fixture(autouse=True)
+def empty_counter(monkeypatch):
+    monkeypatch.setattr(TagUsageCounter, "pending", {})
+    monkeypatch.setattr(TagUsageCounter, "pending_total", 0)
+
+def test_flush_keeps_counts_when_write_fails(monkeypatch):
+    async def locked_write(function, *args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(Database, "write", locked_write)
+    TagUsageCounter.increment("1", "hello")
+    TagUsageCounter.increment("1", "hello")
+    TagUsageCounter.increment("2", "world")
+
+    # The error must not reach the command which triggered the flush.
+    asyncio.run(TagUsageCounter.flush())
+
+    assert TagUsageCounter.get_pending("1", "hello") == 2
+    assert TagUsageCounter.get_pending("2", "world") == 1
+    assert TagUsageCounter.pending_total == 3
+
+def test_flush_writes_counts(monkeypatch):
+    con = sqlite3.connect(":memory:")
+    con.execute("CREATE TABLE tags(guildID TEXT, name TEXT, amountUsed INTEGER)")
+    con.execute("INSERT INTO tags VALUES ('1', 'hello', 5)")
+
+    async def write(function, *args):
+        return function(con, *args)
+
+    monkeypatch.setattr(Database, "write", write)
+    TagUsageCounter.increment("1", "hello")
+    asyncio.run(TagUsageCounter.flush())
+
+    assert TagUsageCounter.get_pending("1", "hello") == 0
+    assert con.execute("SELECT amountUsed FROM tags").fetchone()[0] == 6
+
+def test_flush_threshold_follows_config_reloads():
+    old_config = Config.config
+    try:
+        Config.swap_config(dict(Config.get_default_config(), tag_usage_flush_threshold=3))
+        assert not TagUsageCounter.increment("1", "hello")
+        assert not TagUsageCounter.increment("1", "hello")
+        assert TagUsageCounter.increment("1", "hello")
+
+        Config.swap_config(dict(Config.get_default_config(), tag_usage_flush_threshold=10))
+        assert not TagUsageCounter.increment("1", "hello")
+    finally:
+        Config.swap_config(old_config)
@@ -0,0 +1,83 @@
+from collections import deque
+
+"""
+This class is a compiled matcher which checks whether a message contains any word from a blacklist.
+
+The matcher is an Aho-Corasick automaton built once from the blacklist. Checking a message is a single pass over its characters, so the
+cost of a check depends on the length of the message and not on the amount of blacklisted words. Matching is case sensitive, in the same way
+as a plain substring check.
+"""
+class BlacklistMatcher:
+    """
+    Compiles a matcher from a list of blacklisted words. Empty words are ignored.
+
+    @param words The blacklisted words.
+    """
+    def __init__(self, words):
+        # Each state of the automaton has a dictionary of transitions, a failure link and a flag for whether a word ends at that state.
+        self.transitions = [{}]
+        self.failure = [0]
+        self.terminal = [False]
+        self.word_count = 0
+
+        # Build a trie containing every blacklisted word.
+        for word in words:
+            if (not word):
+                continue
+
+            state = 0
+            for character in word:
+                next_state = self.transitions[state].get(character)
+                if (next_state is None):
+                    next_state = len(self.transitions)
+                    self.transitions[state][character] = next_state
+                    self.transitions.append({})
+                    self.failure.append(0)
+                    self.terminal.append(False)
+                state = next_state
+
+            self.terminal[state] = True
+            self.word_count += 1
+
+        # Compute the failure links with a breadth first walk of the trie. The failure link of a state points to the state for the longest
+        # proper suffix of its text which is also in the trie. A state is terminal if any suffix of its text is a blacklisted word.
+        queue = deque(self.transitions[0].values())
+        while (queue):
+            state = queue.popleft()
+            for character, next_state in self.transitions[state].items():
+                queue.append(next_state)
+
+                fallback = self.failure[state]
+                while (fallback != 0 and character not in self.transitions[fallback]):
+                    fallback = self.failure[fallback]
+                self.failure[next_state] = self.transitions[fallback].get(character, 0)
+
+                if (self.terminal[self.failure[next_state]]):
+                    self.terminal[next_state] = True
+
+    """
+    Checks whether a message contains any of the blacklisted words.
+
+    @param message The contents of the message.
+    @return True if the message contains any blacklisted words, False if not.
+    """
+    def matches(self, message: str):
+        # A matcher without any words can never match.
+        if (self.word_count == 0):
+            return False
+
+        transitions = self.transitions
+        failure = self.failure
+        terminal = self.terminal
+
+        state = 0
+        for character in message:
+            # Follow failure links until a state with a transition for this character is found, or we are back at the root.
+            while (state != 0 and character not in transitions[state]):
+                state = failure[state]
+            state = transitions[state].get(character, 0)
+
+            if (terminal[state]):
+                return True
+
+        return False
@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+from util.config_manager import Config
+from util.database_manager import Database
+
+from interactions.client.errors import HTTPException
+
+"""
+This class deletes large amounts of rows from the bot database for the owner commands which clear tags and timezone registrations.
+
+Rows are deleted in bounded batches, each in its own short transaction, with a short pause between batches. This keeps the bot database from
+being locked for a long time, so other commands keep working while a large amount of rows is being deleted. The owner who invoked the
+command is sent a message which is updated with the progress of the deletion. A dry run counts the rows that would be deleted, using the
+same indexes as the deletion, without deleting anything.
+"""
+class BulkDelete:
+    # The minimum amount of seconds between updates of the progress message, so editing it doesn't run into Discord's rate limits.
+    PROGRESS_INTERVAL = 2
+
+    # The settings for bulk deletes, which are only worked out again after the config changes.
+    settings = None
+
+    """
+    Returns the settings for bulk deletes specified in the config.json file.
+
+    @return A dictionary containing the batch_size and batch_delay settings.
+    """
+    @staticmethod
+    def get_settings():
+        settings = BulkDelete.settings
+        if (settings is None):
+            settings = BulkDelete.load_settings(Config.get_config())
+            BulkDelete.settings = settings
+        return settings
+
+    """
+    Works out the settings for bulk deletes from a config.
+
+    @param config The config to read the settings from.
+    @return A dictionary containing the batch_size and batch_delay settings.
+    """
+    @staticmethod
+    def load_settings(config: dict):
+        return {
+            "batch_size": max(1, config.get("bulk_delete_batch_size", 500)),
+            "batch_delay": max(0.0, config.get("bulk_delete_batch_delay", 0.1)),
+        }
+
+    """
+    Config subscriber which works out the settings for bulk deletes again when they change.
+
+    @param old_config The old config.
+    @param new_config The new config.
+    """
+    @staticmethod
+    def on_config_changed(old_config: dict, new_config: dict):
+        if (Config.changed(old_config, new_config, "bulk_delete_batch_size", "bulk_delete_batch_delay")):
+            BulkDelete.settings = BulkDelete.load_settings(new_config)
+
+    """
+    Builds the WHERE clause matching the rows to delete from the values of a command's options. Options which weren't given are left out.
+
+    @param columns A dictionary mapping the name of each column to the value the rows must have, or an empty string to match any value.
+    @return A tuple containing the WHERE clause, which is empty if every row matches, and its parameters.
+    """
+    @staticmethod
+    def get_conditions(columns: dict):
+        conditions = [f"{column} = ?" for column, value in columns.items() if value != ""]
+        params = tuple(value for value in columns.values() if value != "")
+        return (f" WHERE {' AND '.join(conditions)}" if conditions else "", params)
+
+    """
+    Counts the rows that match a WHERE clause.
+
+    @param table The name of the table.
+    @param conditions The WHERE clause from BulkDelete.get_conditions().
+    @param params The parameters of the WHERE clause.
+    @return The amount of matching rows.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def count(table: str, conditions: str, params: tuple):
+        return (await Database.fetch_one(f"SELECT COUNT(*) FROM {table}{conditions}", params))[0]
+
+    """
+    Deletes the rows that match a WHERE clause in batches, and keeps the user who invoked the command updated on the progress.
+
+    @param context The context for which the command was invoked.
+    @param table The name of the table. The table must have a row ID.
+    @param conditions The WHERE clause from BulkDelete.get_conditions().
+    @param params The parameters of the WHERE clause.
+    @param description What the rows are, such as "tag(s)", used in the progress message.
+    @return The amount of rows that were deleted.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made. The batches deleted before that stay deleted.
+    """
+    @staticmethod
+    async def run(context, table: str, conditions: str, params: tuple, description: str):
+        settings = BulkDelete.get_settings()
+        total = await BulkDelete.count(table, conditions, params)
+        message = await context.send(f"Clearing {total} {description} from database with specified conditions...")
+
+        deleted = 0
+        last_update = time.monotonic()
+        while (True):
+            # Delete the next batch in its own transaction. Rows added while the deletion runs are deleted as well if they match.
+            removed = await Database.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table}{conditions} LIMIT ?)", params + (settings["batch_size"],))
+            if (removed == 0):
+                break
+            deleted += removed
+
+            # Update the progress message every few seconds.
+            if (time.monotonic() - last_update >= BulkDelete.PROGRESS_INTERVAL):
+                last_update = time.monotonic()
+                await BulkDelete.update_message(message, f"Clearing {description} from database with specified conditions... {deleted}/{max(total, deleted)} cleared.")
+
+            # Give the event loop and other commands some room before the next batch.
+            await asyncio.sleep(settings["batch_delay"])
+
+        await BulkDelete.update_message(message, f"Cleared {deleted} {description} from database with specified conditions.")
+        return deleted
+
+    """
+    Updates the progress message of a deletion. Failing to update the message doesn't stop the deletion.
+
+    @param message The progress message.
+    @param content The new content of the message.
+    """
+    @staticmethod
+    async def update_message(message, content: str):
+        try:
+            await message.edit(content=content)
+        except HTTPException:
+            pass
+
+# Work out the settings for bulk deletes again whenever the config is reloaded.
+Config.subscribe(BulkDelete.on_config_changed)
@@ -6,12 +6,18 @@ import sys
 This class manages the config file used for storing the bot settings.
 
 Functionality includes seting up a default config file, if one is not present, and returning a dictionary object representing the config file.
+The config file is validated against a schema when it is loaded, and can be reloaded while the bot is running. Anything derived from the config
+can subscribe to changes so it is rebuilt once when the config changes.
 """
 class Config:
     CONFIG_FILENAME = "config.json"
 
     config = {}
 
+    subscribers = []
+
+    file_state = None
+
     """
     Returns a predefined config file with default settings.
 
@@ -22,8 +28,38 @@ class Config:
         return  {
                     "token": "token",
                     "geoname_api_username": "username",
+                    "geonames_gazetteer_file": "cities15000.txt",
+                    "geonames_online_fallback": True,
+                    "geocode_cache_ttl": 2592000,
+                    "geocode_negative_cache_ttl": 86400,
                     "invite_oauth2_link": "oauth2_link",
                     "bot_database_name": "database_name.db",
+                    "database_pool_size": 4,
+                    "database_journal_mode": "WAL",
+                    "database_synchronous": "NORMAL",
+                    "database_cache_size": -16000,
+                    "database_mmap_size": 268435456,
+                    "database_busy_timeout": 5000,
+                    "database_checkpoint_interval": 300,
+                    "database_cleanup_interval": 86400,
+                    "database_cleanup_chunk_size": 100,
+                    "database_cleanup_chunk_delay": 1,
+                    "tag_usage_flush_interval": 30,
+                    "tag_usage_flush_threshold": 500,
+                    "tag_cache_size": 1000,
+                    "blacklist_guild_cache_size": 256,
+                    "blacklist_guild_idle_timeout": 3600,
+                    "config_watch_interval": 5,
+                    "deferred_extensions": [],
+                    "startup_profile": False,
+                    "member_cache_policy": "lru",
+                    "member_cache_size": 1000,
+                    "member_cache_ttl": 3600,
+                    "user_name_cache_size": 5000,
+                    "user_name_cache_ttl": 3600,
+                    "user_fetch_concurrency": 4,
+                    "bulk_delete_batch_size": 500,
+                    "bulk_delete_batch_delay": 0.1,
                     "clean_user_data": False,
                     "testing_mode_enabled": False,
                     "testing_guild_id": "guild_id",
@@ -31,6 +67,215 @@ class Config:
                     "owner_id": "owner_id"
                 }
 
+    """
+    Returns the type of every setting in the config. Settings read from the config file are checked against these types when the config is loaded.
+
+    @return A dictionary mapping the name of every setting to its type.
+    """
+    @staticmethod
+    def get_schema():
+        return  {
+                    "token": str,
+                    "geoname_api_username": str,
+                    "geonames_gazetteer_file": str,
+                    "geonames_online_fallback": bool,
+                    "geocode_cache_ttl": int,
+                    "geocode_negative_cache_ttl": int,
+                    "invite_oauth2_link": str,
+                    "bot_database_name": str,
+                    "database_pool_size": int,
+                    "database_journal_mode": str,
+                    "database_synchronous": str,
+                    "database_cache_size": int,
+                    "database_mmap_size": int,
+                    "database_busy_timeout": int,
+                    "database_checkpoint_interval": int,
+                    "database_cleanup_interval": int,
+                    "database_cleanup_chunk_size": int,
+                    "database_cleanup_chunk_delay": float,
+                    "tag_usage_flush_interval": int,
+                    "tag_usage_flush_threshold": int,
+                    "tag_cache_size": int,
+                    "blacklist_guild_cache_size": int,
+                    "blacklist_guild_idle_timeout": int,
+                    "config_watch_interval": int,
+                    "deferred_extensions": list,
+                    "startup_profile": bool,
+                    "member_cache_policy": str,
+                    "member_cache_size": int,
+                    "member_cache_ttl": int,
+                    "user_name_cache_size": int,
+                    "user_name_cache_ttl": int,
+                    "user_fetch_concurrency": int,
+                    "bulk_delete_batch_size": int,
+                    "bulk_delete_batch_delay": float,
+                    "clean_user_data": bool,
+                    "testing_mode_enabled": bool,
+                    "testing_guild_id": str,
+                    "blacklist": list,
+                    "owner_id": str
+                }
+
+    """
+    Converts a setting from the config file to the type it has in the schema.
+    IDs are often written as numbers instead of strings, so numbers are accepted for text settings, and numeric text is accepted for numbers.
+
+    @param value The value of the setting in the config file.
+    @param expected_type The type of the setting in the schema.
+    @return The converted value.
+    @throws ValueError If the value can't be converted to the type.
+    """
+    @staticmethod
+    def convert_setting(value, expected_type):
+        if (expected_type is bool):
+            if (isinstance(value, bool)):
+                return value
+        elif (expected_type is int or expected_type is float):
+            # Booleans are integers in Python, but true and false are never meant as numbers in the config.
+            if (not isinstance(value, bool) and isinstance(value, (int, float, str))):
+                converted = expected_type(value)
+                if (expected_type is float or converted == float(value)):
+                    return converted
+        elif (expected_type is str):
+            if (isinstance(value, (str, int)) and not isinstance(value, bool)):
+                return str(value)
+        elif (expected_type is list):
+            if (isinstance(value, list) and all(isinstance(item, str) for item in value)):
+                return value
+            raise ValueError("expected a list of strings")
+
+        raise ValueError(f"expected {expected_type.__name__}, got {type(value).__name__}")
+
+    """
+    Validates the settings read from the config file.
+    Settings that are missing or have the wrong type are replaced with their fallback value, and settings that aren't in the schema are kept as is.
+
+    @param settings The dictionary read from the config file.
+    @param fallback The settings to fall back to, such as the defaults or the config that is currently in use.
+    @return A tuple containing the validated config and a list of problems that were found.
+    """
+    @staticmethod
+    def validate(settings, fallback: dict):
+        if (not isinstance(settings, dict)):
+            return (dict(fallback), ["the config must be a JSON object"])
+
+        schema = Config.get_schema()
+        config = dict(fallback)
+        problems = []
+
+        for key, value in settings.items():
+            if (key not in schema):
+                problems.append(f"unknown setting '{key}'")
+                config[key] = value
+                continue
+
+            try:
+                config[key] = Config.convert_setting(value, schema[key])
+            except (TypeError, ValueError, OverflowError) as error:
+                problems.append(f"invalid value for '{key}' ({error}), using {json.dumps(config[key])}")
+
+        return (config, problems)
+
+    """
+    Reads and validates the config file.
+
+    @param fallback The settings to fall back to for settings that are missing or invalid.
+    @return The validated config.
+    @throws OSError If the config file could not be read.
+    @throws ValueError If the config file is not valid JSON.
+    """
+    @staticmethod
+    def load_config_file(fallback: dict):
+        # Remember the state of the file before reading it, so a change made while reading it is picked up by the next check.
+        file_state = Config.get_file_state()
+
+        with open(Config.CONFIG_FILENAME, "r") as infile:
+            config, problems = Config.validate(json.load(infile), fallback)
+
+        for problem in problems:
+            print(f"Config warning: {problem}")
+
+        Config.file_state = file_state
+        return config
+
+    """
+    Replaces the config stored in memory and notifies every subscriber of the change.
+    The config is swapped in all at once, so anything reading the config either sees the old settings or the new ones.
+
+    @param config The new config.
+    """
+    @staticmethod
+    def swap_config(config: dict):
+        old_config = Config.config
+        Config.config = config
+
+        for callback in list(Config.subscribers):
+            try:
+                callback(old_config, config)
+            except Exception as error:
+                print(f"Error while applying config change: {error}")
+
+    """
+    Subscribes to changes of the config. The callback is called with the old and new config every time the config is reloaded.
+    Subscribers are meant to rebuild anything derived from the config once per change, rather than reading the config for every event.
+
+    @param callback The function to call when the config changes.
+    """
+    @staticmethod
+    def subscribe(callback):
+        if (callback not in Config.subscribers):
+            Config.subscribers.append(callback)
+
+    """
+    Removes a callback added with Config.subscribe().
+
+    @param callback The function to stop calling when the config changes.
+    """
+    @staticmethod
+    def unsubscribe(callback):
+        if (callback in Config.subscribers):
+            Config.subscribers.remove(callback)
+
+    """
+    Checks whether any of the given settings are different between two configs.
+
+    @param old_config The old config.
+    @param new_config The new config.
+    @param keys The names of the settings to compare.
+    @return True if any of the settings changed, False if not.
+    """
+    @staticmethod
+    def changed(old_config: dict, new_config: dict, *keys):
+        return any(old_config.get(key) != new_config.get(key) for key in keys)
+
+    """
+    Returns the modification time and size of the config file, which are used to detect when the file changes.
+
+    @return A tuple containing the modification time in nanoseconds and the size of the config file, or None if the file doesn't exist.
+    """
+    @staticmethod
+    def get_file_state():
+        try:
+            stat = os.stat(Config.CONFIG_FILENAME)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    """
+    Reloads the config if the config file has changed since it was last read.
+    This is called periodically by the config watcher.
+
+    @return True if the config was reloaded, False if not.
+    """
+    @staticmethod
+    def check_for_changes():
+        file_state = Config.get_file_state()
+        if (file_state is None or file_state == Config.file_state):
+            return False
+
+        print("Detected a change to config.json.")
+        return Config.reload_config()
+
     """
     Attempts to read the config file and load the settings from it. If the config is not found the deafult one will be written to the current directory.
     """
@@ -40,9 +285,8 @@ class Config:
 
         # If the config file exists we will load it.
         if os.path.exists(Config.CONFIG_FILENAME):
-            with open(Config.CONFIG_FILENAME, "r") as infile:
-                Config.config = json.load(infile)
-                print("Successfully read config.json.\n")
+            Config.swap_config(Config.load_config_file(Config.get_default_config()))
+            print("Successfully read config.json.\n")
         # If the config file doesn't exit we will write a default one and exit the program.
         else:
             with open(Config.CONFIG_FILENAME, "w") as outfile:
@@ -53,6 +297,7 @@ class Config:
     """
     Attempts to reload the config file and load the settings from it.
     If the config is not found the deafult one will be written to the current directory and the old config will continue to be used.
+    If the config can't be read or is not valid JSON, the old config will continue to be used. Invalid settings keep their old value.
 
     @return True if the config was reloaded, False if not
     """
@@ -62,15 +307,23 @@ class Config:
 
         # If the config file exists we will load it.
         if os.path.exists(Config.CONFIG_FILENAME):
-            with open(Config.CONFIG_FILENAME, "r") as infile:
-                Config.config = json.load(infile)
-                print("Successfully reloaded config.json.\n")
-                return True
+            try:
+                config = Config.load_config_file(Config.config or Config.get_default_config())
+            except (OSError, ValueError) as error:
+                # Remember the broken file so the watcher doesn't try to reload it again until it changes.
+                Config.file_state = Config.get_file_state()
+                print(f"Unable to reload config.json ({error}). Falling back to old config.\n")
+                return False
+
+            Config.swap_config(config)
+            print("Successfully reloaded config.json.\n")
+            return True
         # If the config file doesn't exit we will write a default one and exit the program.
         else:
             with open(Config.CONFIG_FILENAME, "w") as outfile:
                 print("Unable to reload config.json. Writing a default one to the current directory and falling back to old config.\n")
                 outfile.write(json.dumps(Config.get_default_config(), indent = 4))
+                Config.file_state = Config.get_file_state()
                 return False
 
     """
@@ -80,4 +333,4 @@ class Config:
     """
     @staticmethod
     def get_config():
-        return Config.config
\ No newline at end of file
+        return Config.config
@@ -1,38 +1,494 @@
+import asyncio
+import queue
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from util.config_manager import Config
+from util.database_migrations import DatabaseMigrations
+
+"""
+This class manages a bounded pool of long-lived connections to a single sqlite3 database.
+
+Idle connections are kept in a LIFO queue so the most recently used (and therefore warmest) connection is handed out first.
+Connections are health checked before being handed out and are replaced if they are no longer usable.
+"""
+class ConnectionPool:
+    """
+    Creates a new connection pool for the given database file.
+
+    @param database_name The filename of the database to connect to.
+    @param max_size The maximum amount of connections this pool will open at once.
+    @param timeout The amount of seconds to wait for a free connection before giving up.
+    @param configure An optional function which is called with every new connection before it is first used.
+    """
+    def __init__(self, database_name: str, max_size: int = 4, timeout: float = 5.0, configure = None):
+        self.database_name = database_name
+        self.configure = configure
+        self.max_size = max(1, int(max_size))
+        self.timeout = timeout
+        self.idle_connections = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(self.max_size)
+        self.closed = False
+
+        # The generation of the settings each open connection was configured with. Connections are reconfigured when the generation changes.
+        self.generation = 0
+        self.configured = {}
+
+    """
+    Opens a brand new connection to the database of this pool.
+
+    @return A sqlite3 connection to the database.
+    """
+    def create_connection(self):
+        # Open the database in read-write mode so that a missing database file is not silently created.
+        # The connection may be handed to different threads over its lifetime, but only one thread will ever use it at a time.
+        con = sqlite3.connect(f"file:{self.database_name}?mode=rw", uri=True, check_same_thread=False)
+
+        # Apply any per-connection settings, such as pragmas, before handing the connection out.
+        if (self.configure is not None):
+            try:
+                self.configure(con)
+            except BaseException:
+                con.close()
+                raise
+
+        return con
+
+    """
+    Discards a connection which is no longer usable.
+
+    @param con The connection to discard.
+    """
+    def discard_connection(self, con):
+        self.configured.pop(con, None)
+        try:
+            con.close()
+        except sqlite3.Error:
+            pass
+
+    """
+    Makes every connection of this pool apply the configure function again before it is next handed out, such as after its settings changed.
+    Connections that are currently checked out are reconfigured the next time they are taken out of the pool.
+    """
+    def reconfigure(self):
+        self.generation += 1
+
+    """
+    Checks whether or not a connection is still usable.
+
+    @param con The connection to check.
+    @return True if the connection is usable, False if not.
+    """
+    @staticmethod
+    def is_healthy(con):
+        try:
+            con.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    """
+    Applies the configure function to an idle connection again if it was configured before the settings of this pool last changed.
+
+    @param con The connection to check.
+    @return True if the connection is configured with the current settings, False if it could not be reconfigured.
+    """
+    def refresh_configuration(self, con):
+        generation = self.generation
+        if (self.configure is None or self.configured.get(con) == generation):
+            return True
+
+        try:
+            self.configure(con)
+        except sqlite3.Error:
+            return False
+
+        self.configured[con] = generation
+        return True
+
+    """
+    Takes a connection out of the pool, opening a new one if no healthy idle connection is available.
+    Every connection taken out of the pool must be handed back with ConnectionPool.put().
+
+    @return A sqlite3 connection to the database.
+    @throws sqlite3.Error If the pool is closed, exhausted, or a connection could not be opened.
+    """
+    def get(self):
+        if (self.closed):
+            raise sqlite3.OperationalError("Connection pool is closed")
+
+        # Wait for a free slot so that we never have more than max_size connections checked out at once.
+        if (not self.slots.acquire(timeout=self.timeout)):
+            raise sqlite3.OperationalError("Timed out waiting for a database connection")
+
+        try:
+            # Reuse an idle connection if there is a healthy one available, otherwise open a new one.
+            while True:
+                try:
+                    con = self.idle_connections.get_nowait()
+                except queue.Empty:
+                    con = self.create_connection()
+                    self.configured[con] = self.generation
+                    return con
+
+                if (self.is_healthy(con) and self.refresh_configuration(con)):
+                    return con
+                self.discard_connection(con)
+        except BaseException:
+            # Give the slot back since no connection is leaving the pool.
+            self.slots.release()
+            raise
+
+    """
+    Hands a connection taken out with ConnectionPool.get() back to the pool.
+    Any transaction left open by the caller is rolled back before the connection is reused.
+
+    @param con The connection to hand back.
+    """
+    def put(self, con):
+        try:
+            # Roll back any transaction the caller left open so the next user gets a clean connection.
+            if (con.in_transaction):
+                con.rollback()
+
+            if (self.closed):
+                self.discard_connection(con)
+            else:
+                self.idle_connections.put(con)
+        except sqlite3.Error:
+            self.discard_connection(con)
+        finally:
+            self.slots.release()
+
+    """
+    Closes every connection owned by this pool. Connections that are currently checked out will be closed when they are returned.
+    """
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                con = self.idle_connections.get_nowait()
+            except queue.Empty:
+                break
+            self.discard_connection(con)
+
+"""
+This exception is raised by the asynchronous Database API when a connection to the bot database could not be made.
+"""
+class DatabaseUnavailableError(Exception):
+    pass
 
 """
 This class manages a database used for storing bot information.
 
-Functionality includes seting up an empty database, if one is not present, and returning a connection to said database.
+Functionality includes seting up an empty database, if one is not present, and handing out pooled connections to said database.
+Command handlers should use the asynchronous API (read, write, fetch_one, fetch_all, execute and execute_many) so that disk access
+happens on background threads instead of blocking the event loop. Reads run on a pool of reader threads while every write is
+serialized through a single dedicated writer thread.
 """
 class Database:
+    pool = None
+
+    pool_lock = threading.Lock()
+
+    reader_executor = None
+
+    writer_executor = None
+
+    pragma_settings = None
+
+    JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+
+    SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+    """
+    Returns the filename of the bot database specified in the config.json file.
+
+    @return The filename of the bot database, suffixed with '.db'.
+    """
+    @staticmethod
+    def get_database_name():
+        # Get the bot database name from the config file.
+        config = Config.get_config()
+        bot_database_name = str(config["bot_database_name"])
+
+        # If the bot database name in the config is not suffixed with '.db' we will add it.
+        if not (bot_database_name.endswith(".db")):
+            bot_database_name += ".db"
+
+        return bot_database_name
+
+    """
+    Returns the pragma settings for the bot database specified in the config.json file.
+    Settings that are missing or invalid fall back to defaults suited for a bot serving many concurrent commands.
+
+    @return A dictionary containing the journal_mode, synchronous, cache_size, mmap_size, busy_timeout and checkpoint_interval settings.
+    """
+    @staticmethod
+    def get_pragma_settings():
+        # The settings are only worked out again after the config changes.
+        settings = Database.pragma_settings
+        if (settings is None):
+            settings = Database.load_pragma_settings(Config.get_config())
+            Database.pragma_settings = settings
+        return settings
+
+    """
+    Works out the pragma settings for the bot database from a config.
+
+    @param config The config to read the settings from.
+    @return A dictionary containing the journal_mode, synchronous, cache_size, mmap_size, busy_timeout and checkpoint_interval settings.
+    """
+    @staticmethod
+    def load_pragma_settings(config: dict):
+        settings = {}
+
+        # Pragma values can't be passed as query parameters, so the text settings are checked against the values sqlite accepts.
+        journal_mode = str(config.get("database_journal_mode", "WAL")).upper()
+        settings["journal_mode"] = journal_mode if journal_mode in Database.JOURNAL_MODES else "WAL"
+        synchronous = str(config.get("database_synchronous", "NORMAL")).upper()
+        settings["synchronous"] = synchronous if synchronous in Database.SYNCHRONOUS_LEVELS else "NORMAL"
+
+        # The numeric settings are converted to integers for the same reason.
+        for key, default in (("cache_size", -16000), ("mmap_size", 268435456), ("busy_timeout", 5000), ("checkpoint_interval", 300)):
+            try:
+                settings[key] = int(config.get(f"database_{key}", default))
+            except (TypeError, ValueError):
+                settings[key] = default
+
+        return settings
+
     """
-    Returns a connection to the specified database in the config.json file.
+    Applies the per-connection pragma settings from the config.json file to a connection to the bot database.
+
+    @param con The connection to configure.
+    """
+    @staticmethod
+    def configure_connection(con):
+        settings = Database.get_pragma_settings()
+        con.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+        con.execute(f"PRAGMA cache_size = {settings['cache_size']}")
+        con.execute(f"PRAGMA mmap_size = {settings['mmap_size']}")
+        con.execute(f"PRAGMA busy_timeout = {settings['busy_timeout']}")
+
+    """
+    Config subscriber which applies changed pragma settings to the bot database.
+    The settings are worked out once, and every pooled connection applies them the next time it is handed out. The journal mode is a property of
+    the database file and the pool size is fixed once the pool exists, so changes to those only take effect after the bot is restarted.
+
+    @param old_config The old config.
+    @param new_config The new config.
+    """
+    @staticmethod
+    def on_config_changed(old_config: dict, new_config: dict):
+        if (not Config.changed(old_config, new_config, "database_synchronous", "database_cache_size", "database_mmap_size", "database_busy_timeout", "database_checkpoint_interval")):
+            return
+
+        Database.pragma_settings = Database.load_pragma_settings(new_config)
+        with Database.pool_lock:
+            if (Database.pool is not None):
+                Database.pool.reconfigure()
+
+    """
+    Returns the connection pool for the bot database, creating it if it does not exist yet.
+
+    @return The ConnectionPool for the bot database.
+    """
+    @staticmethod
+    def get_pool():
+        with Database.pool_lock:
+            if (Database.pool is None):
+                # One connection more than the amount of reader threads is allowed so the writer thread never waits on readers.
+                pool_size = max(1, int(Config.get_config().get("database_pool_size", 4)))
+                busy_timeout = Database.get_pragma_settings()["busy_timeout"] / 1000.0
+                Database.pool = ConnectionPool(Database.get_database_name(), pool_size + 1, max(5.0, busy_timeout), Database.configure_connection)
+            return Database.pool
+
+    """
+    Returns a new connection to the specified database in the config.json file.
+    The caller is responsible for closing this connection. Command handlers should use Database.connection() instead.
 
     @return A sqlite3 connection to the database or None if a connection was unable to be made.
     """
     @staticmethod
     def get_connection():
         try:
-            # Get the bot database name from the config file.
-            config = Config.get_config()
-            bot_database_name = str(config["bot_database_name"])
-
-            # If the bot database name in the config is not suffixed with '.db' we will add it.
-            if not (bot_database_name.endswith(".db")):
-                bot_database_name += ".db"
-            
             # Attempt to open a connect to a bot database with the name provided in the config file.
-            con = sqlite3.connect(f"file:{bot_database_name}?mode=rw", uri=True)
+            con = sqlite3.connect(f"file:{Database.get_database_name()}?mode=rw", uri=True)
             return con
         except:
             # Return none since we were unable to open a connection.
             return None
-    
+
+    """
+    Borrows a pooled connection to the specified database in the config.json file for the duration of a with block.
+    The connection is returned to the pool, rather than closed, when the with block exits.
+
+    @return A context manager yielding a sqlite3 connection to the database or None if a connection was unable to be made.
+    """
+    @staticmethod
+    @contextmanager
+    def connection():
+        try:
+            # Attempt to borrow a connection from the pool for the bot database.
+            pool = Database.get_pool()
+            con = pool.get()
+        except:
+            # Yield none since we were unable to get a connection.
+            yield None
+            return
+
+        try:
+            yield con
+        finally:
+            # Hand the connection back to the pool now that the caller is done with it.
+            pool.put(con)
+
+    """
+    Returns the executors used to run database work off of the event loop, creating them if they do not exist yet.
+
+    @return A tuple containing the reader thread pool and the single threaded writer executor.
+    """
+    @staticmethod
+    def get_executors():
+        with Database.pool_lock:
+            if (Database.reader_executor is None):
+                reader_count = Config.get_config().get("database_pool_size", 4)
+                Database.reader_executor = ThreadPoolExecutor(max_workers=max(1, int(reader_count)), thread_name_prefix="database-reader")
+                Database.writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database-writer")
+            return (Database.reader_executor, Database.writer_executor)
+
+    """
+    Runs a function with a pooled connection to the bot database. This is run on one of the database threads.
+
+    @param function The function to run. It is called with the connection followed by any extra arguments.
+    @param commit Whether or not the transaction should be committed once the function returns.
+    @return The return value of the function.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    def run_with_connection(function, args, commit):
+        with Database.connection() as con:
+            # Check if the connection is valid.
+            if (con is None):
+                raise DatabaseUnavailableError("Unable to access bot database!")
+
+            try:
+                result = function(con, *args)
+                if (commit):
+                    con.commit()
+                return result
+            except BaseException:
+                # Undo any partial changes if the function failed.
+                con.rollback()
+                raise
+
+    """
+    Runs a function which only reads from the bot database on the reader thread pool.
+
+    @param function The function to run. It is called with a sqlite3 connection followed by any extra arguments.
+    @return The return value of the function.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def read(function, *args):
+        reader_executor, _ = Database.get_executors()
+        return await asyncio.get_running_loop().run_in_executor(reader_executor, Database.run_with_connection, function, args, False)
+
+    """
+    Runs a function which writes to the bot database on the writer thread and commits the transaction once it returns.
+    If the function raises an exception the transaction is rolled back instead.
+
+    @param function The function to run. It is called with a sqlite3 connection followed by any extra arguments.
+    @return The return value of the function.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def write(function, *args):
+        _, writer_executor = Database.get_executors()
+        return await asyncio.get_running_loop().run_in_executor(writer_executor, Database.run_with_connection, function, args, True)
+
+    """
+    Runs a read query against the bot database and returns the first row of the results.
+
+    @param sql The query to run.
+    @param params The parameters for the query.
+    @return The first row of the results, or None if there were no results.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def fetch_one(sql: str, params: tuple = ()):
+        return await Database.read(lambda con: con.execute(sql, params).fetchone())
+
+    """
+    Runs a read query against the bot database and returns every row of the results.
+
+    @param sql The query to run.
+    @param params The parameters for the query.
+    @return A list containing every row of the results.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def fetch_all(sql: str, params: tuple = ()):
+        return await Database.read(lambda con: con.execute(sql, params).fetchall())
+
+    """
+    Runs a single write statement against the bot database and commits it.
+
+    @param sql The statement to run.
+    @param params The parameters for the statement.
+    @return The amount of rows affected by the statement.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def execute(sql: str, params: tuple = ()):
+        return await Database.write(lambda con: con.execute(sql, params).rowcount)
+
+    """
+    Runs a write statement against the bot database once for every set of parameters and commits them in a single transaction.
+
+    @param sql The statement to run.
+    @param params_list An iterable of parameters for the statement.
+    @return The amount of rows affected by the statements.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def execute_many(sql: str, params_list):
+        return await Database.write(lambda con: con.executemany(sql, params_list).rowcount)
+
+    """
+    Checkpoints the write-ahead log of the bot database into the main database file so the log doesn't grow without bound.
+    This is a no-op if the bot database is not in WAL mode.
+
+    @return A tuple containing the busy flag, the amount of frames in the log and the amount of frames that were checkpointed.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def checkpoint():
+        return await Database.write(lambda con: con.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone())
+
+    """
+    Closes every pooled connection to the bot database and stops the database threads. This should be called when the bot is shutting down.
+    """
+    @staticmethod
+    def close():
+        with Database.pool_lock:
+            # Let any queued database work finish before the connections are closed.
+            if (Database.reader_executor is not None):
+                Database.reader_executor.shutdown(wait=True)
+                Database.writer_executor.shutdown(wait=True)
+                Database.reader_executor = None
+                Database.writer_executor = None
+
+            if (Database.pool is not None):
+                Database.pool.close()
+                Database.pool = None
+
     """
     Attempts to read from the database specified in the config.json file, and creates an empty one if it is not present.
+    Any schema migrations that have not been applied to the database yet are applied afterwards.
     """
     @staticmethod
     def setup_bot_database():
@@ -42,30 +498,28 @@ class Database:
 
         # If a connection is made with the bot database we will have a connection object that is not equal to None.
         if (con is not None):
-            # If we are successfully able to open a connect with the bot database we will close the connection and print a message saying so.
+            # If we are successfully able to open a connect with the bot database we will print a message saying so.
             print("Successfully read specified bot database file.\n")
-            con.close()
         # Since the bot database with the given name doesn't exist, we will create one and setup it up for our needs.
         else:
             # Print a message saying that we were unable to connect to the bot database.
             print("Unable to read specified bot database file. Writing a default one to the current directory.\n")
-            
-            # Get the bot database name from the config file.
-            config = Config.get_config()
-            bot_database_name = str(config["bot_database_name"])
-
-            # If the bot database name in the config is not suffixed with '.db' we will add it.
-            if not (bot_database_name.endswith(".db")):
-                bot_database_name += ".db"
 
             # Create a new bot database by creating a connection.
-            con = sqlite3.connect(bot_database_name)
+            con = sqlite3.connect(Database.get_database_name())
 
-            # Create a table to contain the database information.
-            cur = con.cursor()
-            cur.execute("CREATE TABLE tags(name, content, authorID, guildID, date, amountUsed)")
-            cur.execute("CREATE TABLE timezones(timezone, userID, guildID)")
-            con.commit()
+        try:
+            # Set the journal mode of the bot database. Unlike the other pragmas, this is stored in the database file itself.
+            journal_mode = Database.get_pragma_settings()["journal_mode"]
+            con.execute(f"PRAGMA journal_mode = {journal_mode}")
 
+            # Bring the schema of the bot database up to date.
+            applied = DatabaseMigrations.migrate(con)
+            if (applied > 0):
+                print(f"Applied {applied} bot database migration(s).\n")
+        finally:
             # Close the database connection now that we are done with it.
-            con.close()
\ No newline at end of file
+            con.close()
+
+# Apply changed pragma settings whenever the config is reloaded.
+Config.subscribe(Database.on_config_changed)
@@ -0,0 +1,244 @@
+import sqlite3
+from datetime import datetime
+
+"""
+This class manages the schema of the bot database.
+
+The schema is upgraded through an ordered list of migrations. The version of every migration that has been applied to a database is recorded
+in the schema_migrations table, so each migration only ever runs once and existing databases are upgraded in place when the bot starts.
+New migrations must be appended to the end of the list returned by DatabaseMigrations.get_migrations() and must never be reordered or edited
+once they have been released.
+"""
+class DatabaseMigrations:
+    """
+    Returns every migration for the bot database in the order they must be applied.
+
+    @return A list of tuples containing the version, a description and the function of each migration.
+    """
+    @staticmethod
+    def get_migrations():
+        return [
+            (1, "Create the original tags and timezones tables", DatabaseMigrations.create_original_tables),
+            (2, "Add types, keys and indexes to the tags and timezones tables", DatabaseMigrations.add_keys_and_indexes),
+            (3, "Create the geocoding cache table", DatabaseMigrations.create_geocode_cache),
+            (4, "Create the per-server blacklist table", DatabaseMigrations.create_blacklist),
+            (5, "Create the background job state table", DatabaseMigrations.create_job_state),
+            (6, "Add a creation time to tags and indexes for sorted tag listings", DatabaseMigrations.add_tag_listing_indexes),
+            (7, "Create the full-text search index for tags", DatabaseMigrations.create_tag_search_index),
+            (8, "Add an index for grouping timezone registrations by timezone", DatabaseMigrations.add_timezone_group_index),
+        ]
+
+    """
+    Returns the version of the newest migration that has been applied to the bot database.
+
+    @param con The connection to the bot database.
+    @return The current schema version of the bot database, or 0 if it is empty.
+    """
+    @staticmethod
+    def get_schema_version(con):
+        # Create the table used to keep track of the applied migrations if it doesn't exist yet.
+        con.execute("CREATE TABLE IF NOT EXISTS schema_migrations(version INTEGER PRIMARY KEY, description TEXT NOT NULL, appliedAt TEXT NOT NULL)")
+        return con.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").fetchone()[0]
+
+    """
+    Applies every migration that has not been applied to the bot database yet. Each migration is run in its own transaction.
+
+    @param con The connection to the bot database.
+    @return The amount of migrations that were applied.
+    @throws sqlite3.Error If a migration failed. The failed migration is rolled back and the migrations after it are not applied.
+    """
+    @staticmethod
+    def migrate(con):
+        # Manage the transactions ourselves so that schema changes and the version bump are committed together.
+        isolation_level = con.isolation_level
+        con.isolation_level = None
+
+        try:
+            current_version = DatabaseMigrations.get_schema_version(con)
+            applied = 0
+
+            for version, description, function in DatabaseMigrations.get_migrations():
+                # Skip any migrations which have already been applied.
+                if (version <= current_version):
+                    continue
+
+                print(f"Applying bot database migration {version}: {description}...")
+                con.execute("BEGIN IMMEDIATE")
+                try:
+                    function(con.cursor())
+                    con.execute("INSERT INTO schema_migrations VALUES (?, ?, ?)", (version, description, datetime.now().isoformat(timespec="seconds"),))
+                    con.execute("COMMIT")
+                except sqlite3.Error:
+                    con.execute("ROLLBACK")
+                    raise
+                applied += 1
+
+            return applied
+        finally:
+            con.isolation_level = isolation_level
+
+    """
+    Migration 1.
+    Creates the untyped tags and timezones tables used by the original version of the bot. Databases created before migrations existed already have
+    these tables, so this is a no-op for them.
+
+    @param cur A cursor for the bot database.
+    """
+    @staticmethod
+    def create_original_tables(cur):
+        cur.execute("CREATE TABLE IF NOT EXISTS tags(name, content, authorID, guildID, date, amountUsed)")
+        cur.execute("CREATE TABLE IF NOT EXISTS timezones(timezone, userID, guildID)")
+
+    """
+    Migration 2.
+    Rebuilds the tags and timezones tables with typed columns, a unique (guildID, name) key on tags, a (guildID, userID) key on timezones,
+    and indexes on the author and user ID columns. If an old database contains duplicate keys, the oldest row for each key is kept.
+
+    @param cur A cursor for the bot database.
+    """
+    @staticmethod
+    def add_keys_and_indexes(cur):
+        # Rebuild the tags table. The explicit integer primary key gives every tag a stable row ID.
+        cur.execute("""CREATE TABLE tags_new(
+                        id INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        authorID TEXT NOT NULL,
+                        guildID TEXT NOT NULL,
+                        date TEXT NOT NULL,
+                        amountUsed INTEGER NOT NULL DEFAULT 0,
+                        UNIQUE (guildID, name))""")
+        cur.execute("""INSERT INTO tags_new(name, content, authorID, guildID, date, amountUsed)
+                        SELECT name, COALESCE(content, ''), CAST(authorID AS TEXT), CAST(guildID AS TEXT), COALESCE(date, ''), COALESCE(amountUsed, 0)
+                        FROM tags
+                        WHERE rowid IN (SELECT MIN(rowid) FROM tags WHERE name IS NOT NULL AND guildID IS NOT NULL AND authorID IS NOT NULL GROUP BY CAST(guildID AS TEXT), name)
+                        ORDER BY rowid""")
+        cur.execute("DROP TABLE tags")
+        cur.execute("ALTER TABLE tags_new RENAME TO tags")
+        cur.execute("CREATE INDEX tags_author_index ON tags(authorID, guildID)")
+
+        # Rebuild the timezones table. Every user can only register a single timezone per server.
+        cur.execute("""CREATE TABLE timezones_new(
+                        timezone TEXT NOT NULL,
+                        userID TEXT NOT NULL,
+                        guildID TEXT NOT NULL,
+                        PRIMARY KEY (guildID, userID))""")
+        cur.execute("""INSERT INTO timezones_new(timezone, userID, guildID)
+                        SELECT timezone, CAST(userID AS TEXT), CAST(guildID AS TEXT)
+                        FROM timezones
+                        WHERE rowid IN (SELECT MIN(rowid) FROM timezones WHERE timezone IS NOT NULL AND userID IS NOT NULL AND guildID IS NOT NULL GROUP BY CAST(guildID AS TEXT), CAST(userID AS TEXT))""")
+        cur.execute("DROP TABLE timezones")
+        cur.execute("ALTER TABLE timezones_new RENAME TO timezones")
+        cur.execute("CREATE INDEX timezones_user_index ON timezones(userID, guildID)")
+
+    """
+    Migration 3.
+    Creates the table used to cache the results of GeoNames API lookups. A NULL timezone marks a city name that GeoNames did not recognize.
+
+    @param cur A cursor for the bot database.
+    """
+    @staticmethod
+    def create_geocode_cache(cur):
+        cur.execute("""CREATE TABLE geocode_cache(
+                        query TEXT PRIMARY KEY,
+                        geonamesID INTEGER,
+                        timezone TEXT,
+                        cachedAt INTEGER NOT NULL)""")
+
+    """
+    Migration 4.
+    Creates the table used to store the blacklisted words of each server.
+
+    @param cur A cursor for the bot database.
+    """
+    @staticmethod
+    def create_blacklist(cur):
+        cur.execute("""CREATE TABLE blacklist(
+                        guildID TEXT NOT NULL,
+                        word TEXT NOT NULL,
+                        PRIMARY KEY (guildID, word)) WITHOUT ROWID""")
+
+    """
+    Migration 5.
+    Creates the table used by background jobs to save their progress, so that a job interrupted by a restart can resume where it stopped.
+
+    @param cur A cursor for the bot database.
+    """
+    @staticmethod
+    def create_job_state(cur):
+        cur.execute("""CREATE TABLE job_state(
+                        job TEXT PRIMARY KEY,
+                        checkpoint TEXT NOT NULL,
+                        startedAt INTEGER NOT NULL,
+                        updatedAt INTEGER NOT NULL)""")
+
+    """
+    Migration 6.
+    Adds a sortable createdAt column (unix time) to the tags table, backfilled from the text date column, and adds the indexes used to list the tags
+    of a server by amount of uses, by creation time and by author. Dates that can't be parsed are backfilled as 0.
+
+    @param cur A cursor for the bot database.
+    """
+    @staticmethod
+    def add_tag_listing_indexes(cur):
+        cur.execute("ALTER TABLE tags ADD COLUMN createdAt INTEGER NOT NULL DEFAULT 0")
+
+        # The date column is stored in the "%b-%d-%Y" format, which sqlite can't parse, so the creation times are computed here.
+        updates = []
+        for tag_id, tag_date in cur.execute("SELECT id, date FROM tags").fetchall():
+            try:
+                updates.append((int(datetime.strptime(tag_date, "%b-%d-%Y").timestamp()), tag_id,))
+            except (TypeError, ValueError):
+                pass
+        cur.executemany("UPDATE tags SET createdAt = ? WHERE id = ?", updates)
+
+        # Each listing is ordered by its column, with the tag ID as a tie breaker. The tag ID is part of every index as the row ID.
+        cur.execute("CREATE INDEX tags_usage_index ON tags(guildID, amountUsed)")
+        cur.execute("CREATE INDEX tags_created_index ON tags(guildID, createdAt)")
+
+        # Extend the author index so the tags of an author can be listed in order of their name.
+        cur.execute("DROP INDEX tags_author_index")
+        cur.execute("CREATE INDEX tags_author_index ON tags(authorID, guildID, name)")
+
+    """
+    Migration 7.
+    Creates an FTS5 full-text index over the names and contents of tags. The index is an external content table which reads its text from the tags
+    table, and is kept in sync with it by triggers, so every way tags are added, edited or deleted also updates the index. The guild ID is indexed
+    as well, so a search can be limited to a single server inside the full-text query itself.
+
+    @param cur A cursor for the bot database.
+    """
+    @staticmethod
+    def create_tag_search_index(cur):
+        cur.execute("""CREATE VIRTUAL TABLE tags_search USING fts5(
+                        name,
+                        content,
+                        guildID,
+                        content='tags',
+                        content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2')""")
+
+        # Keep the index in sync with the tags table. Updates that only change the amount of uses don't touch the index.
+        cur.execute("""CREATE TRIGGER tags_search_insert AFTER INSERT ON tags BEGIN
+                        INSERT INTO tags_search(rowid, name, content, guildID) VALUES (new.id, new.name, new.content, new.guildID);
+                       END""")
+        cur.execute("""CREATE TRIGGER tags_search_delete AFTER DELETE ON tags BEGIN
+                        INSERT INTO tags_search(tags_search, rowid, name, content, guildID) VALUES ('delete', old.id, old.name, old.content, old.guildID);
+                       END""")
+        cur.execute("""CREATE TRIGGER tags_search_update AFTER UPDATE OF name, content, guildID ON tags BEGIN
+                        INSERT INTO tags_search(tags_search, rowid, name, content, guildID) VALUES ('delete', old.id, old.name, old.content, old.guildID);
+                        INSERT INTO tags_search(rowid, name, content, guildID) VALUES (new.id, new.name, new.content, new.guildID);
+                       END""")
+
+        # Index the tags which already exist.
+        cur.execute("INSERT INTO tags_search(tags_search) VALUES ('rebuild')")
+
+    """
+    Migration 8.
+    Adds a covering index used to list the timezone registrations of a server grouped by timezone, so the grouping doesn't need a temporary sort.
+
+    @param cur A cursor for the bot database.
+    """
+    @staticmethod
+    def add_timezone_group_index(cur):
+        cur.execute("CREATE INDEX timezones_group_index ON timezones(guildID, timezone, userID)")
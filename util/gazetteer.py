@@ -0,0 +1,111 @@
+import bisect
+import csv
+import os
+import sys
+import unicodedata
+
+from util.config_manager import Config
+
+"""
+This class is an offline gazetteer which resolves city names to timezones without making any requests to the GeoNames API.
+
+The gazetteer is loaded from a GeoNames cities dump, such as cities15000.txt from https://download.geonames.org/export/dump/.
+City names are normalized and stored in a sorted list with parallel lists holding the GeoNames ID and timezone of each city,
+so a lookup is a single binary search. When several cities share a name, the one with the largest population is used.
+"""
+class Gazetteer:
+    index = ([], [], [])
+
+    # The columns of the GeoNames dump that are used by the gazetteer.
+    NAME_COLUMN = 1
+    ASCII_NAME_COLUMN = 2
+    FEATURE_CLASS_COLUMN = 6
+    POPULATION_COLUMN = 14
+    TIMEZONE_COLUMN = 17
+
+    """
+    Normalizes a city name so that lookups ignore case, accents and extra whitespace.
+
+    @param name The city name to normalize.
+    @return The normalized city name.
+    """
+    @staticmethod
+    def normalize(name: str):
+        # Decompose accented characters and drop the accents, so "Zürich" and "Zurich" are the same city.
+        decomposed = unicodedata.normalize("NFKD", name)
+        stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+        return " ".join(stripped.casefold().split())
+
+    """
+    Loads the gazetteer from a GeoNames cities dump, replacing any cities that were loaded before.
+
+    @param filename The path to the GeoNames dump.
+    @return The amount of distinct city names that were loaded.
+    """
+    @staticmethod
+    def load(filename: str):
+        # Keep the most populous city for each normalized name.
+        best = {}
+
+        # The alternate names column can be very long, so the field size limit is raised to the maximum the platform allows.
+        csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+
+        with open(filename, "r", encoding="utf-8", newline="") as infile:
+            for row in csv.reader(infile, delimiter="\t", quoting=csv.QUOTE_NONE):
+                # Skip malformed rows and anything that isn't a populated place.
+                if (len(row) <= Gazetteer.TIMEZONE_COLUMN or row[Gazetteer.FEATURE_CLASS_COLUMN] != "P" or not row[Gazetteer.TIMEZONE_COLUMN]):
+                    continue
+
+                try:
+                    geonames_id = int(row[0])
+                    population = int(row[Gazetteer.POPULATION_COLUMN] or 0)
+                except ValueError:
+                    continue
+
+                entry = (population, geonames_id, row[Gazetteer.TIMEZONE_COLUMN])
+                for name in {Gazetteer.normalize(row[Gazetteer.NAME_COLUMN]), Gazetteer.normalize(row[Gazetteer.ASCII_NAME_COLUMN])}:
+                    if (name and (name not in best or best[name][0] < population)):
+                        best[name] = entry
+
+        # Build the sorted lists used for lookups and swap them in all at once, so a lookup never sees a half built index.
+        names = sorted(best.keys())
+        Gazetteer.index = (names, [best[name][1] for name in names], [best[name][2] for name in names])
+
+        return len(names)
+
+    """
+    Loads the gazetteer from the GeoNames dump specified in the config.json file, if there is one.
+
+    @return True if the gazetteer was loaded, False if not.
+    """
+    @staticmethod
+    def load_from_config():
+        filename = str(Config.get_config().get("geonames_gazetteer_file", ""))
+        if (filename == "" or not os.path.exists(filename)):
+            print("No GeoNames gazetteer file found. City lookups will use the GeoNames API.\n")
+            return False
+
+        try:
+            count = Gazetteer.load(filename)
+            print(f"Loaded {count} cities from GeoNames gazetteer file.\n")
+            return True
+        except (OSError, UnicodeDecodeError, csv.Error):
+            print("Unable to read GeoNames gazetteer file. City lookups will use the GeoNames API.\n")
+            return False
+
+    """
+    Looks up a city in the gazetteer.
+
+    @param city The name of the city.
+    @return A tuple containing the GeoNames ID and timezone of the city, or None if the city is not in the gazetteer.
+    """
+    @staticmethod
+    def lookup(city: str):
+        names, geonames_ids, timezones = Gazetteer.index
+        name = Gazetteer.normalize(city)
+
+        position = bisect.bisect_left(names, name)
+        if (position < len(names) and names[position] == name):
+            return (geonames_ids[position], timezones[position])
+
+        return None
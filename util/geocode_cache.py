@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import OrderedDict
+
+from util.config_manager import Config
+from util.database_manager import Database, DatabaseUnavailableError
+from util.gazetteer import Gazetteer
+
+"""
+This class caches the results of GeoNames API lookups so that registering the same city twice only queries the API once.
+
+Results are stored in the geocode_cache table of the bot database, keyed by the normalized city name, with a bounded in-memory tier in front
+of it. Cities that GeoNames did not recognize are cached as well, with a shorter time to live, so repeated typos don't use up the API quota.
+"""
+class GeocodeCache:
+    memory = OrderedDict()
+
+    lock = threading.Lock()
+
+    MEMORY_SIZE = 1024
+
+    # The times to live of found and unrecognized cities, which are only worked out again after the config changes.
+    ttls = None
+
+    """
+    Returns the amount of seconds a cached result stays valid for, as specified in the config.json file.
+
+    @param found Whether the result is for a city that was found or for a city that was not recognized.
+    @return The time to live of the result in seconds.
+    """
+    @staticmethod
+    def get_ttl(found: bool):
+        ttls = GeocodeCache.ttls
+        if (ttls is None):
+            ttls = GeocodeCache.load_ttls(Config.get_config())
+            GeocodeCache.ttls = ttls
+        return ttls[found]
+
+    """
+    Works out the times to live of cached results from a config.
+
+    @param config The config to read the settings from.
+    @return A dictionary mapping whether a city was found to the time to live of its result in seconds.
+    """
+    @staticmethod
+    def load_ttls(config: dict):
+        return {True: config.get("geocode_cache_ttl", 2592000), False: config.get("geocode_negative_cache_ttl", 86400)}
+
+    """
+    Config subscriber which works out the times to live of cached results again when they change.
+
+    @param old_config The old config.
+    @param new_config The new config.
+    """
+    @staticmethod
+    def on_config_changed(old_config: dict, new_config: dict):
+        if (Config.changed(old_config, new_config, "geocode_cache_ttl", "geocode_negative_cache_ttl")):
+            GeocodeCache.ttls = GeocodeCache.load_ttls(new_config)
+
+    """
+    Checks whether or not a cached result has expired.
+
+    @param result The cached result, or None for a city that was not recognized.
+    @param cached_at The unix time the result was cached at.
+    @return True if the result has expired, False if not.
+    """
+    @staticmethod
+    def is_expired(result, cached_at: int):
+        return time.time() - cached_at > GeocodeCache.get_ttl(result is not None)
+
+    """
+    Adds a result to the in-memory tier, evicting the least recently used result if it is full.
+
+    @param query The normalized city name.
+    @param result A tuple containing the GeoNames ID and timezone of the city, or None if the city was not recognized.
+    @param cached_at The unix time the result was cached at.
+    """
+    @staticmethod
+    def remember(query: str, result, cached_at: int):
+        with GeocodeCache.lock:
+            GeocodeCache.memory[query] = (result, cached_at)
+            GeocodeCache.memory.move_to_end(query)
+            while (len(GeocodeCache.memory) > GeocodeCache.MEMORY_SIZE):
+                GeocodeCache.memory.popitem(last=False)
+
+    """
+    Looks up the cached result for a city.
+
+    @param city The name of the city.
+    @return A tuple containing whether a valid cached result was found, and the result itself.
+            The result is a tuple containing the GeoNames ID and timezone of the city, or None if the city was not recognized.
+    """
+    @staticmethod
+    async def get(city: str):
+        query = Gazetteer.normalize(city)
+
+        # Check the in-memory tier first.
+        with GeocodeCache.lock:
+            cached = GeocodeCache.memory.get(query)
+            if (cached is not None):
+                GeocodeCache.memory.move_to_end(query)
+
+        # If the result isn't in memory we will check the bot database.
+        if (cached is None):
+            try:
+                row = await Database.fetch_one("SELECT geonamesID, timezone, cachedAt FROM geocode_cache WHERE query = ?", (query,))
+            except DatabaseUnavailableError:
+                row = None
+
+            if (row is None):
+                return (False, None)
+
+            cached = ((row[0], row[1]) if row[1] is not None else None, row[2])
+            GeocodeCache.remember(query, cached[0], cached[1])
+
+        # Ignore the result if it is too old.
+        result, cached_at = cached
+        if (GeocodeCache.is_expired(result, cached_at)):
+            return (False, None)
+
+        return (True, result)
+
+    """
+    Caches the result of looking up a city.
+
+    @param city The name of the city.
+    @param result A tuple containing the GeoNames ID and timezone of the city, or None if the city was not recognized.
+    """
+    @staticmethod
+    async def put(city: str, result):
+        # A result without a timezone can't be used, so it is cached as a city that was not recognized.
+        if (result is not None and result[1] is None):
+            result = None
+
+        query = Gazetteer.normalize(city)
+        cached_at = int(time.time())
+        GeocodeCache.remember(query, result, cached_at)
+
+        geonames_id, timezone = result if result is not None else (None, None)
+        try:
+            await Database.execute("INSERT OR REPLACE INTO geocode_cache(query, geonamesID, timezone, cachedAt) VALUES (?, ?, ?, ?)", (query, geonames_id, timezone, cached_at,))
+        except DatabaseUnavailableError:
+            pass
+
+    """
+    Deletes the cached results which have expired from the bot database, so the geocode_cache table doesn't grow without bound.
+    Expired results are also dropped from the in-memory tier.
+
+    @return The amount of results that were deleted from the bot database.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def delete_expired():
+        # Drop the expired results from the in-memory tier.
+        with GeocodeCache.lock:
+            expired = [query for query, (result, cached_at) in GeocodeCache.memory.items() if GeocodeCache.is_expired(result, cached_at)]
+            for query in expired:
+                del GeocodeCache.memory[query]
+
+        # Cities that were not recognized are cached without a timezone and expire sooner than cities that were found.
+        now = int(time.time())
+        return await Database.execute("""DELETE FROM geocode_cache WHERE (timezone IS NOT NULL AND cachedAt < ?)
+                                         OR (timezone IS NULL AND cachedAt < ?)""", (now - GeocodeCache.get_ttl(True), now - GeocodeCache.get_ttl(False),))
+
+# Work out the times to live of cached results again whenever the config is reloaded.
+Config.subscribe(GeocodeCache.on_config_changed)
@@ -0,0 +1,144 @@
+from collections.abc import Sequence
+
+from interactions.ext.paginators import Paginator
+
+"""
+This class holds the pages of a LazyPaginator.
+
+Only the page being shown and its neighbours are kept in memory. Pages are loaded through a loader callback which is given the key of a page to
+start from, so the loader can use keyset pagination instead of reading every row up front. The loader has the signature
+loader(anchor, forward, limit) and returns a list of up to limit (key, page) tuples in the order they are reached from the anchor. An anchor
+of None means the loader starts from the first page when moving forward, or from the last page when moving backward.
+"""
+class LazyPages(Sequence):
+    """
+    Creates the pages for a lazy paginator.
+
+    @param loader The callback used to load pages.
+    @param count The total amount of pages.
+    """
+    def __init__(self, loader, count: int):
+        self.loader = loader
+        self.count = count
+        self.loaded = {}
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index: int):
+        return self.loaded[index][1]
+
+    """
+    Creates a loader for pages whose data is already in memory, such as rows that were all read in a single query.
+    The key of each page is its index. Rendering a page can be expensive, such as when it needs the names of many users, so pages are only
+    rendered when they are loaded, and every page loaded at once is rendered in a single call so their data can be looked up together.
+
+    @param sources A list of the data needed to render each page.
+    @param render An async function which renders a list of page sources into a list of pages.
+    @return A loader callback for a LazyPaginator.
+    """
+    @staticmethod
+    def create_source_loader(sources: list, render):
+        async def load(anchor, forward: bool, limit: int):
+            # Work out the indexes of the pages to load, starting next to the anchor.
+            step = 1 if forward else -1
+            if (anchor is None):
+                start = 0 if forward else len(sources) - 1
+            else:
+                start = anchor + step
+            indexes = [index for index in range(start, start + limit * step, step) if 0 <= index < len(sources)]
+
+            pages = await render([sources[index] for index in indexes])
+            return list(zip(indexes, pages))
+
+        return load
+
+    """
+    Loads the page at an index, along with one more page in the same direction so the next button press doesn't need to wait for the loader.
+    Pages further than one page away from the loaded page are dropped, so the memory used stays the same no matter how many pages there are.
+
+    @param index The index of the page to load.
+    @param current The index of the page currently being shown.
+    @return True if the page was loaded, False if the loader didn't return it.
+    """
+    async def load(self, index: int, current: int):
+        if (index not in self.loaded):
+            # Work out which page to start loading from. The first and last pages can always be loaded without a key.
+            if (index == 0):
+                anchor, forward, start = None, True, 0
+            elif (index == self.count - 1):
+                anchor, forward, start = None, False, self.count - 1
+            elif (current in self.loaded and abs(index - current) == 1):
+                anchor, forward, start = self.loaded[current][0], index > current, index
+            else:
+                return False
+
+            # Load the requested page and prefetch the page after it.
+            results = await self.loader(anchor, forward, 2)
+            step = 1 if forward else -1
+            for offset, result in enumerate(results):
+                position = start + offset * step
+                if (0 <= position < self.count):
+                    self.loaded[position] = result
+
+            if (index not in self.loaded):
+                return False
+
+        # Drop every page that isn't next to the one being shown.
+        for position in [position for position in self.loaded if abs(position - index) > 1]:
+            del self.loaded[position]
+
+        return True
+
+"""
+This class is a paginator which only loads the pages that are shown, rather than building every page before the paginator is sent.
+
+It is used in the same way as the Paginator from interactions.py, but is created with LazyPaginator.create() from a loader callback and the
+total amount of pages. The select menu isn't supported, since it would need a summary of every page.
+
+Loading a page before the paginator moves to it relies on the private Paginator._on_button() and Paginator._timeout_task of interactions.py,
+which can change in any release. This is why interactions.py is pinned to 5.16 in the README, and tests/test_lazy_paginator.py checks that
+both still exist. Check them again before upgrading interactions.py.
+"""
+class LazyPaginator(Paginator):
+    """
+    Creates a lazy paginator and loads its first page.
+
+    @param client The client the bot is running on.
+    @param loader The callback used to load pages, as described in LazyPages.
+    @param count The total amount of pages.
+    @param timeout The amount of seconds until the paginator disables itself, or 0 to never disable it.
+    @return The lazy paginator, or None if there are no pages.
+    """
+    @classmethod
+    async def create(cls, client, loader, count: int, timeout: int = 0):
+        pages = LazyPages(loader, count)
+        if (count <= 0 or not await pages.load(0, 0)):
+            return None
+
+        return cls(client, pages=pages, timeout_interval=timeout, show_select_menu=False)
+
+    """
+    Loads the page a button leads to before the paginator moves to it.
+    If the page can't be loaded, such as when the rows behind it were deleted, the paginator stays on the current page.
+    This overrides a private method of the interactions.py Paginator, which is only known to work with the pinned version of interactions.py.
+
+    @param ctx The context of the button press.
+    """
+    async def _on_button(self, ctx, *args, **kwargs):
+        if (ctx.author.id == self.author_id):
+            # Work out which page the button leads to.
+            target = {
+                "first": 0,
+                "last": len(self.pages) - 1,
+                "next": min(self.page_index + 1, len(self.pages) - 1),
+                "back": max(self.page_index - 1, 0),
+            }.get(ctx.custom_id.split("|")[1])
+
+            if (target is not None and not await self.pages.load(target, self.page_index)):
+                if (self._timeout_task):
+                    self._timeout_task.ping.set()
+                await ctx.edit_origin(**self.to_dict())
+                return None
+
+        return await super()._on_button(ctx, *args, **kwargs)
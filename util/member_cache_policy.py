@@ -0,0 +1,171 @@
+import threading
+
+from util.config_manager import Config
+from util.database_manager import Database
+
+from interactions.client.smart_cache import create_cache
+
+"""
+This class is a cache which only keeps the entries whose keys are accepted by a filter, and silently ignores every other entry.
+It is used as the member cache of the client, so only the members referenced by the bot database are kept in memory.
+"""
+class ReferencedCache(dict):
+    """
+    Creates an empty cache.
+
+    @param is_referenced A function which returns whether an entry with a given key should be kept.
+    """
+    def __init__(self, is_referenced):
+        super().__init__()
+        self.is_referenced = is_referenced
+
+    def __setitem__(self, key, value):
+        if (self.is_referenced(key)):
+            super().__setitem__(key, value)
+
+"""
+This class decides how many server members and users the bot keeps in memory, as specified by the member_cache_policy setting in the config.
+
+The policies are:
+none - No members are cached, and they are fetched from Discord whenever they are needed.
+lru - The most recently used members are cached, up to member_cache_size of them, and are evicted after member_cache_ttl seconds.
+referenced - Only the members who have a tag or timezone registration in the bot database are cached.
+full - Every member of every server is fetched when the bot starts and kept in memory. This uses the most memory.
+
+The policy only applies to the member cache. A member looks up its name and avatar in the user cache, so unless the full policy is used the user cache
+always keeps the most recently used users, up to member_cache_size of them, for member_cache_ttl seconds.
+"""
+class MemberCachePolicy:
+    POLICIES = ("none", "lru", "referenced", "full")
+
+    DEFAULT_POLICY = "lru"
+
+    lock = threading.Lock()
+
+    # The (guild ID, user ID) pairs referenced by the bot database, as integers so they match the keys of the client's member cache.
+    referenced_members = set()
+
+    # The member cache settings, which are only worked out again after the config changes.
+    settings = None
+
+    """
+    Returns the member cache settings specified in the config.json file.
+
+    @return A dictionary containing the policy, size and ttl settings.
+    """
+    @staticmethod
+    def get_settings():
+        settings = MemberCachePolicy.settings
+        if (settings is None):
+            settings = MemberCachePolicy.load_settings(Config.get_config())
+            MemberCachePolicy.settings = settings
+        return settings
+
+    """
+    Works out the member cache settings from a config.
+
+    @param config The config to read the settings from.
+    @return A dictionary containing the policy, size and ttl settings.
+    """
+    @staticmethod
+    def load_settings(config: dict):
+        policy = config.get("member_cache_policy", MemberCachePolicy.DEFAULT_POLICY)
+        return {
+            "policy": policy if policy in MemberCachePolicy.POLICIES else MemberCachePolicy.DEFAULT_POLICY,
+            "size": max(1, config.get("member_cache_size", 1000)),
+            "ttl": max(1, config.get("member_cache_ttl", 3600)),
+        }
+
+    """
+    Config subscriber which works out the member cache settings again when they change.
+    The caches of the client are only created when the bot starts, so only the referenced members are affected until the bot is restarted.
+
+    @param old_config The old config.
+    @param new_config The new config.
+    """
+    @staticmethod
+    def on_config_changed(old_config: dict, new_config: dict):
+        if (Config.changed(old_config, new_config, "member_cache_policy", "member_cache_size", "member_cache_ttl")):
+            MemberCachePolicy.settings = MemberCachePolicy.load_settings(new_config)
+
+    """
+    Returns whether every member of every server is kept in memory.
+
+    @return True if the full policy is used, False if not.
+    """
+    @staticmethod
+    def caches_all_members():
+        return MemberCachePolicy.get_settings()["policy"] == "full"
+
+    """
+    Returns the arguments used to create the client, which set up its member cache for the policy in the config and bound its user cache.
+
+    @return A dictionary of keyword arguments for the Client.
+    """
+    @staticmethod
+    def get_client_options():
+        settings = MemberCachePolicy.get_settings()
+        policy = settings["policy"]
+        if (Config.get_config().get("member_cache_policy", policy) != policy):
+            print(f"Warning: Unknown member_cache_policy in config, using '{policy}' instead.")
+
+        if (policy == "full"):
+            return {"fetch_members": True}
+
+        # Members read their user from the user cache, so it has to keep users no matter which policy is used for members.
+        options = {"fetch_members": False, "user_cache": create_cache(settings["ttl"], settings["size"])}
+        if (policy == "none"):
+            options["member_cache"] = create_cache(0, 0, 0)
+        elif (policy == "referenced"):
+            options["member_cache"] = ReferencedCache(MemberCachePolicy.is_referenced_member)
+        else:
+            options["member_cache"] = create_cache(settings["ttl"], settings["size"])
+
+        return options
+
+    """
+    Returns whether a member is referenced by the bot database.
+
+    @param key The (guild ID, user ID) key of the member in the member cache.
+    @return True if the member has a tag or timezone registration in the server, False if not.
+    """
+    @staticmethod
+    def is_referenced_member(key):
+        return key in MemberCachePolicy.referenced_members
+
+    """
+    Loads the members referenced by the bot database, replacing the ones that were loaded before.
+    This does nothing unless the referenced policy is used.
+
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def load_references():
+        if (MemberCachePolicy.get_settings()["policy"] != "referenced"):
+            return
+
+        rows = await Database.fetch_all("SELECT guildID, authorID FROM tags UNION SELECT guildID, userID FROM timezones")
+
+        members = set()
+        for guild_id, user_id in rows:
+            if (guild_id.isdigit() and user_id.isdigit()):
+                members.add((int(guild_id), int(user_id)))
+
+        with MemberCachePolicy.lock:
+            MemberCachePolicy.referenced_members = members
+
+    """
+    Marks a member as referenced by the bot database, such as after they create a tag, so they are cached from now on.
+    References are only removed when they are loaded again, which happens after every cleanup of the bot database.
+
+    @param guild_id The guild ID of the server.
+    @param user_id The user ID of the member.
+    """
+    @staticmethod
+    def add_reference(guild_id: str, user_id: str):
+        if (guild_id.isdigit() and user_id.isdigit()):
+            with MemberCachePolicy.lock:
+                MemberCachePolicy.referenced_members.add((int(guild_id), int(user_id)))
+
+# Work out the member cache settings again whenever the config is reloaded.
+Config.subscribe(MemberCachePolicy.on_config_changed)
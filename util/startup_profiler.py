@@ -0,0 +1,72 @@
+import sys
+import time
+from contextlib import contextmanager
+
+"""
+This class measures how long each phase of the bot's startup takes, such as reading the config, setting up the bot database and importing and
+loading each extension.
+
+The phases are always measured, since measuring them is cheap, but the report is only printed when the startup profile mode is enabled in the config.
+Along with the time of each phase, the report lists the amount of modules that were imported during it, which shows which phases pull in heavy dependencies.
+"""
+class StartupProfiler:
+    # The time the bot process started, which is set by minibot.py before anything else is imported.
+    start_time = time.perf_counter()
+
+    phases = []
+
+    """
+    Sets the time the bot process started. Every phase and the total startup time are measured from this time.
+
+    @param start_time The value of time.perf_counter() when the process started.
+    """
+    @staticmethod
+    def set_start_time(start_time: float):
+        StartupProfiler.start_time = start_time
+
+    """
+    Measures a phase of the startup. This is used as a context manager around the code of the phase.
+
+    @param name The name of the phase.
+    """
+    @staticmethod
+    @contextmanager
+    def measure(name: str):
+        modules_before = len(sys.modules)
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # Record the phase even if it failed, so the report shows how far the startup got.
+            StartupProfiler.phases.append((name, time.perf_counter() - phase_start, len(sys.modules) - modules_before))
+
+    """
+    Returns a report of every phase of the startup that was measured.
+
+    @param label What the startup reached when the report was made, such as "on_ready".
+    @return The report as a string.
+    """
+    @staticmethod
+    def get_report(label: str):
+        total = time.perf_counter() - StartupProfiler.start_time
+        lines = [f"Startup profile ({total * 1000:.1f} ms from process start to {label}):"]
+
+        # List the slowest phases first.
+        for name, duration, modules in sorted(StartupProfiler.phases, key=lambda phase: phase[1], reverse=True):
+            lines.append(f"  {duration * 1000:9.1f} ms  {modules:4} modules imported  {name}")
+
+        # Whatever wasn't measured is mostly spent connecting to Discord and waiting for the gateway.
+        unmeasured = total - sum(phase[1] for phase in StartupProfiler.phases)
+        lines.append(f"  {unmeasured * 1000:9.1f} ms  (connecting to Discord and everything else)")
+        return "\n".join(lines)
+
+    """
+    Prints the startup report if the startup profile mode is enabled.
+
+    @param enabled Whether the startup profile mode is enabled in the config.
+    @param label What the startup reached when the report was made.
+    """
+    @staticmethod
+    def report(enabled: bool, label: str):
+        if (enabled):
+            print(StartupProfiler.get_report(label))
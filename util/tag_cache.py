@@ -0,0 +1,208 @@
+import threading
+from collections import OrderedDict
+
+from util.config_manager import Config
+
+"""
+This class is an in-memory cache of tag contents which sits in front of the tags table in the bot database.
+
+Tags are cached per server, keyed by guild ID and tag name. The cache holds a bounded amount of tags and evicts the least recently used tag
+once it is full. Any command or listener which changes or deletes tags must invalidate the affected entries so stale content is never served.
+"""
+class TagCache:
+    entries = OrderedDict()
+
+    guild_index = {}
+
+    lock = threading.Lock()
+
+    hits = 0
+
+    misses = 0
+
+    generation = 0
+
+    # The maximum size of the cache, which is only worked out again after the config changes.
+    max_size = None
+
+    """
+    Returns the maximum amount of tags the cache will hold, as specified in the config.json file.
+
+    @return The maximum size of the cache.
+    """
+    @staticmethod
+    def get_max_size():
+        max_size = TagCache.max_size
+        if (max_size is None):
+            max_size = TagCache.load_max_size(Config.get_config())
+            TagCache.max_size = max_size
+        return max_size
+
+    """
+    Works out the maximum amount of tags the cache will hold from a config.
+
+    @param config The config to read the setting from.
+    @return The maximum size of the cache.
+    """
+    @staticmethod
+    def load_max_size(config: dict):
+        return max(0, config.get("tag_cache_size", 1000))
+
+    """
+    Config subscriber which works out the maximum size of the cache again when it changes.
+    Tags over the new limit are evicted the next time a tag is added to the cache.
+
+    @param old_config The old config.
+    @param new_config The new config.
+    """
+    @staticmethod
+    def on_config_changed(old_config: dict, new_config: dict):
+        if (Config.changed(old_config, new_config, "tag_cache_size")):
+            TagCache.max_size = TagCache.load_max_size(new_config)
+
+    """
+    Returns a cached tag and marks it as recently used.
+
+    @param guild_id The guild ID of the server the tag belongs to.
+    @param name The tag's name.
+    @return A tuple containing the content and author ID of the tag, or None if the tag is not cached.
+    """
+    @staticmethod
+    def get(guild_id: str, name: str):
+        with TagCache.lock:
+            key = (guild_id, name)
+            entry = TagCache.entries.get(key)
+            if (entry is None):
+                TagCache.misses += 1
+                return None
+
+            TagCache.entries.move_to_end(key)
+            TagCache.hits += 1
+            return entry
+
+    """
+    Returns the current generation of the cache. The generation changes every time tags are invalidated.
+    Callers loading a tag from the bot database should read the generation before running their query and pass it to TagCache.put().
+
+    @return The current generation of the cache.
+    """
+    @staticmethod
+    def get_generation():
+        return TagCache.generation
+
+    """
+    Adds a tag to the cache, evicting the least recently used tags if the cache is full.
+    The tag is not added if any tags were invalidated since the given generation, since the tag may have been changed or deleted in the meantime.
+
+    @param guild_id The guild ID of the server the tag belongs to.
+    @param name The tag's name.
+    @param content The tag's content.
+    @param author_id The user ID of the tag's author.
+    @param generation The generation of the cache from before the tag was loaded from the bot database.
+    """
+    @staticmethod
+    def put(guild_id: str, name: str, content: str, author_id: str, generation: int):
+        max_size = TagCache.get_max_size()
+        if (max_size == 0):
+            return
+
+        with TagCache.lock:
+            if (generation != TagCache.generation):
+                return
+
+            key = (guild_id, name)
+            TagCache.entries[key] = (content, author_id)
+            TagCache.entries.move_to_end(key)
+            TagCache.guild_index.setdefault(guild_id, set()).add(name)
+
+            # Evict the least recently used tags until the cache is back within its bounds.
+            while (len(TagCache.entries) > max_size):
+                (evicted_guild_id, evicted_name), _ = TagCache.entries.popitem(last=False)
+                TagCache.remove_from_guild_index(evicted_guild_id, evicted_name)
+
+    """
+    Removes a tag from the per-server index of cached tag names. The cache lock must be held by the caller.
+
+    @param guild_id The guild ID of the server the tag belongs to.
+    @param name The tag's name.
+    """
+    @staticmethod
+    def remove_from_guild_index(guild_id: str, name: str):
+        names = TagCache.guild_index.get(guild_id)
+        if (names is not None):
+            names.discard(name)
+            if (not names):
+                del TagCache.guild_index[guild_id]
+
+    """
+    Removes a single tag from the cache.
+
+    @param guild_id The guild ID of the server the tag belongs to.
+    @param name The tag's name.
+    """
+    @staticmethod
+    def invalidate(guild_id: str, name: str):
+        with TagCache.lock:
+            TagCache.generation += 1
+            if (TagCache.entries.pop((guild_id, name), None) is not None):
+                TagCache.remove_from_guild_index(guild_id, name)
+
+    """
+    Removes every tag belonging to a server from the cache.
+
+    @param guild_id The guild ID of the server.
+    """
+    @staticmethod
+    def invalidate_guild(guild_id: str):
+        with TagCache.lock:
+            TagCache.generation += 1
+            for name in TagCache.guild_index.pop(guild_id, ()):
+                TagCache.entries.pop((guild_id, name), None)
+
+    """
+    Removes every tag created by a user from the cache.
+
+    @param author_id The user ID of the author.
+    @param guild_id The guild ID of the server to remove the tags from, or None to remove the tags from every server.
+    """
+    @staticmethod
+    def invalidate_author(author_id: str, guild_id: str = None):
+        with TagCache.lock:
+            TagCache.generation += 1
+            if (guild_id is None):
+                keys = [key for key, entry in TagCache.entries.items() if entry[1] == author_id]
+            else:
+                keys = [(guild_id, name) for name in TagCache.guild_index.get(guild_id, ()) if TagCache.entries[(guild_id, name)][1] == author_id]
+
+            for key in keys:
+                del TagCache.entries[key]
+                TagCache.remove_from_guild_index(key[0], key[1])
+
+    """
+    Removes every tag from the cache.
+    """
+    @staticmethod
+    def clear():
+        with TagCache.lock:
+            TagCache.generation += 1
+            TagCache.entries.clear()
+            TagCache.guild_index.clear()
+
+    """
+    Returns statistics about the cache.
+
+    @return A dictionary containing the amount of cached tags, hits and misses, and the hit rate of the cache.
+    """
+    @staticmethod
+    def get_stats():
+        with TagCache.lock:
+            lookups = TagCache.hits + TagCache.misses
+            return {
+                "size": len(TagCache.entries),
+                "hits": TagCache.hits,
+                "misses": TagCache.misses,
+                "hit_rate": TagCache.hits / lookups if lookups > 0 else 0.0
+            }
+
+# Work out the maximum size of the cache again whenever the config is reloaded.
+Config.subscribe(TagCache.on_config_changed)
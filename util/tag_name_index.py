@@ -0,0 +1,174 @@
+import bisect
+import random
+import threading
+
+from util.database_manager import Database
+
+"""
+This class is an in-memory index of the names of every tag, used to answer autocomplete requests for tag names without querying the bot database.
+
+The names of each server's tags are kept in a list sorted by their casefolded name, so the suggestions for a prefix are found with a binary search.
+The index is loaded when the bot starts, and any command or listener which adds or deletes tags must update it, in the same way as the TagCache.
+"""
+class TagNameIndex:
+    guilds = {}
+
+    lock = threading.Lock()
+
+    generation = 0
+
+    loaded = False
+
+    # The maximum length of an autocomplete choice allowed by Discord.
+    MAX_CHOICE_LENGTH = 100
+
+    """
+    Builds the sorted name list of a server from its tag names.
+
+    @param names The names of the server's tags.
+    @return A list of (casefolded name, name) tuples sorted by the casefolded name.
+    """
+    @staticmethod
+    def build(names):
+        return sorted((name.casefold(), name) for name in names)
+
+    """
+    Loads the names of every tag in the bot database into the index, replacing the names that were loaded before.
+    If the index changes while the names are being read, the names are read again so the index doesn't miss the change.
+
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def warm():
+        for attempt in range(3):
+            generation = TagNameIndex.generation
+            rows = await Database.fetch_all("SELECT guildID, name FROM tags")
+
+            names = {}
+            for guild_id, name in rows:
+                names.setdefault(guild_id, []).append(name)
+
+            with TagNameIndex.lock:
+                if (generation == TagNameIndex.generation or attempt == 2):
+                    TagNameIndex.generation += 1
+                    TagNameIndex.guilds = {guild_id: TagNameIndex.build(guild_names) for guild_id, guild_names in names.items()}
+                    TagNameIndex.loaded = True
+                    return
+
+    """
+    Loads the names of a server's tags into the index, replacing the names that were loaded before.
+    This is used after deleting tags whose names aren't known, such as every tag created by a user.
+
+    @param guild_id The guild ID of the server.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def load_guild(guild_id: str):
+        for attempt in range(3):
+            generation = TagNameIndex.generation
+            rows = await Database.fetch_all("SELECT name FROM tags WHERE guildID = ?", (guild_id,))
+
+            with TagNameIndex.lock:
+                if (generation == TagNameIndex.generation or attempt == 2):
+                    TagNameIndex.generation += 1
+                    if (rows):
+                        TagNameIndex.guilds[guild_id] = TagNameIndex.build(row[0] for row in rows)
+                    else:
+                        TagNameIndex.guilds.pop(guild_id, None)
+                    return
+
+    """
+    Adds the name of a tag to the index.
+
+    @param guild_id The guild ID of the server the tag belongs to.
+    @param name The tag's name.
+    """
+    @staticmethod
+    def add(guild_id: str, name: str):
+        with TagNameIndex.lock:
+            TagNameIndex.generation += 1
+            names = TagNameIndex.guilds.setdefault(guild_id, [])
+            entry = (name.casefold(), name)
+            position = bisect.bisect_left(names, entry)
+            if (position == len(names) or names[position] != entry):
+                names.insert(position, entry)
+
+    """
+    Removes the name of a tag from the index.
+
+    @param guild_id The guild ID of the server the tag belongs to.
+    @param name The tag's name.
+    """
+    @staticmethod
+    def remove(guild_id: str, name: str):
+        with TagNameIndex.lock:
+            TagNameIndex.generation += 1
+            names = TagNameIndex.guilds.get(guild_id)
+            if (names is None):
+                return
+
+            entry = (name.casefold(), name)
+            position = bisect.bisect_left(names, entry)
+            if (position < len(names) and names[position] == entry):
+                del names[position]
+            if (not names):
+                del TagNameIndex.guilds[guild_id]
+
+    """
+    Removes the names of every tag in a server from the index.
+
+    @param guild_id The guild ID of the server.
+    """
+    @staticmethod
+    def remove_guild(guild_id: str):
+        with TagNameIndex.lock:
+            TagNameIndex.generation += 1
+            TagNameIndex.guilds.pop(guild_id, None)
+
+    """
+    Removes every name from the index.
+    """
+    @staticmethod
+    def clear():
+        with TagNameIndex.lock:
+            TagNameIndex.generation += 1
+            TagNameIndex.guilds = {}
+
+    """
+    Returns the names of a server's tags which start with a prefix, ignoring case.
+
+    @param guild_id The guild ID of the server.
+    @param prefix The prefix to search for.
+    @param limit The maximum amount of names to return.
+    @return A list of tag names in alphabetical order.
+    """
+    @staticmethod
+    def suggest(guild_id: str, prefix: str, limit: int = 25):
+        prefix = prefix.casefold()
+        suggestions = []
+
+        with TagNameIndex.lock:
+            names = TagNameIndex.guilds.get(guild_id, [])
+            position = bisect.bisect_left(names, (prefix,))
+            while (position < len(names) and len(suggestions) < limit and names[position][0].startswith(prefix)):
+                # Names that are too long to be an autocomplete choice are skipped.
+                if (len(names[position][1]) <= TagNameIndex.MAX_CHOICE_LENGTH):
+                    suggestions.append(names[position][1])
+                position += 1
+
+        return suggestions
+
+    """
+    Returns the name of a random tag in a server. Every tag is equally likely to be chosen, and choosing one takes constant time.
+
+    @param guild_id The guild ID of the server.
+    @return The name of a random tag, or None if the server has no tags.
+    """
+    @staticmethod
+    def random_name(guild_id: str):
+        with TagNameIndex.lock:
+            names = TagNameIndex.guilds.get(guild_id)
+            if (not names):
+                return None
+
+            return random.choice(names)[1]
@@ -0,0 +1,123 @@
+import bisect
+import itertools
+import random
+import threading
+import time
+
+from util.config_manager import Config
+from util.database_manager import Database
+from util.tag_usage_counter import TagUsageCounter
+
+"""
+This class chooses random tags weighted by how often they have been used, so that popular tags come up more often.
+
+Each server has a list of tag names with a parallel list of cumulative weights, so choosing a tag is a single random number and a binary search.
+The weight of a tag is its amount of uses plus one, so tags that have never been used can still be chosen. Since the amount of uses is only
+written to the bot database in batches, the lists are rebuilt at most once per tag usage flush interval, when tags are added to or removed from
+the server, or when a chosen tag no longer exists.
+"""
+class TagSampler:
+    samplers = {}
+
+    lock = threading.Lock()
+
+    # The time to live of the weights, which is only worked out again after the config changes.
+    ttl = None
+
+    """
+    Returns the amount of seconds a server's weights are reused for before they are rebuilt, which is the tag usage flush interval in the config.json file.
+
+    @return The time to live of the weights in seconds.
+    """
+    @staticmethod
+    def get_ttl():
+        ttl = TagSampler.ttl
+        if (ttl is None):
+            ttl = TagSampler.load_ttl(Config.get_config())
+            TagSampler.ttl = ttl
+        return ttl
+
+    """
+    Works out the time to live of the weights from a config.
+
+    @param config The config to read the setting from.
+    @return The time to live of the weights in seconds.
+    """
+    @staticmethod
+    def load_ttl(config: dict):
+        return max(1, config.get("tag_usage_flush_interval", 30))
+
+    """
+    Config subscriber which works out the time to live of the weights again when the tag usage flush interval changes.
+
+    @param old_config The old config.
+    @param new_config The new config.
+    """
+    @staticmethod
+    def on_config_changed(old_config: dict, new_config: dict):
+        if (Config.changed(old_config, new_config, "tag_usage_flush_interval")):
+            TagSampler.ttl = TagSampler.load_ttl(new_config)
+
+    """
+    Builds the names and cumulative weights of a server's tags from the bot database.
+
+    @param guild_id The guild ID of the server.
+    @return A tuple containing the time the weights were built, the tag names and their cumulative weights.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def build(guild_id: str):
+        rows = await Database.fetch_all("SELECT name, amountUsed FROM tags WHERE guildID = ?", (guild_id,))
+        names = [row[0] for row in rows]
+        weights = (row[1] + TagUsageCounter.get_pending(guild_id, row[0]) + 1 for row in rows)
+        return (time.monotonic(), names, list(itertools.accumulate(weights)))
+
+    """
+    Returns the name of a random tag in a server, weighted by the amount of times each tag has been used.
+
+    @param guild_id The guild ID of the server.
+    @return The name of a random tag, or None if the server has no tags.
+    @throws DatabaseUnavailableError If a connection to the bot database could not be made.
+    """
+    @staticmethod
+    async def weighted_name(guild_id: str):
+        with TagSampler.lock:
+            sampler = TagSampler.samplers.get(guild_id)
+
+        # Rebuild the weights of this server if they are missing or out of date.
+        if (sampler is None or time.monotonic() - sampler[0] > TagSampler.get_ttl()):
+            sampler = await TagSampler.build(guild_id)
+            with TagSampler.lock:
+                # Drop the weights of any servers which are out of date as well, so servers that stop using weighted tags don't keep their weights.
+                ttl = TagSampler.get_ttl()
+                for expired in [key for key, value in TagSampler.samplers.items() if sampler[0] - value[0] > ttl]:
+                    del TagSampler.samplers[expired]
+                TagSampler.samplers[guild_id] = sampler
+
+        _, names, cumulative = sampler
+        if (not names):
+            return None
+
+        # Pick a point along the total weight and find the tag it falls on.
+        return names[bisect.bisect_right(cumulative, random.random() * cumulative[-1])]
+
+    """
+    Removes the weights of a server, so they are rebuilt the next time a weighted tag is chosen.
+
+    @param guild_id The guild ID of the server.
+    """
+    @staticmethod
+    def invalidate(guild_id: str):
+        with TagSampler.lock:
+            TagSampler.samplers.pop(guild_id, None)
+
+    """
+    Removes the weights of every server, so they are rebuilt the next time a weighted tag is chosen in each server.
+    """
+    @staticmethod
+    def clear():
+        with TagSampler.lock:
+            TagSampler.samplers = {}
+
+# Work out the time to live of the weights again whenever the config is reloaded.
+Config.subscribe(TagSampler.on_config_changed)
@@ -0,0 +1,264 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, datetime
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+from util.config_manager import Config
+from util.database_manager import Database
+from util.database_migrations import DatabaseMigrations
+
+"""
+This class exports tags from the bot database to a file, and imports tags from a file into the bot database.
+
+Tags are written one per line as NDJSON (a JSON object per line) or as CSV with a header row. Both exports and imports stream the tags, so only
+a batch of tags is held in memory at once no matter how large the file is. Imports insert each batch with a single executemany() and commit
+it as one transaction, and tags whose (guildID, name) already exists are either skipped or replaced.
+
+The owner commands /tag_export and /tag_import use this class while the bot is running. It can also be run from the command line, with
+python -m util.tag_transfer, while the bot is stopped. Run it with --help for the available options.
+"""
+class TagTransfer:
+    FORMATS = ("ndjson", "csv")
+
+    CONFLICT_MODES = ("skip", "replace")
+
+    # The columns of the tags table that are exported, in the order they are written.
+    FIELDS = ("guildID", "name", "content", "authorID", "date", "createdAt", "amountUsed")
+
+    # The amount of tags read from the database or the file at once, and inserted in a single transaction.
+    BATCH_SIZE = 5000
+
+    """
+    Works out the format of a tag file from its name.
+
+    @param file_name The name of the file.
+    @return The format of the file, defaulting to NDJSON for unknown extensions.
+    """
+    @staticmethod
+    def get_format(file_name: str):
+        return "csv" if file_name.lower().endswith(".csv") else "ndjson"
+
+    """
+    Writes tags from the bot database to a file, one batch at a time.
+
+    @param con The connection to the bot database.
+    @param path The path of the file to write.
+    @param file_format The format of the file, either "ndjson" or "csv".
+    @param guild_id The guild ID of the server to export the tags of, or None to export the tags of every server.
+    @return The amount of tags that were exported.
+    """
+    @staticmethod
+    def export_tags(con, path: str, file_format: str, guild_id: str = None):
+        columns = ", ".join(TagTransfer.FIELDS)
+        if (guild_id is None):
+            cur = con.execute(f"SELECT {columns} FROM tags ORDER BY guildID, name")
+        else:
+            cur = con.execute(f"SELECT {columns} FROM tags WHERE guildID = ? ORDER BY name", (guild_id,))
+
+        exported = 0
+        with open(path, "w", encoding="utf-8", newline="") as file:
+            if (file_format == "csv"):
+                writer = csv.writer(file)
+                writer.writerow(TagTransfer.FIELDS)
+
+            while (True):
+                rows = cur.fetchmany(TagTransfer.BATCH_SIZE)
+                if (not rows):
+                    break
+
+                if (file_format == "csv"):
+                    writer.writerows(rows)
+                else:
+                    file.writelines(json.dumps(dict(zip(TagTransfer.FIELDS, row)), ensure_ascii=False) + "\n" for row in rows)
+                exported += len(rows)
+
+        return exported
+
+    """
+    Reads the tags from a file, one at a time.
+    Tags without a name or content are skipped. Missing authors, dates and amounts of uses are filled in with defaults.
+
+    @param file An open text file to read from.
+    @param file_format The format of the file, either "ndjson" or "csv".
+    @param guild_id The guild ID to import every tag into, or None to keep the guild ID of each tag.
+    @return A generator of tuples containing the values of TagTransfer.FIELDS for each tag.
+    @throws ValueError If a line of the file is not valid JSON.
+    @throws csv.Error If a line of the file is not valid CSV.
+    """
+    @staticmethod
+    def read_tags(file, file_format: str, guild_id: str = None):
+        if (file_format == "csv"):
+            records = csv.DictReader(file)
+        else:
+            records = (json.loads(line) for line in file if line.strip())
+
+        today = date.today().strftime("%b-%d-%Y")
+        for record in records:
+            if (not isinstance(record, dict)):
+                raise ValueError("every line must be a JSON object")
+
+            # Skip tags which can't be used.
+            name = record.get("name")
+            content = record.get("content")
+            target_guild_id = guild_id if guild_id is not None else record.get("guildID")
+            if (not name or not content or not target_guild_id):
+                continue
+
+            # Fill in the creation time from the date if it is missing, in the same way as the migration which added it.
+            tag_date = str(record.get("date") or today)
+            try:
+                created_at = int(record.get("createdAt") or datetime.strptime(tag_date, "%b-%d-%Y").timestamp())
+            except (TypeError, ValueError):
+                created_at = int(time.time())
+
+            try:
+                amount_used = max(0, int(record.get("amountUsed") or 0))
+            except (TypeError, ValueError):
+                amount_used = 0
+
+            yield (str(target_guild_id), str(name), str(content), str(record.get("authorID") or ""), tag_date, created_at, amount_used)
+
+    """
+    Splits tags into batches of TagTransfer.BATCH_SIZE tags.
+
+    @param tags An iterable of tuples containing the values of TagTransfer.FIELDS for each tag, such as from TagTransfer.read_tags().
+    @return A generator of lists of tags.
+    """
+    @staticmethod
+    def batch_tags(tags):
+        batch = []
+        for tag in tags:
+            batch.append(tag)
+            if (len(batch) >= TagTransfer.BATCH_SIZE):
+                yield batch
+                batch = []
+
+        if (batch):
+            yield batch
+
+    """
+    Builds the statement which inserts a tag.
+
+    @param on_conflict What to do with tags whose (guildID, name) already exists, either "skip" or "replace".
+    @return The insert statement.
+    """
+    @staticmethod
+    def get_insert_sql(on_conflict: str = "skip"):
+        columns = ", ".join(TagTransfer.FIELDS)
+        sql = f"INSERT INTO tags({columns}) VALUES ({', '.join('?' for _ in TagTransfer.FIELDS)}) ON CONFLICT(guildID, name) "
+        if (on_conflict == "replace"):
+            sql += "DO UPDATE SET " + ", ".join(f"{field} = excluded.{field}" for field in TagTransfer.FIELDS[2:])
+        else:
+            sql += "DO NOTHING"
+        return sql
+
+    """
+    Inserts tags into the bot database. The tags are inserted in batches, and each batch is committed as its own transaction.
+
+    @param con The connection to the bot database.
+    @param tags An iterable of tuples containing the values of TagTransfer.FIELDS for each tag, such as from TagTransfer.read_tags().
+    @param on_conflict What to do with tags whose (guildID, name) already exists, either "skip" or "replace".
+    @return A tuple containing the amount of tags that were read, the amount that were inserted or replaced, and the set of guild IDs that were read.
+    """
+    @staticmethod
+    def import_tags(con, tags, on_conflict: str = "skip"):
+        sql = TagTransfer.get_insert_sql(on_conflict)
+
+        read = 0
+        imported = 0
+        guild_ids = set()
+        for batch in TagTransfer.batch_tags(tags):
+            guild_ids.update(tag[0] for tag in batch)
+            imported += TagTransfer.insert_batch(con, sql, batch)
+            read += len(batch)
+
+        return (read, imported, guild_ids)
+
+    """
+    Inserts a batch of tags with a single executemany() and commits it.
+
+    @param con The connection to the bot database.
+    @param sql The insert statement.
+    @param batch A list of tuples containing the values of TagTransfer.FIELDS for each tag.
+    @return The amount of tags that were inserted or replaced.
+    """
+    @staticmethod
+    def insert_batch(con, sql: str, batch: list):
+        inserted = con.executemany(sql, batch).rowcount
+        con.commit()
+        return inserted
+
+    """
+    Imports tags from a file into the bot database.
+
+    @param con The connection to the bot database.
+    @param path The path of the file to read.
+    @param file_format The format of the file, either "ndjson" or "csv".
+    @param guild_id The guild ID to import every tag into, or None to keep the guild ID of each tag.
+    @param on_conflict What to do with tags whose (guildID, name) already exists, either "skip" or "replace".
+    @return A tuple containing the amount of tags that were read, the amount that were inserted or replaced, and the set of guild IDs that were read.
+    @throws ValueError If a line of the file is not valid. The batches imported before that stay imported.
+    @throws csv.Error If a line of a CSV file is not valid. The batches imported before that stay imported.
+    """
+    @staticmethod
+    def import_file(con, path: str, file_format: str, guild_id: str = None, on_conflict: str = "skip"):
+        with open(path, "r", encoding="utf-8", newline="") as file:
+            return TagTransfer.import_tags(con, TagTransfer.read_tags(file, file_format, guild_id), on_conflict)
+
+    """
+    Runs the command line interface, which exports or imports tags while the bot is stopped.
+
+    @param args The command line arguments.
+    @return The exit code.
+    """
+    @staticmethod
+    def main(args = None):
+        parser = argparse.ArgumentParser(prog="python -m util.tag_transfer", description="Exports or imports the tags in the bot database. The bot should be stopped while tags are imported.")
+        parser.add_argument("action", choices=("export", "import"), help="Whether to export tags to the file or import tags from it")
+        parser.add_argument("file", help="The tag file to write or read")
+        parser.add_argument("--format", choices=TagTransfer.FORMATS, help="The format of the file, which is detected from its extension by default")
+        parser.add_argument("--guild", help="Only export the tags of this guild ID, or import every tag into this guild ID")
+        parser.add_argument("--on-conflict", choices=TagTransfer.CONFLICT_MODES, default="skip", help="What to do with imported tags whose name is already used in their server")
+        parser.add_argument("--database", help="The bot database file, which is read from config.json by default")
+        options = parser.parse_args(args)
+
+        # Get the bot database name from the config if it wasn't given.
+        if (options.database is None):
+            Config.read_config()
+            options.database = Database.get_database_name()
+
+        file_format = options.format or TagTransfer.get_format(options.file)
+        # Open the bot database in read-write mode so that a missing database file is not silently created.
+        try:
+            con = sqlite3.connect(f"file:{options.database}?mode=rw", uri=True)
+        except sqlite3.Error as error:
+            print(f"Unable to open the bot database {options.database}: {error}", file=sys.stderr)
+            return 1
+
+        try:
+            # Make sure the schema of the bot database is up to date, in the same way as when the bot starts.
+            DatabaseMigrations.migrate(con)
+
+            if (options.action == "export"):
+                exported = TagTransfer.export_tags(con, options.file, file_format, options.guild)
+                print(f"Exported {exported} tag(s) to {options.file}.")
+            else:
+                try:
+                    read, imported, _ = TagTransfer.import_file(con, options.file, file_format, options.guild, options.on_conflict)
+                except (OSError, ValueError, csv.Error) as error:
+                    print(f"Unable to import tags from {options.file}: {error}", file=sys.stderr)
+                    return 1
+                print(f"Read {read} tag(s) from {options.file} and imported {imported} of them.")
+        finally:
+            con.close()
+
+        return 0
+
+if (__name__ == "__main__"):
+    sys.exit(TagTransfer.main())
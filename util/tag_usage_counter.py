@@ -0,0 +1,162 @@
+import sqlite3
+import threading
+
+from util.config_manager import Config
+from util.database_manager import Database, DatabaseUnavailableError
+
+"""
+This class accumulates tag usage counts in memory and writes them to the bot database in batches.
+
+Reading a tag only increments an in-memory counter. The accumulated counts are added to the amountUsed column of the tags table in a single
+transaction, either periodically, once enough uses have accumulated, or when the bot shuts down. Because the counts are added to the stored
+value inside the database, concurrent uses of the same tag can never overwrite each other's increments.
+"""
+class TagUsageCounter:
+    pending = {}
+
+    pending_total = 0
+
+    lock = threading.Lock()
+
+    # The flush threshold, which is only worked out again after the config changes since it is checked on every use of a tag.
+    flush_threshold = None
+
+    """
+    Returns the amount of accumulated uses after which the pending counts should be flushed, as specified in the config.json file.
+
+    @return The flush threshold.
+    """
+    @staticmethod
+    def get_flush_threshold():
+        flush_threshold = TagUsageCounter.flush_threshold
+        if (flush_threshold is None):
+            flush_threshold = Config.get_config().get("tag_usage_flush_threshold", 500)
+            TagUsageCounter.flush_threshold = flush_threshold
+        return flush_threshold
+
+    """
+    Config subscriber which picks up a changed flush threshold.
+
+    @param old_config The old config.
+    @param new_config The new config.
+    """
+    @staticmethod
+    def on_config_changed(old_config: dict, new_config: dict):
+        if (Config.changed(old_config, new_config, "tag_usage_flush_threshold")):
+            TagUsageCounter.flush_threshold = new_config.get("tag_usage_flush_threshold", 500)
+
+    """
+    Records a single use of a tag.
+
+    @param guild_id The guild ID of the server the tag belongs to.
+    @param name The tag's name.
+    @return True if enough uses have accumulated that the pending counts should be flushed, False if not.
+    """
+    @staticmethod
+    def increment(guild_id: str, name: str):
+        with TagUsageCounter.lock:
+            key = (guild_id, name)
+            TagUsageCounter.pending[key] = TagUsageCounter.pending.get(key, 0) + 1
+            TagUsageCounter.pending_total += 1
+            return TagUsageCounter.pending_total >= TagUsageCounter.get_flush_threshold()
+
+    """
+    Returns the amount of uses of a tag that have not been written to the bot database yet.
+
+    @param guild_id The guild ID of the server the tag belongs to.
+    @param name The tag's name.
+    @return The amount of pending uses for the tag.
+    """
+    @staticmethod
+    def get_pending(guild_id: str, name: str):
+        with TagUsageCounter.lock:
+            return TagUsageCounter.pending.get((guild_id, name), 0)
+
+    """
+    Forgets the pending uses of tags which are being deleted, so they aren't added to a new tag which is later created with the same name.
+
+    @param guild_id The guild ID of the tags to forget, or None to forget tags from every server.
+    @param name The name of the tag to forget, or None to forget every tag in the server.
+    """
+    @staticmethod
+    def discard(guild_id: str = None, name: str = None):
+        with TagUsageCounter.lock:
+            for key in list(TagUsageCounter.pending.keys()):
+                if ((guild_id is None or key[0] == guild_id) and (name is None or key[1] == name)):
+                    TagUsageCounter.pending_total -= TagUsageCounter.pending.pop(key)
+
+    """
+    Removes every pending count from the accumulator.
+
+    @return A list of (delta, guildID, name) tuples ready to be passed to TagUsageCounter.apply_updates().
+    """
+    @staticmethod
+    def take_pending():
+        with TagUsageCounter.lock:
+            pending = TagUsageCounter.pending
+            TagUsageCounter.pending = {}
+            TagUsageCounter.pending_total = 0
+        return [(delta, guild_id, name) for (guild_id, name), delta in pending.items()]
+
+    """
+    Puts counts that could not be written back into the accumulator so they are retried on the next flush.
+
+    @param updates A list of (delta, guildID, name) tuples returned by TagUsageCounter.take_pending().
+    """
+    @staticmethod
+    def restore_pending(updates):
+        with TagUsageCounter.lock:
+            for delta, guild_id, name in updates:
+                key = (guild_id, name)
+                TagUsageCounter.pending[key] = TagUsageCounter.pending.get(key, 0) + delta
+                TagUsageCounter.pending_total += delta
+
+    """
+    Adds the given counts to the amountUsed column of the tags table.
+    This function is run on the database writer thread.
+
+    @param con The connection to the bot database.
+    @param updates A list of (delta, guildID, name) tuples.
+    """
+    @staticmethod
+    def apply_updates(con, updates):
+        con.executemany("UPDATE tags SET amountUsed = amountUsed + ? WHERE guildID = ? AND name = ?", updates)
+
+    """
+    Writes every pending count to the bot database in a single transaction.
+    If the bot database can't be accessed or the write fails, such as when the database is locked, the counts are kept and retried on the next flush.
+    Errors are never raised, since a flush can happen after a command has already responded to the user who invoked it.
+    """
+    @staticmethod
+    async def flush():
+        updates = TagUsageCounter.take_pending()
+        if (not updates):
+            return
+
+        try:
+            await Database.write(TagUsageCounter.apply_updates, updates)
+        except DatabaseUnavailableError:
+            TagUsageCounter.restore_pending(updates)
+        except sqlite3.Error as error:
+            TagUsageCounter.restore_pending(updates)
+            print(f"Unable to write {len(updates)} tag usage count(s) to bot database, they will be retried on the next flush: {error}")
+
+    """
+    Writes every pending count to the bot database without using the event loop. This is used when the bot is shutting down.
+    """
+    @staticmethod
+    def flush_now():
+        updates = TagUsageCounter.take_pending()
+        if (not updates):
+            return
+
+        with Database.connection() as con:
+            # Check if the connection is valid.
+            if (con is not None):
+                TagUsageCounter.apply_updates(con, updates)
+                con.commit()
+            else:
+                print(f"Unable to access bot database! {len(updates)} tag usage count(s) were lost.")
+
+# Pick up a changed flush threshold whenever the config is reloaded.
+Config.subscribe(TagUsageCounter.on_config_changed)
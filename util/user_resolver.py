@@ -0,0 +1,143 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from util.config_manager import Config
+
+from interactions.client.errors import HTTPException
+
+"""
+This class resolves user IDs into the names and avatars shown in listings, such as the tag and timezone listings.
+
+Every user ID needed by a listing is resolved in a single step. Users are looked up in a cache of names and avatar URLs first, then in the
+client's user cache, and the remaining users are fetched from Discord concurrently, with a limited amount of requests in flight at once.
+The cache holds a few small strings per user instead of a full user object, and is bounded by both its size and the age of its entries.
+Users that don't exist anymore are cached as well, so they aren't fetched again every time a listing is shown.
+
+A resolved user is a tuple containing the user's tag, display name and avatar URL.
+"""
+class UserResolver:
+    users = OrderedDict()
+
+    # The settings for the user cache and fetching, which are only worked out again after the config changes.
+    settings = None
+
+    """
+    Returns the settings for the user cache and fetching specified in the config.json file.
+
+    @return A dictionary containing the cache_size, cache_ttl and fetch_concurrency settings.
+    """
+    @staticmethod
+    def get_settings():
+        settings = UserResolver.settings
+        if (settings is None):
+            settings = UserResolver.load_settings(Config.get_config())
+            UserResolver.settings = settings
+        return settings
+
+    """
+    Works out the settings for the user cache and fetching from a config.
+
+    @param config The config to read the settings from.
+    @return A dictionary containing the cache_size, cache_ttl and fetch_concurrency settings.
+    """
+    @staticmethod
+    def load_settings(config: dict):
+        return {
+            "cache_size": max(0, config.get("user_name_cache_size", 5000)),
+            "cache_ttl": max(0, config.get("user_name_cache_ttl", 3600)),
+            "fetch_concurrency": max(1, config.get("user_fetch_concurrency", 4)),
+        }
+
+    """
+    Config subscriber which works out the settings for the user cache and fetching again when they change.
+
+    @param old_config The old config.
+    @param new_config The new config.
+    """
+    @staticmethod
+    def on_config_changed(old_config: dict, new_config: dict):
+        if (Config.changed(old_config, new_config, "user_name_cache_size", "user_name_cache_ttl", "user_fetch_concurrency")):
+            UserResolver.settings = UserResolver.load_settings(new_config)
+
+    """
+    Creates the resolved form of a user.
+
+    @param user The user object.
+    @return A tuple containing the user's tag, display name and avatar URL.
+    """
+    @staticmethod
+    def from_user(user):
+        return (user.tag, user.display_name, user.display_avatar.url)
+
+    """
+    Resolves a list of user IDs.
+
+    @param client The client the bot is running on.
+    @param user_ids The user IDs to resolve. Duplicate IDs are only resolved once.
+    @return A dictionary mapping every user ID to its resolved user, or to None if the user couldn't be found.
+    """
+    @staticmethod
+    async def resolve(client, user_ids):
+        settings = UserResolver.get_settings()
+        now = time.monotonic()
+        users = UserResolver.users
+        resolved = {}
+        missing = []
+
+        for user_id in dict.fromkeys(user_ids):
+            # Use the cached name and avatar of the user if they haven't expired.
+            cached = users.get(user_id)
+            if (cached is not None and now - cached[1] <= settings["cache_ttl"]):
+                users.move_to_end(user_id)
+                resolved[user_id] = cached[0]
+                continue
+
+            # Otherwise use the client's user cache, and fetch the user from Discord if it isn't there either.
+            user = client.get_user(user_id) if user_id.isdigit() else None
+            if (user is not None):
+                resolved[user_id] = UserResolver.from_user(user)
+                UserResolver.store(user_id, resolved[user_id], now, settings["cache_size"])
+            elif (user_id.isdigit()):
+                missing.append(user_id)
+            else:
+                resolved[user_id] = None
+
+        if (missing):
+            # Fetch the missing users concurrently, but limit how many requests are in flight at once.
+            semaphore = asyncio.Semaphore(settings["fetch_concurrency"])
+
+            async def fetch(user_id: str):
+                async with semaphore:
+                    try:
+                        user = await client.fetch_user(user_id)
+                    except HTTPException:
+                        # Don't cache users that couldn't be fetched because of an error, so they are fetched again next time.
+                        return (user_id, None, False)
+                    return (user_id, UserResolver.from_user(user) if user is not None else None, True)
+
+            for user_id, user, cacheable in await asyncio.gather(*(fetch(user_id) for user_id in missing)):
+                resolved[user_id] = user
+                if (cacheable):
+                    UserResolver.store(user_id, user, now, settings["cache_size"])
+
+        return resolved
+
+    """
+    Stores a resolved user in the cache, evicting the least recently used users if the cache is full.
+
+    @param user_id The user ID of the user.
+    @param user The resolved user, or None if the user doesn't exist.
+    @param now The time the user was resolved at, from time.monotonic().
+    @param cache_size The maximum amount of users in the cache.
+    """
+    @staticmethod
+    def store(user_id: str, user, now: float, cache_size: int):
+        users = UserResolver.users
+        users[user_id] = (user, now)
+        users.move_to_end(user_id)
+        while (len(users) > cache_size):
+            users.popitem(last=False)
+
+# Work out the settings for the user cache and fetching again whenever the config is reloaded.
+Config.subscribe(UserResolver.on_config_changed)